@@ -2,10 +2,12 @@
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
 from collections import defaultdict
+from contextlib import contextmanager
 import logging
 import re
 import json
 import copy
+import threading
 import traceback
 import unicodedata
 
@@ -22,9 +24,14 @@ except ImportError:
     from ..stubs import aggregator
 
 from ..config import is_affirmative
+from ..utils.cache import LRUCache
 from ..utils.common import ensure_bytes
+from ..utils.http import HTTPSessionPool
 from ..utils.proxy import config_proxy_skip
 
+# Guards the creation of the metric name caches of the check classes
+_metric_name_caches_lock = threading.Lock()
+
 
 class AgentCheck(object):
     """
@@ -32,6 +39,13 @@ class AgentCheck(object):
     """
     OK, WARNING, CRITICAL, UNKNOWN = (0, 1, 2, 3)
 
+    # Maximum number of results memoized by `normalize` and `convert_to_underscore_separated`,
+    # their caches are shared by all the instances of a check class, which may run concurrently
+    METRIC_NAME_CACHE_SIZE = 5000
+
+    # Maximum number of samples of a metric type held by a `batch()` block before they get flushed
+    METRIC_BATCH_SIZE = 1000
+
     def __init__(self, *args, **kwargs):
         """
         args: `name`, `init_config`, `agentConfig` (deprecated), `instances`
@@ -74,6 +88,13 @@ class AgentCheck(object):
 
         self.default_integration_http_timeout = float(self.agentConfig.get('default_integration_http_timeout', 9))
 
+        # keep-alive HTTP sessions, created on the first call to `get_http_session`
+        self._http_sessions = None
+
+        # metric type -> (names, values, tags, hostnames) accumulated while in a `batch()` block,
+        # per thread: the samples submitted by other threads are not part of the batch
+        self._metric_batch_state = threading.local()
+
         self._deprecations = {
             'increment': [
                 False,
@@ -102,6 +123,27 @@ class AgentCheck(object):
         skip = is_affirmative(instance.get('no_proxy', not self._use_agent_proxy))
         return config_proxy_skip(proxies, uri, skip)
 
+    def get_http_session(self, url, cert=None, verify=True):
+        """
+        Return a keep-alive `requests.Session` to query `url`, reused across runs for the same
+        endpoint and TLS settings so that connections and TLS handshakes are not redone every run.
+
+        The size of the pool can be tuned from `init_config` with `http_max_sessions`,
+        `http_pool_maxsize` and `http_session_idle_timeout`.
+
+        :param url: the url to query, only its scheme, host and port are used
+        :param cert: client certificate, as accepted by `requests`
+        :param verify: TLS verification setting, as accepted by `requests`
+        """
+        if self._http_sessions is None:
+            init_config = self.init_config or {}
+            self._http_sessions = HTTPSessionPool(
+                max_sessions=int(init_config.get('http_max_sessions', 10)),
+                pool_maxsize=int(init_config.get('http_pool_maxsize', 4)),
+                idle_timeout=float(init_config.get('http_session_idle_timeout', 300)),
+            )
+        return self._http_sessions.get(url, cert=cert, verify=verify)
+
     def _submit_metric(self, mtype, name, value, tags=None, hostname=None, device_name=None):
         if value is None:
             # ignore metric sample
@@ -111,8 +153,93 @@ class AgentCheck(object):
         if hostname is None:
             hostname = ""
 
+        if self._metric_batch is not None:
+            columns = self._metric_batch.get(mtype)
+            if columns is None:
+                columns = self._metric_batch[mtype] = ([], [], [], [])
+            columns[0].append(name)
+            columns[1].append(float(value))
+            columns[2].append(tags)
+            columns[3].append(hostname)
+            if len(columns[0]) >= self.METRIC_BATCH_SIZE:
+                self._flush_metrics(mtype, *self._metric_batch.pop(mtype))
+            return
+
         aggregator.submit_metric(self, self.check_id, mtype, name, float(value), tags, hostname)
 
+    @property
+    def _metric_batch(self):
+        return getattr(self._metric_batch_state, 'metrics', None)
+
+    @_metric_batch.setter
+    def _metric_batch(self, metric_batch):
+        self._metric_batch_state.metrics = metric_batch
+
+    def submit_metric_rows(self, mtype, rows):
+        """
+        Submit many samples of the given metric type at once
+
+        :param mtype: the metric type, one of the `aggregator` constants (e.g. `aggregator.GAUGE`)
+        :param rows: iterable of `(name, value, tags, hostname)` tuples, samples with a `None` value are ignored
+        """
+        names, values, all_tags, hostnames = [], [], [], []
+        for name, value, tags, hostname in rows:
+            if value is None:
+                continue
+            names.append(name)
+            values.append(float(value))
+            all_tags.append(self._normalize_tags_type(tags))
+            hostnames.append("" if hostname is None else hostname)
+
+        if self._metric_batch is not None:
+            columns = self._metric_batch.setdefault(mtype, ([], [], [], []))
+            for column, new_values in zip(columns, (names, values, all_tags, hostnames)):
+                column.extend(new_values)
+            if len(columns[0]) >= self.METRIC_BATCH_SIZE:
+                self._flush_metrics(mtype, *self._metric_batch.pop(mtype))
+        else:
+            self._flush_metrics(mtype, names, values, all_tags, hostnames)
+
+    @contextmanager
+    def batch(self):
+        """
+        Context manager accumulating the metrics submitted in its block, flushed to the aggregator
+        with a single call per metric type when the outermost block exits, or every `METRIC_BATCH_SIZE`
+        samples of a type:
+
+            with self.batch():
+                for name, value in stats:
+                    self.gauge(name, value, tags=tags)
+
+        A batch is local to the thread opening it: the metrics submitted meanwhile by other
+        threads are submitted right away. Nothing is batched if the aggregator has no
+        `submit_metrics` entry point, the metrics are then submitted one by one.
+        """
+        if self._metric_batch is not None or getattr(aggregator, 'submit_metrics', None) is None:
+            # nested block, the outermost one flushes
+            yield
+            return
+
+        self._metric_batch = {}
+        try:
+            yield
+        finally:
+            metric_batch, self._metric_batch = self._metric_batch, None
+            for mtype, columns in metric_batch.iteritems():
+                self._flush_metrics(mtype, *columns)
+
+    def _flush_metrics(self, mtype, names, values, tags, hostnames):
+        if not names:
+            return
+
+        submit_metrics = getattr(aggregator, 'submit_metrics', None)
+        if submit_metrics is not None:
+            submit_metrics(self, self.check_id, mtype, names, values, tags, hostnames)
+        else:
+            # the aggregator doesn't support batches, submit the samples one by one
+            for i, name in enumerate(names):
+                aggregator.submit_metric(self, self.check_id, mtype, name, values[i], tags[i], hostnames[i])
+
     def gauge(self, name, value, tags=None, hostname=None, device_name=None):
         self._submit_metric(aggregator.GAUGE, name, value, tags=tags, hostname=hostname, device_name=device_name)
 
@@ -185,6 +312,26 @@ class AgentCheck(object):
     def check(self, instance):
         raise NotImplementedError
 
+    @classmethod
+    def metric_name_caches(cls):
+        """
+        Return the caches memoizing `normalize` and `convert_to_underscore_separated` for this check class,
+        by function name. Their `hits`, `misses` and `hit_rate` tell how effective they are.
+        They must be accessed holding the `_metric_name_cache_lock` of the class.
+        """
+        caches = cls.__dict__.get('_metric_name_caches')
+        if caches is None:
+            with _metric_name_caches_lock:
+                caches = cls.__dict__.get('_metric_name_caches')
+                if caches is None:
+                    caches = {
+                        'normalize': LRUCache(cls.METRIC_NAME_CACHE_SIZE),
+                        'convert_to_underscore_separated': LRUCache(cls.METRIC_NAME_CACHE_SIZE),
+                    }
+                    cls._metric_name_cache_lock = threading.Lock()
+                    cls._metric_name_caches = caches
+        return caches
+
     def normalize(self, metric, prefix=None, fix_case=False):
         """
         Turn a metric into a well-formed metric name
@@ -194,6 +341,18 @@ class AgentCheck(object):
         :param fix_case A boolean, indicating whether to make sure that
                         the metric name returned is in underscore_case
         """
+        cache = self.metric_name_caches()['normalize']
+        # the types are part of the key, `str` and `unicode` names being equal but not normalized the same way
+        key = (type(metric), metric, type(prefix), prefix, fix_case)
+        with self._metric_name_cache_lock:
+            name = cache.get(key)
+        if name is None:
+            name = self._normalize(metric, prefix, fix_case)
+            with self._metric_name_cache_lock:
+                cache.set(key, name)
+        return name
+
+    def _normalize(self, metric, prefix, fix_case):
         if isinstance(metric, unicode):
             metric_name = unicodedata.normalize('NFKD', metric).encode('ascii', 'ignore')
         else:
@@ -229,6 +388,17 @@ class AgentCheck(object):
         Convert from CamelCase to camel_case
         And substitute illegal metric characters
         """
+        cache = self.metric_name_caches()['convert_to_underscore_separated']
+        key = (type(name), name)
+        with self._metric_name_cache_lock:
+            metric_name = cache.get(key)
+        if metric_name is None:
+            metric_name = self._convert_to_underscore_separated(name)
+            with self._metric_name_cache_lock:
+                cache.set(key, metric_name)
+        return metric_name
+
+    def _convert_to_underscore_separated(self, name):
         metric_name = self.FIRST_CAP_RE.sub(r'\1_\2', name)
         metric_name = self.ALL_CAP_RE.sub(r'\1_\2', metric_name).lower()
         metric_name = self.METRIC_REPLACEMENT.sub('_', metric_name)
@@ -54,20 +54,18 @@ class PrometheusScraper(PrometheusScraperMixin):
         self.check.monotonic_count('{}.{}'.format(self.NAMESPACE, metric_name), val, _tags, hostname=hostname)
 
     def _metric_tags(self, metric_name, val, metric, custom_tags=None, hostname=None):
-        _tags = []
-        if custom_tags is not None:
-            _tags += custom_tags
-        for label in metric.label:
-            if self.exclude_labels is None or label.name not in self.exclude_labels:
-                tag_name = label.name
-                if self.labels_mapper is not None and label.name in self.labels_mapper:
-                    tag_name = self.labels_mapper[label.name]
-                _tags.append('{}:{}'.format(tag_name, label.value))
+        _tags = self._get_label_tags(metric, custom_tags)
         return self._finalize_tags_to_submit(_tags, metric_name, val, metric, custom_tags=custom_tags, hostname=hostname)
 
     def _submit_service_check(self, *args, **kwargs):
         self.check.service_check(*args, **kwargs)
 
+    def _get_http_session(self, endpoint, cert=None, verify=True):
+        return self.check.get_http_session(endpoint, cert=cert, verify=verify)
+
+    def _submission_batch(self):
+        return self.check.batch()
+
 
 class GenericPrometheusCheck(AgentCheck):
     """
@@ -165,6 +163,12 @@ class GenericPrometheusCheck(AgentCheck):
         scraper.ssl_private_key = instance.get("ssl_private_key", default_instance.get("ssl_private_key", None))
         scraper.ssl_ca_cert = instance.get("ssl_ca_cert", default_instance.get("ssl_ca_cert", None))
 
+        scraper.keep_alive = instance.get("keep_alive", default_instance.get("keep_alive", False))
+        scraper.stream_response = instance.get("stream_response", default_instance.get("stream_response", False))
+        scraper.conditional_scrape = instance.get("conditional_scrape", default_instance.get("conditional_scrape", False))
+        # Only the mapped metrics are submitted, there's no need to decode the other families
+        scraper.skip_unwanted_families = True
+
         scraper.set_prometheus_timeout(instance, default_instance.get("prometheus_timeout", 10))
 
         self.scrapers_map[endpoint] = scraper
@@ -2,16 +2,21 @@
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
 
-from fnmatch import fnmatchcase
+from fnmatch import translate
+import hashlib
 import logging
+import re
 import requests
 from urllib3 import disable_warnings
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 from collections import defaultdict
-from google.protobuf.internal.decoder import _DecodeVarint32  # pylint: disable=E0611,E0401
+from itertools import count
+from google.protobuf.internal.decoder import _DecodeVarint, _DecodeVarint32  # pylint: disable=E0611,E0401
 from ...utils.prometheus import metrics_pb2
 from math import isnan, isinf
 from prometheus_client.parser import text_fd_to_metric_families
+from six.moves import intern
+from ...utils.cache import LRUCache
 
 # toolkit
 from .. import AgentCheck
@@ -30,6 +35,80 @@ class UnknownFormatError(TypeError):
     pass
 
 
+# versions of the settings tracked with `_VersionedDict` and `_VersionedList`, unique across the settings
+_config_versions = count(1)
+
+
+def _modifies(method):
+    def modify(self, *args, **kwargs):
+        self.version = next(_config_versions)
+        return method(self, *args, **kwargs)
+    modify.__name__ = method.__name__
+    return modify
+
+
+class _VersionedDict(dict):
+    """
+    dict whose `version` changes whenever it is modified, to invalidate what is computed from it
+    """
+    def __init__(self, *args, **kwargs):
+        super(_VersionedDict, self).__init__(*args, **kwargs)
+        self.version = next(_config_versions)
+
+    __setitem__ = _modifies(dict.__setitem__)
+    __delitem__ = _modifies(dict.__delitem__)
+    clear = _modifies(dict.clear)
+    pop = _modifies(dict.pop)
+    popitem = _modifies(dict.popitem)
+    setdefault = _modifies(dict.setdefault)
+    update = _modifies(dict.update)
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+
+class _VersionedList(list):
+    """
+    list whose `version` changes whenever it is modified, to invalidate what is computed from it
+    """
+    def __init__(self, *args, **kwargs):
+        super(_VersionedList, self).__init__(*args, **kwargs)
+        self.version = next(_config_versions)
+
+    __setitem__ = _modifies(list.__setitem__)
+    __delitem__ = _modifies(list.__delitem__)
+    if hasattr(list, '__setslice__'):
+        # Python 2 only
+        __setslice__ = _modifies(list.__setslice__)
+        __delslice__ = _modifies(list.__delslice__)
+    __iadd__ = _modifies(list.__iadd__)
+    __imul__ = _modifies(list.__imul__)
+    append = _modifies(list.append)
+    extend = _modifies(list.extend)
+    insert = _modifies(list.insert)
+    pop = _modifies(list.pop)
+    remove = _modifies(list.remove)
+
+    def __reduce__(self):
+        return self.__class__, (list(self),)
+
+
+def _versioned(value):
+    """
+    Copy the plain dicts and lists of the settings into their versioned counterpart,
+    other values are kept as is and their modifications are not tracked
+    """
+    if type(value) is dict:
+        return _VersionedDict(value)
+    if type(value) is list:
+        return _VersionedList(value)
+    return value
+
+
+def _config_version(*settings):
+    return tuple(getattr(setting, 'version', None) for setting in settings)
+
+
 class PrometheusScraperMixin(object):
     # pylint: disable=E1101
     # This class is not supposed to be used by itself, it provides scraping behavior but
@@ -38,12 +117,31 @@ class PrometheusScraperMixin(object):
     UNWANTED_LABELS = ["le", "quantile"]  # are specifics keys for prometheus itself
     REQUESTS_CHUNK_SIZE = 1024 * 10  # use 10kb as chunk size when using the Stream feature in requests.get
 
+    # sample names allowed in a family of the text format, see `text_fd_to_metric_families`
+    TEXT_FAMILY_SUFFIXES = {
+        'summary': ['_count', '_sum', ''],
+        'histogram': ['_count', '_sum', '_bucket'],
+    }
+    SAMPLE_NAME_RE = re.compile(r'[^{\s]+')
+
+    # how a metric name is handled, see `_match_metric_name`
+    METRIC_IGNORED, METRIC_MAPPED, METRIC_WILDCARD, METRIC_UNMAPPED = range(4)
+
+    # initial and maximum number of series whose tags are kept between runs, the cache grows
+    # when it is too small for the series of the payloads, see `_resize_label_tags_cache`
+    LABEL_TAGS_CACHE_SIZE = 10000
+    LABEL_TAGS_CACHE_MAX_SIZE = 200000
+
     def __init__(self, *args, **kwargs):
         super(PrometheusScraperMixin, self).__init__(*args, **kwargs)
 
         # The scraper needs its own logger
         self.log = logging.getLogger(__name__)
 
+        # `label_tags_cache` holds the encoded tags of the series seen during the last runs,
+        # see `_get_label_tags`. Its `hits` and `misses` counters tell how effective it is.
+        self.label_tags_cache = LRUCache(self.LABEL_TAGS_CACHE_SIZE)
+
         # message.type is the index in this array
         # see: https://github.com/prometheus/client_model/blob/master/ruby/lib/prometheus/client/model/metrics.pb.rb
         self.METRIC_TYPES = ['counter', 'gauge', 'summary', 'untyped', 'histogram']
@@ -61,8 +159,11 @@ class PrometheusScraperMixin(object):
         # `rate_metrics` contains the metrics that should be sent as rates
         self.rate_metrics = []
 
-        # `_metrics_wildcards` holds the potential wildcards to match for metrics
-        self._metrics_wildcards = None
+        # `_metric_name_cache` memoizes the outcome of `_match_metric_name` for each metric name,
+        # it's flushed whenever `metrics_mapper` or `ignore_metrics` is set or modified in place
+        self._metric_name_cache = {}
+        # `_metrics_wildcards_re` is the single regex matching any of the wildcards of `metrics_mapper`
+        self._metrics_wildcards_re = None
 
         # `prometheus_metrics_prefix` allows to specify a prefix that all
         # prometheus metrics should have. This can be used when the prometheus
@@ -150,6 +251,133 @@ class PrometheusScraperMixin(object):
         # Timeout used during the network request
         self.prometheus_timeout = 10
 
+        # `keep_alive` reuses the connection to the endpoint across runs, see `AgentCheck.get_http_session`
+        self.keep_alive = False
+
+        # `conditional_scrape` sends the `ETag`/`Last-Modified` validators of the previous payload
+        # and detects unchanged payloads from their hash (unless the response is streamed).
+        # An unchanged payload isn't parsed again: the families it produced last time and submitted
+        # as gauges are replayed, or nothing is processed at all if `skip_unchanged_payload` is set.
+        self.conditional_scrape = False
+        self.skip_unchanged_payload = False
+        # `_scrape_cache` holds, per endpoint, the validators, hash and serialized families of the last payload
+        self._scrape_cache = {}
+
+        # `stream_response` reads the payload from the socket as it gets parsed instead of
+        # loading it in memory first, the text format is then processed family by family
+        self.stream_response = False
+
+        # `batch_submission` submits the samples of the payload in batches of `METRIC_BATCH_SIZE`
+        # samples, see `AgentCheck.batch`. Off by default: the samples of a batch are held in memory
+        # until it is flushed, and the Agent aggregator has no batch entry point yet
+        self.batch_submission = False
+
+        # `skip_unwanted_families` drops, before their samples get decoded, the families
+        # `process_metric` would not handle: neither mapped, matched by a wildcard,
+        # targeted by a label join nor handled by a method of the check
+        self.skip_unwanted_families = False
+
+    @property
+    def metrics_mapper(self):
+        return self._metrics_mapper
+
+    @metrics_mapper.setter
+    def metrics_mapper(self, value):
+        # versioned copy, the decisions of `_match_metric_name` are invalidated when it's modified in place
+        self._metrics_mapper = _versioned(value)
+        self._reset_metric_name_cache()
+
+    @property
+    def ignore_metrics(self):
+        return self._ignore_metrics
+
+    @ignore_metrics.setter
+    def ignore_metrics(self, value):
+        self._ignore_metrics = _versioned(value)
+        self._reset_metric_name_cache()
+
+    @property
+    def labels_mapper(self):
+        return self._labels_mapper
+
+    @labels_mapper.setter
+    def labels_mapper(self, value):
+        if value != getattr(self, '_labels_mapper', None):
+            self.label_tags_cache.clear()
+        # versioned copy, the tags cached with the previous mapping are not used once it's modified in place
+        self._labels_mapper = _versioned(value)
+
+    @property
+    def exclude_labels(self):
+        return self._exclude_labels
+
+    @exclude_labels.setter
+    def exclude_labels(self, value):
+        if value != getattr(self, '_exclude_labels', None):
+            self.label_tags_cache.clear()
+        self._exclude_labels = _versioned(value)
+
+    def _reset_metric_name_cache(self):
+        """
+        Forget the compiled wildcards and the memoized decisions, called whenever
+        `metrics_mapper` or `ignore_metrics` is set or modified in place
+        """
+        self._metric_name_cache = {}
+        self._metric_name_cache_version = _config_version(
+            getattr(self, '_metrics_mapper', None), getattr(self, '_ignore_metrics', None))
+        self._metrics_wildcards_re = None
+        # the families cached for unchanged payloads were filtered with the previous settings
+        self._scrape_cache = {}
+
+    def _compile_metrics_wildcards(self):
+        """
+        Compile all the wildcards of `metrics_mapper` into a single regex, None if there are none
+        """
+        patterns = []
+        for wildcard in self.metrics_mapper:
+            if '*' in wildcard:
+                pattern = translate(wildcard)
+                # Python 2 appends the flags at the end of the pattern, they can't be nested in a group
+                if pattern.endswith('(?ms)'):
+                    pattern = pattern[:-len('(?ms)')]
+                patterns.append('(?:{})'.format(pattern))
+        if patterns:
+            return re.compile('|'.join(patterns), re.M | re.S)
+        return None
+
+    def _match_metric_name(self, name):
+        """
+        Return a `(match_type, metric_name)` tuple describing how the family `name` is handled:
+            - METRIC_IGNORED: listed in `ignore_metrics`
+            - METRIC_MAPPED: listed in `metrics_mapper`, `metric_name` is the datadog name
+            - METRIC_WILDCARD: matching one of the wildcards of `metrics_mapper`
+            - METRIC_UNMAPPED: none of the above
+
+        The result is memoized until `metrics_mapper` or `ignore_metrics` change.
+        """
+        if _config_version(self._metrics_mapper, self._ignore_metrics) != self._metric_name_cache_version:
+            self._reset_metric_name_cache()
+
+        try:
+            return self._metric_name_cache[name]
+        except KeyError:
+            pass
+
+        if self._metrics_wildcards_re is None:
+            self._metrics_wildcards_re = self._compile_metrics_wildcards() or False
+
+        if name in self.ignore_metrics:
+            result = (self.METRIC_IGNORED, None)
+        elif name in self.metrics_mapper:
+            result = (self.METRIC_MAPPED, self.metrics_mapper[name])
+        elif self._metrics_wildcards_re and self._metrics_wildcards_re.match(name):
+            result = (self.METRIC_WILDCARD, name)
+        else:
+            result = (self.METRIC_UNMAPPED, None)
+
+        self._metric_name_cache[name] = result
+        return result
+
     def parse_metric_family(self, response):
         """
         Parse the MetricFamily from a valid requests.Response object to provide a MetricFamily object (see [0])
@@ -159,6 +387,9 @@ class PrometheusScraperMixin(object):
         The protobuf format directly parse the response.content property searching for Prometheus messages of type
         MetricFamily [0] delimited by a varint32 [1] when the content-type is a `application/vnd.google.protobuf`.
 
+        When `skip_unwanted_families` is set, only the name of the families `process_metric` would
+        drop is read (protobuf) or their sample lines are discarded before being parsed (text).
+
         [0] https://github.com/prometheus/client_model/blob/086fe7ca28bde6cec2acd5223423c1475a362858/metrics.proto#L76-%20%20L81
         [1] https://developers.google.com/protocol-buffers/docs/reference/java/com/google/protobuf/AbstractMessageLite#writeDelimitedTo(java.io.OutputStream)
 
@@ -167,12 +398,21 @@ class PrometheusScraperMixin(object):
         """
         if 'application/vnd.google.protobuf' in response.headers['Content-Type']:
             n = 0
-            buf = response.content
+            buf = memoryview(response.content)
             while n < len(buf):
                 msg_len, new_pos = _DecodeVarint32(buf, n)
                 n = new_pos
-                msg_buf = buf[n:n+msg_len]
-                n += msg_len
+                msg_end = n + msg_len
+
+                if self.skip_unwanted_families:
+                    # only the name is decoded for the families that would be dropped anyway
+                    name = self._peek_metric_family_name(buf, n, msg_end)
+                    if name is not None and not self._is_wanted_family(self.remove_metric_prefix(name)):
+                        n = msg_end
+                        continue
+
+                msg_buf = buf[n:msg_end].tobytes()
+                n = msg_end
 
                 message = metrics_pb2.MetricFamily()
                 message.ParseFromString(msg_buf)
@@ -188,18 +428,21 @@ class PrometheusScraperMixin(object):
                 yield message
 
         elif 'text/plain' in response.headers['Content-Type']:
-            messages = defaultdict(list)  # map with the name of the element (before the labels)
-            # and the list of occurrences with labels and values
+            lines = response.iter_lines(chunk_size=self.REQUESTS_CHUNK_SIZE)
+            if self.skip_unwanted_families:
+                lines = self._filter_text_lines(lines)
 
-            obj_map = {}  # map of the types of each metrics
-            obj_help = {}  # help for the metrics
-            for metric in text_fd_to_metric_families(response.iter_lines(chunk_size=self.REQUESTS_CHUNK_SIZE)):
+            # `text_fd_to_metric_families` yields a family as soon as its last sample is read,
+            # it is converted right away so only one family is held in memory at a time
+            for metric in text_fd_to_metric_families(lines):
                 metric.name = self.remove_metric_prefix(metric.name)
                 metric_name = "%s_bucket" % metric.name if metric.type == "histogram" else metric.name
                 metric_type = self.type_overrides.get(metric_name, metric.type)
                 if metric_type == "untyped" or metric_type not in self.METRIC_TYPES:
                     continue
 
+                messages = defaultdict(list)  # map with the name of the element (before the labels)
+                # and the list of occurrences with labels and values
                 for sample in metric.samples:
                     if (sample[0].endswith("_sum") or sample[0].endswith("_count")) and \
                             metric_type in ["histogram", "summary"]:
@@ -207,16 +450,90 @@ class PrometheusScraperMixin(object):
                     else:
                         messages[metric_name].append({"labels": sample[1], 'value': sample[2]})
 
-                obj_map[metric.name] = metric_type
-                obj_help[metric.name] = metric.documentation
-
-            for _m in obj_map:
-                if _m in messages or (obj_map[_m] == 'histogram' and ('{}_bucket'.format(_m) in messages)):
-                    yield self._extract_metric_from_map(_m, messages, obj_map, obj_help)
+                obj_map = {metric.name: metric_type}  # map of the types of each metrics
+                obj_help = {metric.name: metric.documentation}  # help for the metrics
+                if metric_name in messages:
+                    yield self._extract_metric_from_map(metric.name, messages, obj_map, obj_help)
         else:
             raise UnknownFormatError('Unsupported content-type provided: {}'.format(
                 response.headers['Content-Type']))
 
+    @staticmethod
+    def _peek_metric_family_name(buf, pos, end):
+        """
+        Return the `name` (field 1) of the MetricFamily message encoded in buf[pos:end],
+        skipping over the other fields without decoding them.
+        Return None if the message has no name or can't be walked.
+
+        :param buf: memoryview of the payload
+        """
+        while pos < end:
+            tag, pos = _DecodeVarint32(buf, pos)
+            field_number, wire_type = tag >> 3, tag & 0x7
+            if wire_type == 2:  # length-delimited
+                length, pos = _DecodeVarint32(buf, pos)
+                if field_number == 1:
+                    return buf[pos:pos + length].tobytes().decode('utf-8')
+                pos += length
+            elif wire_type == 0:  # varint
+                _, pos = _DecodeVarint(buf, pos)
+            elif wire_type == 1:  # 64-bit
+                pos += 8
+            elif wire_type == 5:  # 32-bit
+                pos += 4
+            else:
+                return None
+        return None
+
+    def _filter_text_lines(self, lines):
+        """
+        Filter the lines of a text format payload, dropping the samples of the families
+        `_is_wanted_family` rejects before the parser decodes their labels and values.
+
+        Comment lines are always kept so the parser still delimits the families.
+        """
+        family = ''
+        allowed_names = ()
+        wanted = True
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+
+            if line[0] == '#':
+                parts = line.split(None, 3)
+                if len(parts) > 2 and parts[1] in ('HELP', 'TYPE'):
+                    if parts[2] != family:
+                        family = parts[2]
+                        allowed_names = (family,)
+                        wanted = self._is_wanted_family(self.remove_metric_prefix(family))
+                    if parts[1] == 'TYPE' and len(parts) > 3:
+                        allowed_names = tuple(family + s for s in self.TEXT_FAMILY_SUFFIXES.get(parts[3], ['']))
+                yield line
+                continue
+
+            sample_name = self.SAMPLE_NAME_RE.match(line).group(0)
+            if sample_name in allowed_names:
+                if wanted:
+                    yield line
+            else:
+                # untyped sample outside of any family, the parser yields it as a singleton
+                family = ''
+                allowed_names = ()
+                if self._is_wanted_family(self.remove_metric_prefix(sample_name)):
+                    yield line
+
+    def _is_wanted_family(self, name):
+        """
+        Return whether `process_metric` would do anything with the family `name`
+        """
+        if name in self.label_joins:
+            return True
+        match_type = self._match_metric_name(name)[0]
+        if match_type == self.METRIC_UNMAPPED:
+            return hasattr(self, name)
+        return match_type != self.METRIC_IGNORED
+
     def remove_metric_prefix(self, metric):
         return metric[len(self.prometheus_metrics_prefix):] if metric.startswith(self.prometheus_metrics_prefix) else metric
 
@@ -241,86 +558,114 @@ class PrometheusScraperMixin(object):
 
         raise AttributeError("cannot find expected labels for metric %s with suffix %s" % (metric_name, metric_suffix))
 
+    @staticmethod
+    def _label_set_key(labels):
+        """
+        Hashable key identifying a series of a summary or histogram, i.e. its labels
+        without the `le` and `quantile` ones that are specific to each bucket/quantile
+        """
+        return frozenset((k, v) for k, v in labels.iteritems() if k not in PrometheusScraperMixin.UNWANTED_LABELS)
+
+    def _index_values_by_labels(self, messages, metric_name):
+        """
+        Index the values of the `<name>_count` or `<name>_sum` samples by label set,
+        keeping the first value found for a given label set.
+        Return None if no such samples were seen.
+        """
+        if metric_name not in messages:
+            return None
+        index = {}
+        for elt in messages[metric_name]:
+            key = self._label_set_key(elt["labels"])
+            if key not in index:
+                index[key] = float(elt["value"])
+        return index
+
+    @staticmethod
+    def _get_indexed_value(index, label_key, _m, metric_suffix):
+        try:
+            return index[label_key]
+        except KeyError:
+            raise AttributeError("cannot find expected labels for metric {}_{} with suffix {}".format(
+                _m, metric_suffix, metric_suffix))
+
     def _extract_metric_from_map(self, _m, messages, obj_map, obj_help):
         """
         Extracts MetricFamily objects from the maps generated by parsing the
         strings in _extract_metrics_from_string
+
+        Quantiles and buckets of the same series are grouped through a hash index
+        on their label set, so that a family is assembled in O(samples).
         """
         _obj = metrics_pb2.MetricFamily()
         _obj.name = _m
-        _obj.type = self.METRIC_TYPES.index(obj_map[_m])
+        metric_type = obj_map[_m]
+        _obj.type = self.METRIC_TYPES.index(metric_type)
         if _m in obj_help:
             _obj.help = obj_help[_m]
         # trick for histograms
         _newlbl = _m
-        if obj_map[_m] == 'histogram':
+        if metric_type == 'histogram':
             _newlbl = '{}_bucket'.format(_m)
+
+        grouped = metric_type in ['summary', 'histogram']
+        if grouped:
+            metrics_by_labels = {}
+            counts = self._index_values_by_labels(messages, '{}_count'.format(_m))
+            sums = self._index_values_by_labels(messages, '{}_sum'.format(_m))
+
         # Loop through the array of metrics ({labels, value}) built earlier
         for _metric in messages[_newlbl]:
             # in the case of quantiles and buckets, they need to be grouped by labels
-            if obj_map[_m] in ['summary', 'histogram'] and len(_obj.metric) > 0:
-                _label_exists = False
-                _metric_minus = {k:v for k,v in _metric['labels'].items() if k not in ['quantile', 'le']}
-                _metric_idx = 0
-                for mls in _obj.metric:
-                    _tmp_lbl = {idx.name:idx.value for idx in mls.label}
-                    if _metric_minus == _tmp_lbl:
-                        _label_exists = True
-                        break
-                    _metric_idx = _metric_idx + 1
-                if _label_exists:
-                    _g = _obj.metric[_metric_idx]
-                else:
+            if grouped:
+                label_key = self._label_set_key(_metric['labels'])
+                _g = metrics_by_labels.get(label_key)
+                is_new = _g is None
+                if is_new:
                     _g = _obj.metric.add()
+                    metrics_by_labels[label_key] = _g
+                    if metric_type == 'summary':
+                        _sample = _g.summary
+                    else:
+                        _sample = _g.histogram
+                    if counts is not None:
+                        _sample.sample_count = long(self._get_indexed_value(counts, label_key, _m, 'count'))
+                    if sums is not None:
+                        _sample.sample_sum = self._get_indexed_value(sums, label_key, _m, 'sum')
             else:
+                is_new = True
                 _g = _obj.metric.add()
-            if obj_map[_m] == 'counter':
-                _g.counter.value = float(_metric['value'])
-            elif obj_map[_m] == 'gauge':
-                _g.gauge.value = float(_metric['value'])
-            elif obj_map[_m] == 'summary':
-                if '{}_count'.format(_m) in messages:
-                    _g.summary.sample_count = long(self.get_metric_value_by_labels(messages, _metric, _m, 'count'))
-                if '{}_sum'.format(_m) in messages:
-                    _g.summary.sample_sum = self.get_metric_value_by_labels(messages, _metric, _m, 'sum')
+                if metric_type == 'counter':
+                    _g.counter.value = float(_metric['value'])
+                elif metric_type == 'gauge':
+                    _g.gauge.value = float(_metric['value'])
             # TODO: see what can be done with the untyped metrics
-            elif obj_map[_m] == 'histogram':
-                if '{}_count'.format(_m) in messages:
-                    _g.histogram.sample_count = long(self.get_metric_value_by_labels(messages, _metric, _m, 'count'))
-                if '{}_sum'.format(_m) in messages:
-                    _g.histogram.sample_sum = self.get_metric_value_by_labels(messages, _metric, _m, 'sum')
-            # last_metric = len(_obj.metric) - 1
-            # if last_metric >= 0:
-            for lbl in _metric['labels']:
+
+            for lbl, lbl_value in _metric['labels'].iteritems():
                 # In the string format, the quantiles are in the labels
                 if lbl == 'quantile':
-                    # _q = _obj.metric[last_metric].summary.quantile.add()
                     _q = _g.summary.quantile.add()
-                    _q.quantile = float(_metric['labels'][lbl])
+                    _q.quantile = float(lbl_value)
                     _q.value = float(_metric['value'])
                 # The upper_bounds are stored as "le" labels on string format
-                elif obj_map[_m] == 'histogram' and lbl == 'le':
-                    # _q = _obj.metric[last_metric].histogram.bucket.add()
+                elif metric_type == 'histogram' and lbl == 'le':
                     _q = _g.histogram.bucket.add()
-                    _q.upper_bound = float(_metric['labels'][lbl])
+                    _q.upper_bound = float(lbl_value)
                     _q.cumulative_count = long(float(_metric['value']))
-                else:
-                    # labels deduplication
-                    is_in_labels = False
-                    for _existing_lbl in _g.label:
-                        if lbl == _existing_lbl.name:
-                            is_in_labels = True
-                    if not is_in_labels:
-                        _l = _g.label.add()
-                        _l.name = lbl
-                        _l.value = _metric['labels'][lbl]
+                # the other labels are the same for all the samples of a series
+                elif is_new:
+                    _l = _g.label.add()
+                    _l.name = lbl
+                    _l.value = lbl_value
         return _obj
 
-    def scrape_metrics(self, endpoint):
+    def scrape_metrics(self, endpoint, send_monotonic_counter=False):
         """
         Poll the data from prometheus and return the metrics as a generator.
+        `send_monotonic_counter` tells how the counters get submitted, see `_replays_family`.
         """
         response = self.poll(endpoint)
+        hits, misses = self.label_tags_cache.hits, self.label_tags_cache.misses
         try:
             # no dry run if no label joins
             if not self.label_joins:
@@ -330,9 +675,19 @@ class PrometheusScraperMixin(object):
                 for metric, val in self.label_joins.iteritems():
                     self._watched_labels.add(val['label_to_match'])
 
-            for metric in self.parse_metric_family(response):
+            if self.conditional_scrape:
+                families = self._parse_or_replay(endpoint, response, send_monotonic_counter)
+                if families is None:
+                    self.log.debug("Payload of {} unchanged, skipping it".format(endpoint))
+                    return
+            else:
+                families = self.parse_metric_family(response)
+
+            for metric in families:
                 yield metric
 
+            self._resize_label_tags_cache(self.label_tags_cache.hits - hits, self.label_tags_cache.misses - misses)
+
             # Set dry run off
             self._dry_run = False
             # Garbage collect unused mapping and reset active labels
@@ -344,6 +699,90 @@ class PrometheusScraperMixin(object):
         finally:
             response.close()
 
+    def _resize_label_tags_cache(self, hits, misses):
+        """
+        Double the size of `label_tags_cache`, up to `LABEL_TAGS_CACHE_MAX_SIZE`, when it is full
+        and mostly missed during a scrape: the series of the payloads don't fit in it, and as they
+        are looked up in the same order every run, they would evict each other before any hit.
+        """
+        cache = self.label_tags_cache
+        if misses > hits and len(cache) >= cache.maxsize and cache.maxsize < self.LABEL_TAGS_CACHE_MAX_SIZE:
+            cache.maxsize = min(cache.maxsize * 2, self.LABEL_TAGS_CACHE_MAX_SIZE)
+            self.log.debug("Growing the label tags cache to {} series".format(cache.maxsize))
+
+    def _parse_or_replay(self, endpoint, response, send_monotonic_counter=False):
+        """
+        Return the families of the payload, parsed, or replayed from the previous run if the endpoint
+        answered `304 Not Modified` or sent the exact same payload, see `_record_families`.
+        Return None if the payload is unchanged and `skip_unchanged_payload` is set.
+        """
+        previous = self._scrape_cache.get(endpoint)
+
+        digest = None
+        if not self.stream_response:
+            digest = hashlib.sha1(response.content).digest()
+
+        if previous is not None and (response.status_code == 304 or (digest is not None and digest == previous['digest'])):
+            if self.skip_unchanged_payload:
+                return None
+            return self._replay_families(previous['families'])
+
+        state = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'digest': digest,
+            'families': None if self.skip_unchanged_payload else [],
+        }
+        return self._record_families(endpoint, state, self.parse_metric_family(response), send_monotonic_counter)
+
+    def _record_families(self, endpoint, state, families, send_monotonic_counter=False):
+        """
+        Yield the families while keeping a serialized copy of the ones to replay, before they get
+        modified downstream. The state is only saved once the whole payload was parsed successfully.
+        """
+        self._scrape_cache.pop(endpoint, None)
+        for message in families:
+            if state['families'] is not None and self._replays_family(message, send_monotonic_counter):
+                state['families'].append(message.SerializeToString())
+            yield message
+        self._scrape_cache[endpoint] = state
+
+    def _replays_family(self, message, send_monotonic_counter=False):
+        """
+        Return whether the family must be replayed when the payload is unchanged: the families
+        submitted as gauges, which would disappear otherwise, and the sources of the label joins,
+        which must be processed every run to keep their labels. The monotonic counts and the rates
+        of an unchanged family have nothing new to report.
+        """
+        if message.name in self.label_joins:
+            return True
+        if message.type == 0:
+            return not send_monotonic_counter
+        if message.type in (2, 4):
+            # summaries and histograms are submitted as gauges, see `_submit`
+            return True
+        return message.name not in self.rate_metrics
+
+    @staticmethod
+    def _replay_families(serialized_families):
+        for msg_buf in serialized_families:
+            message = metrics_pb2.MetricFamily()
+            message.ParseFromString(msg_buf)
+            yield message
+
+    def _scrape_validators(self, endpoint):
+        """
+        Return the conditional request headers matching the last payload received from `endpoint`
+        """
+        headers = {}
+        previous = self._scrape_cache.get(endpoint)
+        if previous is not None:
+            if previous['etag']:
+                headers['If-None-Match'] = previous['etag']
+            if previous['last_modified']:
+                headers['If-Modified-Since'] = previous['last_modified']
+        return headers
+
     def process(self, endpoint, **kwargs):
         """
         Polls the data from prometheus and pushes them as gauges
@@ -356,8 +795,14 @@ class PrometheusScraperMixin(object):
         if instance:
             kwargs['custom_tags'] = instance.get('tags', [])
 
-        for metric in self.scrape_metrics(endpoint):
-            self.process_metric(metric, **kwargs)
+        families = self.scrape_metrics(endpoint, kwargs.get('send_monotonic_counter', False))
+        if self.batch_submission:
+            with self._submission_batch():
+                for metric in families:
+                    self.process_metric(metric, **kwargs)
+        else:
+            for metric in families:
+                self.process_metric(metric, **kwargs)
 
     def store_labels(self, message):
         # If targeted metric, store labels
@@ -408,7 +853,8 @@ class PrometheusScraperMixin(object):
         # If targeted metric, store labels
         self.store_labels(message)
 
-        if message.name in self.ignore_metrics:
+        match_type, metric_name = self._match_metric_name(message.name)
+        if match_type == self.METRIC_IGNORED:
             return  # Ignore the metric
 
         # Filter metric to see if we can enrich with joined labels
@@ -421,24 +867,18 @@ class PrometheusScraperMixin(object):
 
         try:
             if not self._dry_run:
-                try:
-                    self._submit(self.metrics_mapper[message.name], message, send_histograms_buckets, send_monotonic_counter, custom_tags)
-                except KeyError:
-                    if not ignore_unmapped:
-                        # call magic method (non-generic check)
-                        handler = getattr(self, message.name)  # Lookup will throw AttributeError if not found
-                        try:
-                            handler(message, **kwargs)
-                        except Exception as err:
-                            self.log.warning("Error handling metric: {} - error: {}".format(message.name, err))
-                    else:
-                        # build the wildcard list if first pass
-                        if self._metrics_wildcards is None:
-                            self._metrics_wildcards = [x for x in self.metrics_mapper.keys() if '*' in x]
-                        # try matching wildcard (generic check)
-                        for wildcard in self._metrics_wildcards:
-                            if fnmatchcase(message.name, wildcard):
-                                self._submit(message.name, message, send_histograms_buckets, send_monotonic_counter, custom_tags)
+                if match_type == self.METRIC_MAPPED:
+                    self._submit(metric_name, message, send_histograms_buckets, send_monotonic_counter, custom_tags)
+                elif not ignore_unmapped:
+                    # call magic method (non-generic check)
+                    handler = getattr(self, message.name)  # Lookup will throw AttributeError if not found
+                    try:
+                        handler(message, **kwargs)
+                    except Exception as err:
+                        self.log.warning("Error handling metric: {} - error: {}".format(message.name, err))
+                elif match_type == self.METRIC_WILDCARD:
+                    # matched a wildcard (generic check)
+                    self._submit(metric_name, message, send_histograms_buckets, send_monotonic_counter, custom_tags)
 
         except AttributeError as err:
             self.log.debug("Unable to handle metric: {} - error: {}".format(message.name, err))
@@ -469,6 +909,8 @@ class PrometheusScraperMixin(object):
                                 'proto=io.prometheus.client.MetricFamily; ' \
                                 'encoding=delimited'
         headers.update(self.extra_headers)
+        if self.conditional_scrape:
+            headers.update(self._scrape_validators(endpoint))
         cert = None
         if isinstance(self.ssl_cert, basestring):
             cert = self.ssl_cert
@@ -481,7 +923,11 @@ class PrometheusScraperMixin(object):
             disable_warnings(InsecureRequestWarning)
             verify = False
         try:
-            response = requests.get(endpoint, headers=headers, stream=False, timeout=self.prometheus_timeout, cert=cert, verify=verify)
+            if self.keep_alive:
+                http = self._get_http_session(endpoint, cert, verify)
+            else:
+                http = requests
+            response = http.get(endpoint, headers=headers, stream=self.stream_response, timeout=self.prometheus_timeout, cert=cert, verify=verify)
         except requests.exceptions.SSLError:
             self.log.error("Invalid SSL settings for requesting {} endpoint".format(endpoint))
             raise
@@ -565,6 +1011,52 @@ class PrometheusScraperMixin(object):
 
         return hostname
 
+    def _get_label_tags(self, metric, custom_tags=None):
+        """
+        Return the `custom_tags` followed by the tags built from the labels of `metric`,
+        according to `labels_mapper` and `exclude_labels`, all encoded as bytes.
+
+        Series are mostly the same from one run to the other: the tags are cached by label set,
+        custom tags and version of `labels_mapper` and `exclude_labels`, so they are only formatted
+        and encoded the first time a series is seen with the current settings.
+        """
+        key = (
+            tuple((label.name, label.value) for label in metric.label),
+            tuple(custom_tags) if custom_tags else (),
+            getattr(self._labels_mapper, 'version', None),
+            getattr(self._exclude_labels, 'version', None),
+        )
+        tags = self.label_tags_cache.get(key)
+        if tags is None:
+            tags = []
+            if custom_tags is not None:
+                tags.extend(custom_tags)
+            for label in metric.label:
+                if self.exclude_labels is None or label.name not in self.exclude_labels:
+                    tag_name = label.name
+                    if self.labels_mapper is not None and label.name in self.labels_mapper:
+                        tag_name = self.labels_mapper[label.name]
+                    tags.append('{}:{}'.format(tag_name, label.value))
+            tags = tuple(self._intern_tags(tags))
+            self.label_tags_cache.set(key, tags)
+
+        # `_finalize_tags_to_submit` may modify the list in place
+        return list(tags)
+
+    def _intern_tags(self, tags):
+        """
+        Encode the tags to bytes and intern them, tags like `namespace:default` are shared by
+        many series and would otherwise be held once per series in `label_tags_cache`
+        """
+        for tag in tags:
+            if not isinstance(tag, bytes):
+                try:
+                    tag = tag.encode('utf-8')
+                except Exception:
+                    self.log.warning('Error encoding tag to utf-8 encoded string, ignoring tag')
+                    continue
+            yield intern(tag)
+
     def _finalize_tags_to_submit(self, _tags, metric_name, val, metric, custom_tags=None, hostname=None):
         """
         Format the finalized tags
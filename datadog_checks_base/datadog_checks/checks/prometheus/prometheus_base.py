@@ -68,16 +68,14 @@ class PrometheusCheck(PrometheusScraperMixin, AgentCheck):
         self.gauge('{}.{}'.format(self.NAMESPACE, metric_name), val, _tags, hostname=hostname)
 
     def _metric_tags(self, metric_name, val, metric, custom_tags=None, hostname=None):
-        _tags = []
-        if custom_tags is not None:
-            _tags += custom_tags
-        for label in metric.label:
-            if self.exclude_labels is None or label.name not in self.exclude_labels:
-                tag_name = label.name
-                if self.labels_mapper is not None and label.name in self.labels_mapper:
-                    tag_name = self.labels_mapper[label.name]
-                _tags.append('{}:{}'.format(tag_name, label.value))
+        _tags = self._get_label_tags(metric, custom_tags)
         return self._finalize_tags_to_submit(_tags, metric_name, val, metric, custom_tags=custom_tags, hostname=hostname)
 
     def _submit_service_check(self, *args, **kwargs):
         self.service_check(*args, **kwargs)
+
+    def _get_http_session(self, endpoint, cert=None, verify=True):
+        return self.get_http_session(endpoint, cert=cert, verify=verify)
+
+    def _submission_batch(self):
+        return self.batch()
@@ -0,0 +1,55 @@
+# (C) Datadog, Inc. 2018
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    A dictionary bounded to `maxsize` entries, evicting the least recently used
+    one when full. Hits and misses are counted to monitor its efficiency.
+    """
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+
+        # re-insert to mark the entry as the most recently used
+        self._data[key] = value
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        try:
+            self._data.pop(key)
+        except KeyError:
+            if len(self._data) >= self.maxsize:
+                self._data.popitem(last=False)
+        self._data[key] = value
+
+    def clear(self):
+        self._data.clear()
+
+    @property
+    def hit_rate(self):
+        """
+        Return the ratio of lookups that were hits, 0 if there were none
+        """
+        lookups = self.hits + self.misses
+        if not lookups:
+            return 0.0
+        return self.hits / float(lookups)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,75 @@
+# (C) Datadog, Inc. 2018
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from six.moves.urllib.parse import urlparse
+
+
+class HTTPSessionPool(object):
+    """
+    Keep-alive `requests.Session` objects keyed by endpoint (scheme, host and port) and TLS
+    settings, so that successive runs reuse their connections instead of paying a new TCP
+    connect and TLS handshake every time.
+
+    At most `max_sessions` sessions are kept, each holding at most `pool_maxsize` connections,
+    and the sessions unused for `idle_timeout` seconds are closed.
+    """
+    def __init__(self, max_sessions=10, pool_maxsize=4, idle_timeout=300):
+        self.max_sessions = max_sessions
+        self.pool_maxsize = pool_maxsize
+        self.idle_timeout = idle_timeout
+
+        # key -> (session, last time used), from the least to the most recently used
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, url, cert=None, verify=True):
+        """
+        Return the session to use to query `url` with the given `cert` and `verify` settings
+        """
+        parsed = urlparse(url)
+        key = (parsed.scheme, parsed.netloc, cert, verify)
+        now = time.time()
+
+        with self._lock:
+            self._evict_idle(now)
+            try:
+                session, _ = self._sessions.pop(key)
+            except KeyError:
+                if len(self._sessions) >= self.max_sessions:
+                    _, (oldest, _) = self._sessions.popitem(last=False)
+                    oldest.close()
+                session = self._new_session(cert, verify)
+            self._sessions[key] = (session, now)
+
+        return session
+
+    def close(self):
+        with self._lock:
+            for session, _ in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _new_session(self, cert, verify):
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.cert = cert
+        session.verify = verify
+        return session
+
+    def _evict_idle(self, now):
+        while self._sessions:
+            key, (session, last_used) = next(iter(self._sessions.items()))
+            if now - last_used < self.idle_timeout:
+                break
+            del self._sessions[key]
+            session.close()
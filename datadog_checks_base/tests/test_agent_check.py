@@ -1,7 +1,13 @@
 # (C) Datadog, Inc. 2018
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
+import threading
+
+import mock
+import pytest
+
 from datadog_checks.checks import AgentCheck
+from datadog_checks.stubs import aggregator
 
 
 def test_instance():
@@ -45,3 +51,166 @@ class TestTags:
 
         assert normalized_tags is not tags
         assert normalized_tag == tag.encode('utf-8')
+
+
+class TestMetricNames:
+    def test_normalize(self):
+        check = AgentCheck()
+        assert check.normalize('Foo (bar)-baz') == 'Foo_bar_baz'
+        assert check.normalize(u'caf\xe9.hits', prefix='web') == 'web.cafe.hits'
+        assert check.normalize('wiredTiger.cacheBytes', fix_case=True) == 'wired_tiger.cache_bytes'
+        assert check.convert_to_underscore_separated('opLatencies.Reads') == 'op_latencies.reads'
+
+    def test_cache(self):
+        class Check(AgentCheck):
+            METRIC_NAME_CACHE_SIZE = 2
+
+        caches = Check.metric_name_caches()
+        assert Check().metric_name_caches() is caches
+        assert AgentCheck.metric_name_caches() is not caches
+
+        check = Check()
+        for _ in range(3):
+            assert check.normalize('connections.totalCreated', fix_case=True) == 'connections.total_created'
+        assert caches['normalize'].misses == 1
+        assert caches['normalize'].hits == 2
+        assert caches['convert_to_underscore_separated'].misses == 1
+
+        check.normalize('foo')
+        check.normalize('bar')
+        assert len(caches['normalize']) == 2
+        assert (str, 'connections.totalCreated', type(None), None, True) not in caches['normalize']
+
+    def test_cache_types(self):
+        check = AgentCheck()
+        assert type(check.normalize('foo.bar')) is str
+        assert type(check.normalize(u'foo.bar')) is str
+        assert type(check.convert_to_underscore_separated('fooBar')) is str
+        assert type(check.convert_to_underscore_separated(u'fooBar')) is unicode
+        assert type(check.convert_to_underscore_separated('fooBar')) is str
+
+    def test_cache_threads(self):
+        class Check(AgentCheck):
+            METRIC_NAME_CACHE_SIZE = 10
+
+        names = []
+
+        def normalize(check):
+            names.extend(check.normalize('metric{}'.format(i % 20), prefix='foo') for i in range(1000))
+
+        threads = [threading.Thread(target=normalize, args=(Check(),)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(names) == sorted(['foo.metric{}'.format(i % 20) for i in range(1000)] * 4)
+        assert len(Check.metric_name_caches()['normalize']) == 10
+
+
+class TestHTTPSession:
+    def test_reused(self):
+        check = AgentCheck()
+        session = check.get_http_session('https://localhost:8443/metrics')
+
+        assert check.get_http_session('https://localhost:8443/other') is session
+        assert check.get_http_session('https://localhost:8443/metrics', verify=False) is not session
+        assert check.get_http_session('http://localhost:8443/metrics') is not session
+
+    def test_pool_settings(self):
+        check = AgentCheck('test', {'http_max_sessions': 1, 'http_session_idle_timeout': 60}, {})
+        session = check.get_http_session('http://foo/metrics')
+
+        assert check._http_sessions.max_sessions == 1
+        assert check._http_sessions.idle_timeout == 60
+        assert check.get_http_session('http://bar/metrics') is not session
+        assert len(check._http_sessions) == 1
+
+
+class TestBatch:
+    @pytest.fixture(autouse=True)
+    def reset_aggregator(self):
+        aggregator.reset()
+        yield
+        aggregator.reset()
+
+    def test_batch(self):
+        check = AgentCheck()
+        with mock.patch.object(aggregator, 'submit_metric') as submit_metric:
+            with check.batch():
+                check.gauge('foo', 1, tags=[u'unicode:tag'])
+                check.gauge('foo', None)
+                with check.batch():
+                    check.rate('bar', '2', hostname='host')
+                check.gauge('baz', 3)
+                assert aggregator.metric_names == []
+            assert submit_metric.call_count == 0
+
+        aggregator.assert_metric('foo', value=1, tags=['unicode:tag'], count=1, metric_type=aggregator.GAUGE)
+        aggregator.assert_metric('bar', value=2, hostname='host', count=1, metric_type=aggregator.RATE)
+        aggregator.assert_metric('baz', value=3, count=1)
+        aggregator.assert_all_metrics_covered()
+
+    def test_batch_flushed_on_error(self):
+        check = AgentCheck()
+        with pytest.raises(ValueError):
+            with check.batch():
+                check.gauge('foo', 1)
+                raise ValueError()
+
+        aggregator.assert_metric('foo', value=1, count=1)
+        check.gauge('foo', 2)
+        aggregator.assert_metric('foo', count=2)
+
+    def test_batch_threads(self):
+        check = AgentCheck()
+        with check.batch():
+            check.gauge('foo', 1)
+            thread = threading.Thread(target=check.gauge, args=('bar', 2))
+            thread.start()
+            thread.join()
+            # submitted by another thread, not part of the batch
+            aggregator.assert_metric('bar', value=2, count=1)
+            assert 'foo' not in aggregator.metric_names
+
+        aggregator.assert_metric('foo', value=1, count=1)
+
+    def test_submit_metric_rows(self):
+        check = AgentCheck()
+        check.submit_metric_rows(aggregator.MONOTONIC_COUNT, [
+            ('foo', 1, ['a:b'], None),
+            ('foo', None, None, None),
+            ('bar', 2.5, None, 'host'),
+        ])
+
+        aggregator.assert_metric('foo', value=1, tags=['a:b'], count=1, metric_type=aggregator.MONOTONIC_COUNT)
+        aggregator.assert_metric('bar', value=2.5, hostname='host', count=1)
+
+    def test_batch_size(self):
+        check = AgentCheck()
+        check.METRIC_BATCH_SIZE = 3
+        with mock.patch.object(aggregator, 'submit_metrics', wraps=aggregator.submit_metrics) as submit_metrics:
+            with check.batch():
+                for i in range(4):
+                    check.gauge('foo', i)
+                check.submit_metric_rows(aggregator.GAUGE, [('bar', i, None, None) for i in range(3)])
+                check.rate('baz', 1)
+                # the gauges were flushed every 3 samples, the rate is still held
+                assert submit_metrics.call_count == 2
+                aggregator.assert_metric('foo', count=4)
+                aggregator.assert_metric('bar', count=3)
+                assert 'baz' not in aggregator.metric_names
+            assert submit_metrics.call_count == 3
+
+        aggregator.assert_metric('baz', count=1)
+
+    def test_fallback(self):
+        check = AgentCheck()
+        with mock.patch.object(aggregator, 'submit_metrics', None):
+            with check.batch():
+                check.gauge('foo', 1)
+                # the aggregator doesn't support batches, nothing is held
+                aggregator.assert_metric('foo', count=1)
+                check.gauge('foo', 2)
+                check.submit_metric_rows(aggregator.GAUGE, [('foo', 3, None, None)])
+
+        aggregator.assert_metric('foo', count=3)
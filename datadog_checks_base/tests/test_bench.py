@@ -0,0 +1,82 @@
+# (C) Datadog, Inc. 2018
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+import pytest
+
+from datadog_checks.checks import AgentCheck
+from datadog_checks.checks.prometheus import PrometheusCheck
+
+BUCKETS = ['0.005', '0.01', '0.025', '0.05', '0.1', '0.25', '0.5', '1', '2.5', '5', '10', '+Inf']
+
+
+class MockResponse:
+    def __init__(self, lines):
+        self.lines = lines
+        self.headers = {'Content-Type': 'text/plain; version=0.0.4'}
+
+    def iter_lines(self, **_):
+        return iter(self.lines)
+
+
+# metric names as collected by mongo, ~10 runs worth of them
+MONGO_METRIC_NAMES = [
+    'asserts.msgps', 'asserts.regularps', 'connections.available', 'connections.totalCreated',
+    'globalLock.activeClients.readers', 'globalLock.currentQueue.writers', 'mem.resident',
+    'metrics.cursor.timedOutps', 'metrics.document.deletedps', 'metrics.queryExecutor.scannedObjectsps',
+    'opLatencies.reads.latency', 'opcounters.getmore', 'wiredTiger.cache.bytes currently in the cache',
+    'wiredTiger.cache.tracked dirty bytes in the cache', 'wiredTiger.concurrentTransactions.read.available',
+] * 10
+
+
+@pytest.fixture(scope='module')
+def large_histogram():
+    """
+    A histogram with 2000 label sets, as exposed by kubelet or istio
+    """
+    lines = [
+        '# HELP request_duration_seconds The request latencies in seconds.',
+        '# TYPE request_duration_seconds histogram',
+    ]
+    for i in range(2000):
+        labels = 'service="svc-{}",method="GET",code="{}"'.format(i // 10, 200 + i % 10)
+        for j, le in enumerate(BUCKETS):
+            lines.append('request_duration_seconds_bucket{{{},le="{}"}} {}'.format(labels, le, i + j))
+        lines.append('request_duration_seconds_sum{{{}}} {}'.format(labels, i * 0.5))
+        lines.append('request_duration_seconds_count{{{}}} {}'.format(labels, i + len(BUCKETS)))
+    return lines
+
+
+def test_parse_large_histogram(benchmark, large_histogram):
+    check = PrometheusCheck('prometheus_check', {}, {}, {})
+
+    def parse():
+        return list(check.parse_metric_family(MockResponse(large_histogram)))
+
+    messages = benchmark(parse)
+
+    assert len(messages) == 1
+    assert len(messages[0].metric) == 2000
+    assert all(len(m.histogram.bucket) == len(BUCKETS) for m in messages[0].metric)
+
+
+def test_normalize(benchmark):
+    check = AgentCheck()
+
+    def normalize():
+        return [check.normalize(name, prefix='mongodb', fix_case=True) for name in MONGO_METRIC_NAMES]
+
+    names = benchmark(normalize)
+
+    assert names[0] == 'mongodb.asserts.msgps'
+    assert check.metric_name_caches()['normalize'].hit_rate > 0.9
+
+
+def test_normalize_uncached(benchmark):
+    check = AgentCheck()
+
+    def normalize():
+        return [check._normalize(name, 'mongodb', True) for name in MONGO_METRIC_NAMES]
+
+    names = benchmark(normalize)
+
+    assert names[0] == 'mongodb.asserts.msgps'
@@ -1,6 +1,7 @@
 # (C) Datadog, Inc. 2016
 # All rights reserved
 # Licensed under Simplified BSD License (see LICENSE)
+import copy
 import logging
 import os
 
@@ -142,6 +143,44 @@ def test_parse_metric_family_protobuf(bin_data, mocked_prometheus_check):
     assert messages[1].type == 2  # summary
 
 
+def test_parse_metric_family_protobuf_skip_unwanted(bin_data, mocked_prometheus_check):
+    check = mocked_prometheus_check
+    check.skip_unwanted_families = True
+    check.metrics_mapper = {
+        'process_virtual_memory_bytes': 'process.vm.bytes',
+        'go_memstats_heap_*': 'go.heap',
+    }
+
+    response = MockResponse(bin_data, protobuf_content_type)
+    messages = list(check.parse_metric_family(response))
+
+    assert [m.name for m in messages] == [
+        'go_memstats_heap_alloc_bytes',
+        'go_memstats_heap_idle_bytes',
+        'go_memstats_heap_inuse_bytes',
+        'go_memstats_heap_objects',
+        'go_memstats_heap_released_bytes_total',
+        'go_memstats_heap_sys_bytes',
+        'process_virtual_memory_bytes',
+    ]
+    assert messages[-1].metric[0].gauge.value == 39211008.0
+
+
+def test_peek_metric_family_name(ref_gauge):
+    check = PrometheusCheck
+    buf = ref_gauge.SerializeToString()
+    assert check._peek_metric_family_name(memoryview(buf), 0, len(buf)) == 'process_virtual_memory_bytes'
+
+    # the name isn't necessarily the first field of the message
+    help_field = b'\x12\x04help'
+    type_field = b'\x18\x01'
+    buf = help_field + type_field + buf
+    assert check._peek_metric_family_name(memoryview(buf), 0, len(buf)) == 'process_virtual_memory_bytes'
+
+    buf = help_field + type_field
+    assert check._peek_metric_family_name(memoryview(buf), 0, len(buf)) is None
+
+
 def test_parse_metric_family_text(text_data, mocked_prometheus_check):
     """ Test the high level method for loading metrics from text format """
     check = mocked_prometheus_check
@@ -227,6 +266,55 @@ def test_parse_metric_family_text(text_data, mocked_prometheus_check):
     assert _histo in messages
 
 
+def test_parse_metric_family_text_streaming(text_data, mocked_prometheus_check):
+    """ Families are yielded as soon as their last sample is read """
+    check = mocked_prometheus_check
+    lines = text_data.split("\n")
+    consumed = []
+
+    def iter_lines(**_):
+        for line in lines:
+            consumed.append(line)
+            yield line
+
+    response = mock.MagicMock(iter_lines=iter_lines, headers={'Content-Type': 'text/plain; version=0.0.4'})
+    messages = check.parse_metric_family(response)
+
+    first = next(messages)
+    assert first.name == 'go_gc_duration_seconds'
+    assert len(consumed) < len(lines)
+    assert len([first] + list(messages)) == 40
+
+
+def test_parse_metric_family_text_skip_unwanted(text_data, mocked_prometheus_check):
+    check = mocked_prometheus_check
+    check.skip_unwanted_families = True
+    check.metrics_mapper = {
+        'process_virtual_memory_bytes': 'process.vm.bytes',
+        'skydns_skydns_dns_response_size_*': 'skydns.response_size',
+    }
+
+    response = MockResponse(text_data, 'text/plain; version=0.0.4')
+    messages = list(check.parse_metric_family(response))
+    assert [m.name for m in messages] == ['process_virtual_memory_bytes', 'skydns_skydns_dns_response_size_bytes']
+    assert len(messages[1].metric) == 3
+
+    # untyped samples are only parsed when wanted
+    check.metrics_mapper = {'go_goroutines': 'goroutines'}
+    check.type_overrides = {'go_goroutines': 'gauge'}
+    response = MockResponse(text_data, 'text/plain; version=0.0.4')
+    messages = list(check.parse_metric_family(response))
+    assert [m.name for m in messages] == ['go_goroutines']
+
+    # ignored metrics are skipped, unless they are needed for a label join
+    check.ignore_metrics = ['go_goroutines']
+    response = MockResponse(text_data, 'text/plain; version=0.0.4')
+    assert list(check.parse_metric_family(response)) == []
+    check.label_joins = {'go_goroutines': {'label_to_match': 'foo', 'labels_to_get': ['bar']}}
+    response = MockResponse(text_data, 'text/plain; version=0.0.4')
+    assert [m.name for m in check.parse_metric_family(response)] == ['go_goroutines']
+
+
 def test_parse_metric_family_unsupported(bin_data, mocked_prometheus_check):
     check = mocked_prometheus_check
     with pytest.raises(UnknownFormatError):
@@ -234,6 +322,22 @@ def test_parse_metric_family_unsupported(bin_data, mocked_prometheus_check):
         list(check.parse_metric_family(response))
 
 
+def test_process_batch_submission(bin_data, mocked_prometheus_check):
+    endpoint = "http://fake.endpoint:10055/metrics"
+    check = mocked_prometheus_check
+    check.poll = mock.MagicMock(side_effect=lambda endpoint: MockResponse(bin_data, protobuf_content_type))
+    check.process_metric = mock.MagicMock()
+
+    # the scrapes aren't batched unless asked to
+    with mock.patch.object(check, 'batch', wraps=check.batch) as batch:
+        check.process(endpoint, instance=None)
+        assert batch.call_count == 0
+        check.batch_submission = True
+        check.process(endpoint, instance=None)
+        assert batch.call_count == 1
+    assert check.process_metric.call_count == 2 * len(list(parse_metric_family(bin_data)))
+
+
 def test_process(bin_data, mocked_prometheus_check, ref_gauge):
     endpoint = "http://fake.endpoint:10055/metrics"
     check = mocked_prometheus_check
@@ -306,6 +410,56 @@ def test_process_metric_filtered(mocked_prometheus_check):
     check.gauge.assert_not_called()
 
 
+def test_process_metric_wildcard(mocked_prometheus_check, ref_gauge):
+    check = mocked_prometheus_check
+    check._dry_run = False
+    check.metrics_mapper = {'process_virtual_*': 'process_virtual_*', 'process_*_bytes': 'process_*_bytes'}
+
+    check.process_metric(ref_gauge, ignore_unmapped=True)
+    # submitted once even if several wildcards match
+    check.gauge.assert_called_once_with('prometheus.process_virtual_memory_bytes', 39211008.0, [], hostname=None)
+
+    check.gauge.reset_mock()
+    check.ignore_metrics = ['process_virtual_memory_bytes']
+    check.process_metric(ref_gauge, ignore_unmapped=True)
+    check.gauge.assert_not_called()
+
+
+def test_match_metric_name(mocked_prometheus_check):
+    check = mocked_prometheus_check
+    check.metrics_mapper = {'foo': 'bar', 'go_*': 'go', 'http_[rs]*': 'http'}
+    check.ignore_metrics = ['go_ignored']
+
+    assert check._match_metric_name('foo') == (check.METRIC_MAPPED, 'bar')
+    assert check._match_metric_name('go_goroutines') == (check.METRIC_WILDCARD, 'go_goroutines')
+    assert check._match_metric_name('http_requests') == (check.METRIC_WILDCARD, 'http_requests')
+    assert check._match_metric_name('http_errors') == (check.METRIC_UNMAPPED, None)
+    assert check._match_metric_name('go_ignored') == (check.METRIC_IGNORED, None)
+    assert check._match_metric_name('process_max_fds') == (check.METRIC_UNMAPPED, None)
+    assert len(check._metric_name_cache) == 6
+
+    # the decisions are recomputed when the mapping changes
+    check.metrics_mapper = {'process_max_fds': 'process.max_fds'}
+    assert check._metric_name_cache == {}
+    assert check._match_metric_name('process_max_fds') == (check.METRIC_MAPPED, 'process.max_fds')
+    assert check._match_metric_name('go_goroutines') == (check.METRIC_UNMAPPED, None)
+
+    # the decisions are recomputed when the settings are modified in place
+    check.metrics_mapper['go_*'] = 'go'
+    assert check._match_metric_name('go_goroutines') == (check.METRIC_WILDCARD, 'go_goroutines')
+    check.metrics_mapper.update({'go_goroutines': 'go.goroutines'})
+    assert check._match_metric_name('go_goroutines') == (check.METRIC_MAPPED, 'go.goroutines')
+    check.ignore_metrics.append('go_goroutines')
+    assert check._match_metric_name('go_goroutines') == (check.METRIC_IGNORED, None)
+    check.ignore_metrics += ['process_max_fds']
+    assert check._match_metric_name('process_max_fds') == (check.METRIC_IGNORED, None)
+    del check.ignore_metrics[:]
+    assert check._match_metric_name('process_max_fds') == (check.METRIC_MAPPED, 'process.max_fds')
+    assert isinstance(check.metrics_mapper, dict)
+    assert isinstance(check.ignore_metrics, list)
+    assert copy.deepcopy(check.metrics_mapper) == check.metrics_mapper
+
+
 def test_poll_protobuf(mocked_prometheus_check, bin_data):
     """ Tests poll using the protobuf format """
     check = mocked_prometheus_check
@@ -339,6 +493,103 @@ def test_poll_text_plain(mocked_prometheus_check, text_data):
     p.stop()
 
 
+def test_poll_stream_response(mocked_prometheus_check):
+    check = mocked_prometheus_check
+    mock_response = mock.MagicMock(status_code=200, headers={'Content-Type': "text/plain"})
+    with mock.patch('requests.get', return_value=mock_response, __name__="get") as mock_get:
+        check.poll("http://fake.endpoint:10055/metrics")
+        assert mock_get.call_args[1]['stream'] is False
+
+        check.stream_response = True
+        check.poll("http://fake.endpoint:10055/metrics")
+        assert mock_get.call_args[1]['stream'] is True
+
+
+def test_poll_keep_alive(mocked_prometheus_check):
+    check = mocked_prometheus_check
+    check.keep_alive = True
+    check.ssl_ca_cert = False
+    mock_response = mock.MagicMock(status_code=200, headers={'Content-Type': "text/plain"})
+    with mock.patch('requests.Session.get', return_value=mock_response, __name__="get") as mock_get:
+        check.poll("https://fake.endpoint:10055/metrics")
+        check.poll("https://fake.endpoint:10055/metrics")
+        assert mock_get.call_count == 2
+
+    assert len(check._http_sessions) == 1
+    assert check.get_http_session("https://fake.endpoint:10055/metrics", verify=False).verify is False
+
+
+def test_scrape_metrics_conditional(text_data, mocked_prometheus_check):
+    check = mocked_prometheus_check
+    check.conditional_scrape = True
+    endpoint = "http://fake.endpoint:10055/metrics"
+
+    response = MockResponse(text_data, 'text/plain; version=0.0.4')
+    response.status_code = 200
+    response.headers['ETag'] = '"abc"'
+    with mock.patch.object(check, 'poll', return_value=response):
+        messages = list(check.scrape_metrics(endpoint))
+    assert len(messages) == 40
+    assert check._scrape_validators(endpoint) == {'If-None-Match': '"abc"'}
+
+    # the same payload is replayed without being parsed again, as fresh messages
+    names = [message.name for message in messages]
+    messages[0].name = 'modified'
+    with mock.patch.object(check, 'poll', return_value=response):
+        with mock.patch.object(check, 'parse_metric_family') as parse:
+            replayed = list(check.scrape_metrics(endpoint))
+            assert parse.call_count == 0
+    assert [message.name for message in replayed] == names
+
+    # so is a 304 Not Modified response
+    not_modified = MockResponse('', 'text/plain; version=0.0.4')
+    not_modified.status_code = 304
+    with mock.patch.object(check, 'poll', return_value=not_modified):
+        assert len(list(check.scrape_metrics(endpoint))) == 40
+
+    # only the families submitted as gauges are replayed: not the monotonic counters nor the rates,
+    # unless they are the source of a label join
+    counters = [message.name for message in messages if message.type == 0]
+    assert len(counters) == 10
+    check.rate_metrics = ['go_memstats_alloc_bytes']
+    check.label_joins = {counters[0]: {'label_to_match': 'foo', 'labels_to_get': []}}
+    with mock.patch.object(check, 'poll', return_value=response):
+        check._scrape_cache = {}
+        assert len(list(check.scrape_metrics(endpoint, send_monotonic_counter=True))) == 40
+        replayed = [message.name for message in check.scrape_metrics(endpoint, send_monotonic_counter=True)]
+    assert len(replayed) == 30
+    assert counters[0] in replayed
+    assert not set(counters[1:]) & set(replayed)
+    assert 'go_memstats_alloc_bytes' not in replayed
+    assert 'go_gc_duration_seconds' in replayed
+    check.rate_metrics = []
+    check.label_joins = {}
+
+    # unchanged payloads are dropped altogether when asked to
+    check.skip_unchanged_payload = True
+    check.metrics_mapper = {'go_goroutines': 'goroutines'}
+    assert check._scrape_cache == {}
+    with mock.patch.object(check, 'poll', return_value=response):
+        assert len(list(check.scrape_metrics(endpoint))) == 40
+        assert list(check.scrape_metrics(endpoint)) == []
+
+
+def test_poll_conditional(mocked_prometheus_check):
+    check = mocked_prometheus_check
+    endpoint = "http://fake.endpoint:10055/metrics"
+    check._scrape_cache[endpoint] = {'etag': '"abc"', 'last_modified': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+    mock_response = mock.MagicMock(status_code=304, headers={'Content-Type': "text/plain"})
+    with mock.patch('requests.get', return_value=mock_response, __name__="get") as mock_get:
+        check.poll(endpoint)
+        assert 'If-None-Match' not in mock_get.call_args[1]['headers']
+
+        check.conditional_scrape = True
+        check.poll(endpoint)
+        headers = mock_get.call_args[1]['headers']
+        assert headers['If-None-Match'] == '"abc"'
+        assert headers['If-Modified-Since'] == 'Wed, 21 Oct 2015 07:28:00 GMT'
+
+
 def test_submit_gauge_with_labels(mocked_prometheus_check, ref_gauge):
     """ submitting metrics that contain labels should result in tags on the gauge call """
     _l1 = ref_gauge.metric[0].label.add()
@@ -457,6 +708,66 @@ def test_submit_gauge_with_exclude_labels(mocked_prometheus_check, ref_gauge):
                                    hostname=None)
 
 
+def test_label_tags_cache(mocked_prometheus_check, ref_gauge):
+    check = mocked_prometheus_check
+    _l1 = ref_gauge.metric[0].label.add()
+    _l1.name = 'my_1st_label'
+    _l1.value = 'my_1st_label_value'
+
+    check._submit(check.metrics_mapper[ref_gauge.name], ref_gauge, custom_tags=['env:prod'])
+    check._submit(check.metrics_mapper[ref_gauge.name], ref_gauge, custom_tags=['env:prod'])
+    assert check.label_tags_cache.misses == 1
+    assert check.label_tags_cache.hits == 1
+    check.gauge.assert_called_with(
+        'prometheus.process.vm.bytes', 39211008.0, ['env:prod', 'my_1st_label:my_1st_label_value'], hostname=None)
+    assert all(isinstance(tag, bytes) for tag in check.gauge.call_args[0][2])
+
+    # different custom tags are a different series
+    check._submit(check.metrics_mapper[ref_gauge.name], ref_gauge, custom_tags=['env:dev'])
+    assert check.label_tags_cache.misses == 2
+
+    # the cached tags are dropped when the labels config changes
+    check.labels_mapper = {'my_1st_label': 'transformed_1st'}
+    assert len(check.label_tags_cache) == 0
+    check._submit(check.metrics_mapper[ref_gauge.name], ref_gauge, custom_tags=['env:prod'])
+    check.gauge.assert_called_with(
+        'prometheus.process.vm.bytes', 39211008.0, ['env:prod', 'transformed_1st:my_1st_label_value'], hostname=None)
+
+    check.exclude_labels = ['my_1st_label']
+    check._submit(check.metrics_mapper[ref_gauge.name], ref_gauge, custom_tags=['env:prod'])
+    check.gauge.assert_called_with('prometheus.process.vm.bytes', 39211008.0, ['env:prod'], hostname=None)
+
+    # as well as when it is modified in place
+    check.exclude_labels.remove('my_1st_label')
+    check._submit(check.metrics_mapper[ref_gauge.name], ref_gauge, custom_tags=['env:prod'])
+    check.gauge.assert_called_with(
+        'prometheus.process.vm.bytes', 39211008.0, ['env:prod', 'transformed_1st:my_1st_label_value'], hostname=None)
+    check.labels_mapper['my_1st_label'] = 'transformed_again'
+    check._submit(check.metrics_mapper[ref_gauge.name], ref_gauge, custom_tags=['env:prod'])
+    check.gauge.assert_called_with(
+        'prometheus.process.vm.bytes', 39211008.0, ['env:prod', 'transformed_again:my_1st_label_value'], hostname=None)
+
+
+def test_label_tags_cache_resize(mocked_prometheus_check):
+    check = mocked_prometheus_check
+    check.label_tags_cache.maxsize = 8
+    check.LABEL_TAGS_CACHE_MAX_SIZE = 64
+    series = ['process_virtual_memory_bytes{{pid="{}"}} {}'.format(i, i) for i in range(20)]
+    text_data = '\n'.join(['# TYPE process_virtual_memory_bytes gauge'] + series)
+    check.poll = mock.MagicMock(side_effect=lambda endpoint: MockResponse(text_data, 'text/plain; version=0.0.4'))
+
+    # the 20 series don't fit in the cache, which grows until they do
+    for _ in range(4):
+        check.process('http://localhost/metrics')
+    assert check.label_tags_cache.maxsize == 32
+
+    check.label_tags_cache.hits = check.label_tags_cache.misses = 0
+    check.process('http://localhost/metrics')
+    assert check.label_tags_cache.hits == 20
+    assert check.label_tags_cache.misses == 0
+    assert check.label_tags_cache.maxsize == 32
+
+
 def test_submit_counter(mocked_prometheus_check):
     _counter = metrics_pb2.MetricFamily()
     _counter.name = 'my_counter'
@@ -47,3 +47,17 @@ def test_label_to_hostname_override():
     instance = {'prometheus_url': endpoint, 'namespace': 'default_namespace'}
     check = GenericPrometheusCheck('prometheus_check', {}, {}, [instance], default_instance, default_namespace="foo")
     assert check.get_scraper(instance).label_to_hostname == 'node'
+
+
+def test_http_options_override():
+    endpoint = "none"
+    instance = {'prometheus_url': endpoint, 'metrics': ["foo"]}
+    check = GenericPrometheusCheck('prometheus_check', {}, {}, [instance], default_namespace="foo")
+    assert check.get_scraper(instance).stream_response is False
+    assert check.get_scraper(instance).keep_alive is False
+    assert check.get_scraper(instance).skip_unwanted_families is True
+
+    instance = {'prometheus_url': endpoint, 'metrics': ["foo"], 'stream_response': True, 'keep_alive': True}
+    check = GenericPrometheusCheck('prometheus_check', {}, {}, [instance], default_namespace="foo")
+    assert check.get_scraper(instance).stream_response is True
+    assert check.get_scraper(instance).keep_alive is True
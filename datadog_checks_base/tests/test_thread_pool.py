@@ -0,0 +1,164 @@
+# (C) Datadog, Inc. 2018
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+import threading
+import time
+
+import mock
+import pytest
+
+from datadog_checks.checks import AgentCheck
+from datadog_checks.checks.libs.thread_pool import DeadlineExceeded, MapResult, Pool, QueueFullError, TimeoutError
+from datadog_checks.stubs import aggregator
+
+
+@pytest.fixture
+def pool():
+    p = Pool(2)
+    yield p
+    p.terminate()
+    p.join()
+
+
+def square(x):
+    return x * x
+
+
+def fail(x):
+    raise ValueError(x)
+
+
+class TestPool:
+    def test_apply_async(self, pool):
+        results = []
+        result = pool.apply_async(square, args=(3,), callback=results.append)
+
+        assert result.get(1) == 9
+        assert result.successful()
+        assert results == [9]
+
+    def test_exception(self, pool):
+        result = pool.apply_async(fail, ('boom',))
+
+        with pytest.raises(ValueError):
+            result.get(1)
+        assert not result.successful()
+
+    def test_map(self, pool):
+        assert pool.map(square, range(10), chunksize=3) == [x * x for x in range(10)]
+        assert pool.map(square, []) == []
+        assert list(pool.imap(square, range(5))) == [0, 1, 4, 9, 16]
+        assert sorted(pool.imap_unordered(square, range(5))) == [0, 1, 4, 9, 16]
+
+        with pytest.raises(ValueError):
+            pool.map(fail, range(3))
+
+    def test_map_stress(self):
+        pool = Pool(4)
+        try:
+            for _ in range(200):
+                assert pool.map(sum, [range(2000)] * 8, chunksize=1) == [sum(range(2000))] * 8
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def test_map_slow_listener(self, pool):
+        # the result of the map is only set once the listener of the last chunk has run
+        chunk_ready = MapResult._chunk_ready
+
+        def slow_chunk_ready(self, chunk_result):
+            time.sleep(0.05)
+            chunk_ready(self, chunk_result)
+
+        with mock.patch.object(MapResult, '_chunk_ready', slow_chunk_ready):
+            assert pool.map(square, range(4), chunksize=2) == [0, 1, 4, 9]
+
+    def test_get_timeout(self, pool):
+        event = threading.Event()
+        result = pool.apply_async(event.wait)
+
+        with pytest.raises(TimeoutError):
+            result.get(0.01)
+        event.set()
+        result.get(1)
+
+    def test_job_deadline(self):
+        pool = Pool(1, job_timeout=0.05)
+        event = threading.Event()
+        try:
+            running = pool.apply_async(event.wait)
+            queued = pool.apply_async(square, (2,))
+
+            # the deadline applies even when waiting without timeout
+            with pytest.raises(DeadlineExceeded):
+                running.get()
+            with pytest.raises(DeadlineExceeded):
+                queued.get()
+            assert pool.late_jobs() == 1
+
+            # the result of the job running late is discarded
+            event.set()
+            time.sleep(0.05)
+            with pytest.raises(DeadlineExceeded):
+                running.get()
+            assert pool.apply_async(square, (2,), timeout=1).get() == 4
+            assert pool.stats.snapshot()['timeouts'] == 2
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def test_bounded_queue(self):
+        pool = Pool(1, max_queue_size=1, submit_timeout=0.01)
+        event = threading.Event()
+        try:
+            pool.apply_async(event.wait)
+            # wait for the worker to dequeue the first job
+            while pool.qsize():
+                time.sleep(0.001)
+            pool.apply_async(square, (2,))
+
+            with pytest.raises(QueueFullError):
+                pool.apply_async(square, (3,))
+            assert pool.qsize() == 1
+            assert pool.stats.snapshot()['rejected'] == 1
+        finally:
+            event.set()
+            pool.terminate()
+            pool.join()
+
+    def test_terminate(self):
+        pool = Pool(1)
+        event = threading.Event()
+        pool.apply_async(event.wait)
+        queued = pool.apply_async(square, (2,))
+
+        pool.terminate()
+        event.set()
+        pool.join()
+
+        assert pool.get_nworkers() == 0
+        with pytest.raises(DeadlineExceeded):
+            queued.get()
+        with pytest.raises(ValueError):
+            pool.apply_async(square, (2,))
+
+    def test_submit_stats(self, pool):
+        aggregator.reset()
+        check = AgentCheck()
+        pool.map(square, range(4))
+        with pytest.raises(ValueError):
+            pool.apply_async(fail, ('boom',)).get(1)
+
+        pool.submit_stats(check, 'pool', tags=['foo:bar'])
+
+        aggregator.assert_metric('pool.queue_size', value=0, tags=['foo:bar'])
+        aggregator.assert_metric('pool.late_jobs', value=0, tags=['foo:bar'])
+        aggregator.assert_metric('pool.jobs.submitted', value=5, tags=['foo:bar'])
+        aggregator.assert_metric('pool.jobs.completed', value=4, tags=['foo:bar'])
+        aggregator.assert_metric('pool.jobs.failed', value=1, tags=['foo:bar'])
+        aggregator.assert_metric('pool.jobs.timeouts', value=0, tags=['foo:bar'])
+        for name in ('wait_time.avg', 'wait_time.max', 'run_time.avg', 'run_time.max'):
+            aggregator.assert_metric('pool.jobs.{}'.format(name), tags=['foo:bar'])
+
+        # the stats are reset once submitted
+        assert pool.stats.snapshot()['submitted'] == 0
@@ -1,7 +1,11 @@
 # (C) Datadog, Inc. 2018
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
+import mock
+
+from datadog_checks.utils.cache import LRUCache
 from datadog_checks.utils.common import pattern_filter
+from datadog_checks.utils.http import HTTPSessionPool
 
 
 class Item:
@@ -50,3 +54,81 @@ class TestPatternFilter:
         assert pattern_filter(items, whitelist=whitelist, key=lambda item: item.name) == [
             Item('abc'), Item('def'), Item('abcdef')
         ]
+
+
+class TestLRUCache:
+    def test_get_set(self):
+        cache = LRUCache(2)
+        cache.set('foo', 1)
+
+        assert cache.get('foo') == 1
+        assert cache.get('bar') is None
+        assert cache.get('bar', 0) == 0
+        assert cache.hits == 1
+        assert cache.misses == 2
+        assert cache.hit_rate == 1 / 3.0
+
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache.set('foo', 1)
+        cache.set('bar', 2)
+        # `foo` becomes the most recently used entry
+        cache.get('foo')
+        cache.set('baz', 3)
+
+        assert len(cache) == 2
+        assert 'foo' in cache
+        assert 'bar' not in cache
+        assert 'baz' in cache
+
+    def test_clear(self):
+        cache = LRUCache()
+        cache.set('foo', 1)
+        cache.clear()
+
+        assert len(cache) == 0
+        assert cache.hit_rate == 0.0
+
+
+class TestHTTPSessionPool:
+    def test_keyed_by_endpoint_and_tls(self):
+        pool = HTTPSessionPool()
+        session = pool.get('https://foo:443/metrics', cert='/path/to/cert', verify='/path/to/ca')
+
+        assert session.cert == '/path/to/cert'
+        assert session.verify == '/path/to/ca'
+        assert pool.get('https://foo:443/stats', cert='/path/to/cert', verify='/path/to/ca') is session
+        assert pool.get('https://foo:443/metrics', cert='/path/to/cert', verify=False) is not session
+        assert pool.get('https://bar:443/metrics', cert='/path/to/cert', verify='/path/to/ca') is not session
+
+    def test_max_sessions(self):
+        pool = HTTPSessionPool(max_sessions=2)
+        foo = pool.get('http://foo/')
+        pool.get('http://bar/')
+        # `foo` becomes the most recently used session
+        pool.get('http://foo/')
+
+        with mock.patch('requests.Session.close') as close:
+            pool.get('http://baz/')
+            assert close.call_count == 1
+
+        assert len(pool) == 2
+        assert pool.get('http://foo/') is foo
+
+    def test_idle_eviction(self):
+        pool = HTTPSessionPool(idle_timeout=60)
+        with mock.patch('time.time', return_value=1000):
+            foo = pool.get('http://foo/')
+        with mock.patch('time.time', return_value=1030):
+            bar = pool.get('http://bar/')
+        with mock.patch('time.time', return_value=1070):
+            assert pool.get('http://bar/') is bar
+            assert len(pool) == 1
+            assert pool.get('http://foo/') is not foo
+
+    def test_close(self):
+        pool = HTTPSessionPool()
+        pool.get('http://foo/')
+        pool.close()
+
+        assert len(pool) == 0
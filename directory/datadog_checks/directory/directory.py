@@ -1,14 +1,93 @@
 # (C) Datadog, Inc. 2018
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
+import threading
 from fnmatch import fnmatch
+from itertools import chain
+from os import stat
 from os.path import abspath, exists, join, relpath
 from time import time
 
+# 3p
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from datadog_checks.checks import AgentCheck
+from datadog_checks.checks.libs.thread_pool import Pool
 from datadog_checks.config import _is_affirmative
+from datadog_checks.utils.cache import LRUCache
 from .traverse import walk
 
+# Number of directories whose content is remembered by the incremental mode
+DEFAULT_INCREMENTAL_CACHE_SIZE = 10000
+
+# Number of files stat'ed between two checks of the scan time budget
+BUDGET_CHECK_INTERVAL = 1000
+
+FILE_METRICS = (
+    'system.disk.directory.file.bytes',
+    'system.disk.directory.file.modified_sec_ago',
+    'system.disk.directory.file.created_sec_ago',
+)
+
+
+def aggregate(values):
+    """
+    Return the `(count, min, max, avg, median, 95percentile)` of a non-empty list of values,
+    the percentiles being computed with the nearest-rank method, as the Agent does for histograms.
+    """
+    count = len(values)
+    if numpy is not None:
+        values = numpy.array(values, dtype=float)
+        values.sort()
+        avg = values.mean()
+    else:
+        values = sorted(values)
+        avg = sum(values) / float(count)
+
+    def percentile(p):
+        return values[max(int(round(p * count - 1)), 0)]
+
+    return count, values[0], values[-1], avg, percentile(0.5), percentile(0.95)
+
+
+class ScanBudget(object):
+    """
+    The number of files and the time a scan is allowed to take, shared by the threads scanning a directory.
+    `truncated` is set once either of them is exceeded.
+    """
+    def __init__(self, max_files=None, max_time=None):
+        self.max_files = max_files
+        self.deadline = None if max_time is None else time() + max_time
+        self.files = 0
+        self.truncated = False
+        self._lock = threading.Lock()
+
+    @property
+    def limited(self):
+        return self.max_files is not None or self.deadline is not None
+
+    def exceeded(self):
+        if not self.truncated and self.deadline is not None and time() > self.deadline:
+            self.truncated = True
+        return self.truncated
+
+    def take(self, count):
+        """
+        Account for `count` more files and return how many of them fit in the budget
+        """
+        if self.max_files is None:
+            return count
+
+        with self._lock:
+            allowed = max(min(count, self.max_files - self.files), 0)
+            self.files += allowed
+        if allowed < count:
+            self.truncated = True
+        return allowed
+
 
 class DirectoryCheck(AgentCheck):
     """This check is for monitoring and reporting metrics on the files for a provided directory.
@@ -28,10 +107,36 @@ class DirectoryCheck(AgentCheck):
                       Useful for very large directories. default False
         `ignore_missing` - boolean, when true do not raise an exception on missing/inaccessible directories.
                            default False
+        `incremental` - boolean, when true and `recursive` is set, the sub-directories whose modification time
+                        did not change since the previous run are not listed again and the stats of their files
+                        are reused. default False
+        `incremental_cache_size` - integer, the maximum number of directories remembered by the incremental mode.
+                                   default 10000
+        `local_aggregation` - boolean, when true the file metrics of the whole directory are aggregated by the
+                              check and submitted as `.count`, `.min`, `.max`, `.avg`, `.median` and
+                              `.95percentile` gauges instead of histograms. default False
+        `max_files` - integer, the maximum number of files to look at, the metrics are then tagged
+                      with `truncated:true`. default unlimited
+        `max_scan_time` - number, the maximum number of seconds the scan of the directory can take,
+                          the metrics are then tagged with `truncated:true`. default unlimited
+
+    Init config options:
+        `threads_count` - integer, the number of threads scanning the top-level sub-directories of a
+                          `recursive` directory concurrently. default 1
     """
 
     SOURCE_TYPE_NAME = 'system'
 
+    def __init__(self, name, init_config, agentConfig, instances=None):
+        AgentCheck.__init__(self, name, init_config, agentConfig, instances)
+
+        # (directory, pattern, countonly) -> LRUCache of directory path -> (mtime, sub-directories, files)
+        self._scan_caches = {}
+        self._scan_cache_lock = threading.Lock()
+
+        self.pool_size = int((self.init_config or {}).get('threads_count', 1))
+        self.pool = None
+
     def check(self, instance):
         try:
             directory = instance['directory']
@@ -47,6 +152,10 @@ class DirectoryCheck(AgentCheck):
         filegauges = _is_affirmative(instance.get('filegauges', False))
         countonly = _is_affirmative(instance.get('countonly', False))
         ignore_missing = _is_affirmative(instance.get('ignore_missing', False))
+        incremental = recursive and _is_affirmative(instance.get('incremental', False))
+        local_aggregation = _is_affirmative(instance.get('local_aggregation', False))
+        max_files = instance.get('max_files')
+        max_scan_time = instance.get('max_scan_time')
         custom_tags = instance.get('tags', [])
 
         if not exists(abs_directory):
@@ -60,88 +169,113 @@ class DirectoryCheck(AgentCheck):
                 'DirectoryCheck: the directory `{}` does not exist. Skipping.'.format(abs_directory)
             )
 
+        scan_cache = None
+        if incremental:
+            cache_key = (abs_directory, pattern, countonly)
+            scan_cache = self._scan_caches.get(cache_key)
+            if scan_cache is None:
+                cache_size = int(instance.get('incremental_cache_size', DEFAULT_INCREMENTAL_CACHE_SIZE))
+                scan_cache = self._scan_caches[cache_key] = LRUCache(cache_size)
+
+        budget = ScanBudget(
+            max_files=None if max_files is None else int(max_files),
+            max_time=None if max_scan_time is None else float(max_scan_time),
+        )
+
         self._get_stats(abs_directory, name, dirtagname,
                         filetagname, filegauges, pattern,
-                        recursive, countonly, custom_tags)
+                        recursive, countonly, custom_tags, scan_cache,
+                        local_aggregation, budget)
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
 
     def _get_stats(self, directory, name, dirtagname, filetagname,
-                   filegauges, pattern, recursive, countonly, tags):
+                   filegauges, pattern, recursive, countonly, tags, scan_cache=None,
+                   local_aggregation=False, budget=None):
         dirtags = ['{}:{}'.format(dirtagname, name)]
         dirtags.extend(tags)
         directory_bytes = 0
         directory_files = 0
+        budget = ScanBudget() if budget is None else budget
 
-        # If we do not want to recursively search sub-directories only get the root.
-        walker = walk(directory) if recursive else (next(walk(directory)), )
-
-        # Avoid repeated global lookups.
-        get_length = len
-
-        for root, dirs, files in walker:
-            directory_files += get_length(files)
-
-            for file_entry in files:
-                if pattern:
-                    # Check if the path of the file relative to the directory
-                    # matches the pattern. Also check if the absolute path of the
-                    # filename matches the pattern, for compatibility with previous
-                    # agent versions.
-                    filename = join(root, file_entry.name)
-                    if not (
-                        fnmatch(filename, pattern) or
-                        fnmatch(relpath(filename, directory), pattern)
-                    ):
-                        directory_files -= 1
-                        continue
-
-                # We're just looking to count the files.
-                if countonly:
-                    continue
+        scan = self._scan(directory, pattern, recursive, countonly, scan_cache, budget)
+        if budget.limited:
+            # The whole directory is scanned before submitting anything, to know whether the scan is truncated
+            scan = list(scan)
+            if budget.truncated:
+                self.warning(
+                    'DirectoryCheck: the scan of `{}` exceeded its budget, its metrics are partial'.format(directory)
+                )
+                dirtags.append('truncated:true')
+
+        now = time()
+        aggregated = ([], [], []) if local_aggregation else None
 
-                try:
-                    file_stat = file_entry.stat()
+        for root, files in scan:
+            for filename, file_stat in files:
+                directory_files += 1
 
-                except OSError as ose:
-                    self.warning(
-                        'DirectoryCheck: could not stat file {} - {}'.format(join(root, file_entry.name), ose)
+                # We're just looking to count the files, or the file could not be stat'ed.
+                if file_stat is None:
+                    continue
+
+                # file specific metrics
+                size, mtime, ctime = file_stat
+                directory_bytes += size
+                if filegauges and directory_files <= 20:
+                    filetags = ['{}:{}'.format(filetagname, join(root, filename))]
+                    filetags.extend(dirtags)
+                    self.gauge(
+                        'system.disk.directory.file.bytes',
+                        size,
+                        tags=filetags
+                    )
+                    self.gauge(
+                        'system.disk.directory.file.modified_sec_ago',
+                        now - mtime,
+                        tags=filetags
+                    )
+                    self.gauge(
+                        'system.disk.directory.file.created_sec_ago',
+                        now - ctime,
+                        tags=filetags
                     )
+                elif aggregated is not None:
+                    aggregated[0].append(size)
+                    aggregated[1].append(now - mtime)
+                    aggregated[2].append(now - ctime)
                 else:
-                    # file specific metrics
-                    directory_bytes += file_stat.st_size
-                    if filegauges and directory_files <= 20:
-                        filetags = ['{}:{}'.format(filetagname, join(root, file_entry.name))]
-                        filetags.extend(dirtags)
-                        self.gauge(
-                            'system.disk.directory.file.bytes',
-                            file_stat.st_size,
-                            tags=filetags
-                        )
-                        self.gauge(
-                            'system.disk.directory.file.modified_sec_ago',
-                            time() - file_stat.st_mtime,
-                            tags=filetags
-                        )
-                        self.gauge(
-                            'system.disk.directory.file.created_sec_ago',
-                            time() - file_stat.st_ctime,
-                            tags=filetags
-                        )
-                    else:
-                        self.histogram(
-                            'system.disk.directory.file.bytes',
-                            file_stat.st_size,
-                            tags=dirtags
-                        )
-                        self.histogram(
-                            'system.disk.directory.file.modified_sec_ago',
-                            time() - file_stat.st_mtime,
-                            tags=dirtags
-                        )
-                        self.histogram(
-                            'system.disk.directory.file.created_sec_ago',
-                            time() - file_stat.st_ctime,
-                            tags=dirtags
-                        )
+                    self.histogram(
+                        'system.disk.directory.file.bytes',
+                        size,
+                        tags=dirtags
+                    )
+                    self.histogram(
+                        'system.disk.directory.file.modified_sec_ago',
+                        now - mtime,
+                        tags=dirtags
+                    )
+                    self.histogram(
+                        'system.disk.directory.file.created_sec_ago',
+                        now - ctime,
+                        tags=dirtags
+                    )
+
+        if aggregated is not None:
+            for metric, values in zip(FILE_METRICS, aggregated):
+                if not values:
+                    continue
+                count, min_value, max_value, avg, median, p95 = aggregate(values)
+                self.gauge(metric + '.count', count, tags=dirtags)
+                self.gauge(metric + '.min', min_value, tags=dirtags)
+                self.gauge(metric + '.max', max_value, tags=dirtags)
+                self.gauge(metric + '.avg', avg, tags=dirtags)
+                self.gauge(metric + '.median', median, tags=dirtags)
+                self.gauge(metric + '.95percentile', p95, tags=dirtags)
 
         # number of files
         self.gauge('system.disk.directory.files', directory_files, tags=dirtags)
@@ -149,3 +283,135 @@ class DirectoryCheck(AgentCheck):
         # total file size
         if not countonly:
             self.gauge('system.disk.directory.bytes', directory_bytes, tags=dirtags)
+
+    def _scan(self, directory, pattern, recursive, countonly, scan_cache, budget):
+        """
+        Yield the `(root, files)` of `directory`, and of its sub-directories if `recursive`,
+        see `_get_files` for the format of `files`.
+
+        With a thread pool, the top-level sub-directories are scanned concurrently, the content
+        of each of them being kept in memory until it is consumed.
+        """
+        def walk_tree(root, recursive=True):
+            if scan_cache is not None:
+                return self._walk_incremental(directory, root, pattern, countonly, scan_cache, budget, recursive)
+            return self._walk(directory, root, pattern, countonly, budget, recursive)
+
+        if not recursive or self.pool_size <= 1:
+            tree = walk_tree(directory, recursive)
+        else:
+            if self.pool is None:
+                self.log.debug("Starting Thread Pool of size %s", self.pool_size)
+                self.pool = Pool(self.pool_size)
+
+            top = list(walk_tree(directory, recursive=False))
+            top_dirs = top[0][1] if top else []
+            subtrees = self.pool.imap(lambda root: list(walk_tree(root)), [join(directory, name) for name in top_dirs])
+            tree = chain(top, chain.from_iterable(subtrees))
+
+        for root, _, files in tree:
+            yield root, files
+
+    def _walk(self, directory, root, pattern, countonly, budget, recursive=True):
+        """
+        Yield the `(root, sub-directories, files)` of `root`, and of its sub-directories if `recursive`,
+        see `_get_files` for the format of `files`.
+        """
+        walker = walk(root)
+        if not recursive:
+            # `walk` only lists the sub-directories once the root is consumed
+            top = next(walker, None)
+            walker = [] if top is None else [top]
+
+        for path, dirs, file_entries in walker:
+            if budget.exceeded():
+                return
+            yield path, dirs, self._get_files(directory, path, file_entries, pattern, countonly, budget)
+
+    def _walk_incremental(self, directory, root, pattern, countonly, scan_cache, budget, recursive=True):
+        """
+        Same as `_walk`, except that the content of the directories whose modification time
+        did not change since it was cached in `scan_cache` is not listed again.
+        """
+        if budget.exceeded():
+            return
+
+        try:
+            mtime = stat(root).st_mtime
+        except OSError:
+            return
+
+        with self._scan_cache_lock:
+            cached = scan_cache.get(root)
+        if cached is not None and cached[0] == mtime:
+            _, dirs, files = cached
+            allowed = budget.take(len(files))
+            if allowed < len(files):
+                files = files[:allowed]
+        else:
+            try:
+                _, dirs, file_entries = next(walk(root))
+            except StopIteration:
+                return
+            files = self._get_files(directory, root, file_entries, pattern, countonly, budget)
+
+            # A change made within the same second could go unnoticed with a coarse mtime resolution,
+            # and a truncated listing is not complete.
+            if time() - mtime > 1 and not budget.truncated:
+                with self._scan_cache_lock:
+                    scan_cache.set(root, (mtime, dirs, files))
+
+        yield root, dirs, files
+
+        if not recursive:
+            return
+
+        for name in dirs:
+            for entry in self._walk_incremental(directory, join(root, name), pattern, countonly, scan_cache, budget):
+                yield entry
+
+    def _get_files(self, directory, root, file_entries, pattern, countonly, budget=None):
+        """
+        Return the `(name, stats)` of the files of `root` matching the pattern, `stats` being
+        their `(size, modification time, creation time)` or None if they are only counted.
+        """
+        files = []
+
+        if pattern:
+            # Check if the path of the file relative to the directory
+            # matches the pattern. Also check if the absolute path of the
+            # filename matches the pattern, for compatibility with previous
+            # agent versions.
+            file_entries = [
+                file_entry for file_entry in file_entries
+                if fnmatch(join(root, file_entry.name), pattern) or
+                fnmatch(relpath(join(root, file_entry.name), directory), pattern)
+            ]
+
+        # Only the files matching the pattern count in the budget
+        if budget is not None:
+            allowed = budget.take(len(file_entries))
+            if allowed < len(file_entries):
+                file_entries = file_entries[:allowed]
+
+        for i, file_entry in enumerate(file_entries):
+            if budget is not None and i % BUDGET_CHECK_INTERVAL == BUDGET_CHECK_INTERVAL - 1 and budget.exceeded():
+                break
+
+            # We're just looking to count the files.
+            if countonly:
+                files.append((file_entry.name, None))
+                continue
+
+            try:
+                file_stat = file_entry.stat()
+
+            except OSError as ose:
+                self.warning(
+                    'DirectoryCheck: could not stat file {} - {}'.format(join(root, file_entry.name), ose)
+                )
+                files.append((file_entry.name, None))
+            else:
+                files.append((file_entry.name, (file_stat.st_size, file_stat.st_mtime, file_stat.st_ctime)))
+
+        return files
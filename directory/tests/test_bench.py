@@ -1,14 +1,39 @@
 # (C) Datadog, Inc. 2018
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
+import os
 import shutil
 import subprocess
 import sys
 import tempfile
 
+import pytest
+
 from datadog_checks.directory import DirectoryCheck
 
 
+@pytest.fixture(scope='module')
+def deep_tree():
+    """
+    A tree 4 levels deep with 5 sub-directories and 10 files per directory, ~7800 files.
+    Its directories are old enough to be cached by the incremental mode.
+    """
+    temp_dir = tempfile.mkdtemp()
+    directories = [temp_dir]
+    for _ in range(4):
+        directories = [os.path.join(parent, 'dir_{}'.format(i)) for parent in directories for i in range(5)]
+        for directory in directories:
+            os.mkdir(directory)
+    for root, _, _ in os.walk(temp_dir):
+        for i in range(10):
+            open(os.path.join(root, 'file_{}'.format(i)), 'a').close()
+        os.utime(root, (0, 0))
+
+    yield temp_dir
+
+    shutil.rmtree(temp_dir)
+
+
 def test_run(benchmark):
     temp_dir = tempfile.mkdtemp()
     command = [sys.executable, '-m', 'virtualenv', temp_dir]
@@ -21,3 +46,17 @@ def test_run(benchmark):
         benchmark(c.check, instance)
     finally:
         shutil.rmtree(temp_dir)
+
+
+def test_deep_tree(benchmark, deep_tree):
+    instance = {'directory': deep_tree, 'recursive': True}
+    c = DirectoryCheck('directory', None, {}, [instance])
+
+    benchmark(c.check, instance)
+
+
+def test_deep_tree_incremental(benchmark, deep_tree):
+    instance = {'directory': deep_tree, 'recursive': True, 'incremental': True}
+    c = DirectoryCheck('directory', None, {}, [instance])
+
+    benchmark(c.check, instance)
@@ -240,3 +240,102 @@ def test_non_existent_directory_ignore_missing(aggregator):
     config = {'directory': '/non-existent/directory',
               'ignore_missing': True}
     dir_check.check(config)
+
+
+def test_incremental(aggregator):
+    root = tempfile.mkdtemp()
+    try:
+        for sub in ('a', 'b', os.path.join('b', 'c')):
+            os.makedirs(os.path.join(root, sub))
+            for i in xrange(0, 3):
+                open(os.path.join(root, sub, 'file_' + str(i)), 'a').close()
+        # Directories modified within the last second are not cached
+        for path, _, _ in os.walk(root):
+            os.utime(path, (0, 0))
+
+        config = {'directory': root, 'recursive': True, 'incremental': True}
+        check = DirectoryCheck('directory', {}, {})
+        check.check(config)
+        aggregator.assert_metric('system.disk.directory.files', count=1, value=9)
+
+        # A new file changes the modification time of its directory, which is listed again
+        open(os.path.join(root, 'b', 'c', 'new_file'), 'a').close()
+        aggregator.reset()
+        check.check(config)
+        aggregator.assert_metric('system.disk.directory.files', count=1, value=10)
+        aggregator.assert_metric('system.disk.directory.file.bytes', count=10)
+
+        # The content of the unchanged directories comes from the cache
+        open(os.path.join(root, 'a', 'new_file'), 'a').close()
+        os.utime(os.path.join(root, 'a'), (0, 0))
+        aggregator.reset()
+        check.check(config)
+        aggregator.assert_metric('system.disk.directory.files', count=1, value=10)
+
+        # Not without the incremental mode
+        aggregator.reset()
+        check.check({'directory': root, 'recursive': True})
+        aggregator.assert_metric('system.disk.directory.files', count=1, value=11)
+    finally:
+        shutil.rmtree(root)
+
+
+def test_local_aggregation(aggregator):
+    config = {'directory': temp_dir, 'recursive': True, 'local_aggregation': True}
+    dir_check.check(config)
+
+    dir_tags = ['name:%s' % temp_dir]
+    for mname in DIRECTORY_METRICS:
+        aggregator.assert_metric(mname, count=0)
+        aggregator.assert_metric(mname + '.count', tags=dir_tags, count=1, value=17)
+        for suffix in ('.min', '.max', '.avg', '.median', '.95percentile'):
+            aggregator.assert_metric(mname + suffix, tags=dir_tags, count=1)
+    aggregator.assert_metric('system.disk.directory.files', tags=dir_tags, count=1, value=17)
+
+
+def test_aggregate():
+    from datadog_checks.directory.directory import aggregate
+
+    assert aggregate([3, 1, 2]) == (3, 1, 3, 2, 2, 3)
+    assert aggregate(range(1, 101)) == (100, 1, 100, 50.5, 50, 95)
+
+
+def test_threads(aggregator):
+    config = {'directory': temp_dir, 'recursive': True}
+    check = DirectoryCheck('directory', {'threads_count': 4}, {})
+    try:
+        check.check(config)
+    finally:
+        check.stop()
+
+    dir_tags = ['name:%s' % temp_dir]
+    aggregator.assert_metric('system.disk.directory.files', tags=dir_tags, count=1, value=17)
+    aggregator.assert_metric('system.disk.directory.file.bytes', tags=dir_tags, count=17)
+
+
+def test_max_files(aggregator):
+    config = {'directory': temp_dir, 'recursive': True, 'max_files': 5}
+    dir_check.check(config)
+
+    dir_tags = ['name:%s' % temp_dir, 'truncated:true']
+    aggregator.assert_metric('system.disk.directory.files', tags=dir_tags, count=1, value=5)
+    aggregator.assert_metric('system.disk.directory.file.bytes', tags=dir_tags, count=5)
+
+
+def test_max_files_pattern(aggregator):
+    # the files not matching the pattern don't count in the budget
+    for incremental in (False, True):
+        aggregator.reset()
+        config = {'directory': temp_dir, 'recursive': True, 'pattern': 'subfolder/*', 'max_files': 3,
+                  'incremental': incremental}
+        DirectoryCheck('directory', {}, {}).check(config)
+
+        dir_tags = ['name:%s' % temp_dir, 'truncated:true']
+        aggregator.assert_metric('system.disk.directory.files', tags=dir_tags, count=1, value=3)
+
+
+def test_max_scan_time(aggregator):
+    config = {'directory': temp_dir, 'recursive': True, 'max_scan_time': 0}
+    dir_check.check(config)
+
+    aggregator.assert_metric('system.disk.directory.files', tags=['name:%s' % temp_dir, 'truncated:true'], count=1)
@@ -8,9 +8,13 @@ import time
 import urlparse
 import requests
 from datadog_checks.checks import AgentCheck
+from datadog_checks.checks.libs.thread_pool import Pool
 from datadog_checks.config import _is_affirmative
 from datadog_checks.utils.headers import headers
 
+# The size of the ThreadPool used to query the different endpoints concurrently
+DEFAULT_SIZE_POOL = 4
+
 
 class NodeNotFound(Exception):
     pass
@@ -22,6 +26,7 @@ ESInstanceConfig = namedtuple(
         'pshard_stats',
         'pshard_graceful_to',
         'cluster_stats',
+        'filter_stats',
         'index_stats',
         'password',
         'service_check_tags',
@@ -390,12 +395,23 @@ class ESCheck(AgentCheck):
 
     SOURCE_TYPE_NAME = 'elasticsearch'
 
+    INDEX_STATS_URL = '/_cat/indices?format=json&bytes=b'
+
     def __init__(self, name, init_config, agentConfig, instances=None):
         AgentCheck.__init__(self, name, init_config, agentConfig, instances)
 
         # Host status needs to persist across all checks
         self.cluster_status = {}
 
+        self.pool_size = int(self.init_config.get('threads_count', DEFAULT_SIZE_POOL))
+        self.pool = None
+
+        # (version, cluster_stats) -> parameters returned by `_define_params`
+        self._params = {}
+        self._cluster_health_metrics = self._compile_metrics(self.CLUSTER_HEALTH_METRICS)
+        self._cluster_pending_tasks = self._compile_metrics(self.CLUSTER_PENDING_TASKS)
+        self._index_stats_metrics = self._compile_metrics(self.INDEX_STATS_METRICS)
+
     def get_instance_config(self, instance):
         url = instance.get('url')
         if url is None:
@@ -408,6 +424,7 @@ class ESCheck(AgentCheck):
         if 'is_external' in instance:
             cluster_stats = _is_affirmative(instance.get('is_external', False))
 
+        filter_stats = _is_affirmative(instance.get('filter_stats', False))
         pending_task_stats = _is_affirmative(instance.get('pending_task_stats', True))
         admin_forwarder = _is_affirmative(instance.get('admin_forwarder', False))
         # Support URLs that have a path in them from the config, for
@@ -437,6 +454,7 @@ class ESCheck(AgentCheck):
             pshard_stats=pshard_stats,
             pshard_graceful_to=pshard_graceful_to,
             cluster_stats=cluster_stats,
+            filter_stats=filter_stats,
             index_stats=index_stats,
             password=instance.get('password'),
             service_check_tags=service_check_tags,
@@ -465,13 +483,28 @@ class ESCheck(AgentCheck):
             raise
 
         health_url, stats_url, pshard_stats_url, pending_tasks_url, stats_metrics, \
-            pshard_stats_metrics = self._define_params(version, config.cluster_stats)
+            pshard_stats_metrics = self._define_params(version, config.cluster_stats, config.filter_stats)
+
+        # The endpoints are all queried concurrently, their data is processed in order
+        stats_url = self._join_url(config.url, stats_url, admin_forwarder)
+        health_url = self._join_url(config.url, health_url, admin_forwarder)
+        urls = [stats_url, health_url]
+        if config.pshard_stats:
+            pshard_stats_url = self._join_url(config.url, pshard_stats_url, admin_forwarder)
+            urls.append(pshard_stats_url)
+        if config.pending_task_stats:
+            pending_tasks_url = self._join_url(config.url, pending_tasks_url, admin_forwarder)
+            urls.append(pending_tasks_url)
+        index_stats = config.index_stats and version >= [1, 0, 0]
+        if index_stats:
+            index_url = self._join_url(config.url, self.INDEX_STATS_URL, admin_forwarder)
+            urls.append(index_url)
+        responses = self._request_all(urls, config)
 
         # Load stats data.
         # This must happen before other URL processing as the cluster name
         # is retreived here, and added to the tag list.
-        stats_url = self._join_url(config.url, stats_url, admin_forwarder)
-        stats_data = self._get_data(stats_url, config)
+        stats_data = self._get_response_data(stats_url, config, *responses[stats_url])
         if stats_data['cluster_name']:
             # retreive the cluster name from the data, and append it to the
             # master tag list.
@@ -484,9 +517,10 @@ class ESCheck(AgentCheck):
         # Note: this is a cluster-wide query, might TO.
         if config.pshard_stats:
             send_sc = bubble_ex = not config.pshard_graceful_to
-            pshard_stats_url = self._join_url(config.url, pshard_stats_url, admin_forwarder)
             try:
-                pshard_stats_data = self._get_data(pshard_stats_url, config, send_sc=send_sc)
+                pshard_stats_data = self._get_response_data(
+                    pshard_stats_url, config, *responses[pshard_stats_url], send_sc=send_sc
+                )
                 self._process_pshard_stats_data(pshard_stats_data, config, pshard_stats_metrics)
             except requests.ReadTimeout as e:
                 if bubble_ex:
@@ -494,19 +528,18 @@ class ESCheck(AgentCheck):
                 self.log.warning("Timed out reading pshard-stats from servers (%s) - stats will be missing", e)
 
         # Load the health data.
-        health_url = self._join_url(config.url, health_url, admin_forwarder)
-        health_data = self._get_data(health_url, config)
+        health_data = self._get_response_data(health_url, config, *responses[health_url])
         self._process_health_data(health_data, config)
 
         if config.pending_task_stats:
             # Load the pending_tasks data.
-            pending_tasks_url = self._join_url(config.url, pending_tasks_url, admin_forwarder)
-            pending_tasks_data = self._get_data(pending_tasks_url, config)
+            pending_tasks_data = self._get_response_data(pending_tasks_url, config, *responses[pending_tasks_url])
             self._process_pending_tasks_data(pending_tasks_data, config)
 
-        if config.index_stats and version >= [1, 0, 0]:
+        if index_stats:
             try:
-                self._get_index_metrics(config, admin_forwarder)
+                index_data = self._get_response_data(index_url, config, *responses[index_url])
+                self._process_index_data(index_data, config)
             except requests.ReadTimeout as e:
                 self.log.warning("Timed out reading index stats from servers (%s) - stats will be missing", e)
 
@@ -548,13 +581,9 @@ class ESCheck(AgentCheck):
         else:
             return urlparse.urljoin(base, url)
 
-    def _get_index_metrics(self, config, admin_forwarder):
-        cat_url = '/_cat/indices?format=json&bytes=b'
-        index_url = self._join_url(config.url, cat_url, admin_forwarder)
-        index_resp = self._get_data(index_url, config)
-        index_stats_metrics = self.INDEX_STATS_METRICS
+    def _process_index_data(self, data, config):
         health_stat = {'green': 0, 'yellow': 1, 'red': 2}
-        for idx in index_resp:
+        for idx in data:
             tags = config.tags + ['index_name:' + idx['index']]
             index_data = {
                 'docs_count':         idx.get('docs.count', None),
@@ -576,16 +605,43 @@ class ESCheck(AgentCheck):
                     del index_data[key]
                     self.log.warning("The index metric data for %s was not found", key)
 
-            for metric in index_stats_metrics:
-                # metric description
-                desc = index_stats_metrics[metric]
-                self._process_metric(index_data, metric, *desc, tags=tags)
+            self._process_metrics(index_data, self._index_stats_metrics, tags=tags)
 
-    def _define_params(self, version, cluster_stats):
+    def _define_params(self, version, cluster_stats, filter_stats=False):
         """ Define the set of URLs and METRICS to use depending on the
             running ES version.
+            The metrics are returned compiled, see `_compile_metrics`.
+            With `filter_stats`, the nodes stats are trimmed by ES to the
+            sections holding the collected metrics.
         """
+        key = (tuple(version), cluster_stats, filter_stats)
+        if key not in self._params:
+            health_url, stats_url, pshard_stats_url, pending_tasks_url, stats_metrics, \
+                pshard_stats_metrics = self._define_raw_params(version, cluster_stats)
+            stats_metrics = self._compile_metrics(stats_metrics)
+
+            # `filter_path` is supported since ES 1.6
+            if filter_stats and version >= [1, 6, 0]:
+                stats_url += '&' if '?' in stats_url else '?'
+                stats_url += 'filter_path=' + self._stats_filter_path(stats_metrics)
+
+            self._params[key] = (
+                health_url, stats_url, pshard_stats_url, pending_tasks_url,
+                stats_metrics, self._compile_metrics(pshard_stats_metrics)
+            )
+        return self._params[key]
 
+    @staticmethod
+    def _stats_filter_path(stats_metrics):
+        """ Return the `filter_path` selecting the parent object of every metric of the nodes stats,
+            rather than the metrics themselves to keep the url short
+        """
+        paths = set(['cluster_name', 'nodes.*.name', 'nodes.*.host', 'nodes.*.hostname'])
+        for _, _, keys, _, _ in stats_metrics:
+            paths.add('nodes.*.' + '.'.join(keys[:-1] or keys))
+        return ','.join(sorted(paths))
+
+    def _define_raw_params(self, version, cluster_stats):
         pshard_stats_url = "/_stats"
 
         if version >= [0, 90, 10]:
@@ -676,6 +732,27 @@ class ESCheck(AgentCheck):
     def _get_data(self, url, config, send_sc=True):
         """ Hit a given URL and return the parsed json
         """
+        return self._get_response_data(url, config, *self._request(url, config), send_sc=send_sc)
+
+    def _request_all(self, urls, config):
+        """ Hit the given URLs concurrently and return a `{url: (response, exception)}` dictionary
+        """
+        if self.pool is None:
+            self.log.debug("Starting Thread Pool of size %s", self.pool_size)
+            self.pool = Pool(self.pool_size)
+
+        return dict(zip(urls, self.pool.map(lambda url: self._request(url, config), urls)))
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def _request(self, url, config):
+        """ Hit a given URL and return the `(response, exception)` pair, the latter
+            being None if the request succeeded
+        """
         # Load basic authentication configuration, if available.
         if config.username and config.password:
             auth = (config.username, config.password)
@@ -698,7 +775,7 @@ class ESCheck(AgentCheck):
 
         resp = None
         try:
-            resp = requests.get(
+            resp = self.get_http_session(url, cert=cert, verify=verify).get(
                 url,
                 timeout=config.timeout,
                 headers=headers(self.agentConfig),
@@ -708,6 +785,14 @@ class ESCheck(AgentCheck):
             )
             resp.raise_for_status()
         except Exception as e:
+            return resp, e
+
+        return resp, None
+
+    def _get_response_data(self, url, config, resp, error, send_sc=True):
+        """ Return the parsed json of a response returned by `_request`, raise its error if it failed
+        """
+        if error is not None:
             # this means we've hit a particular kind of auth error that means the config is broken
             if resp and resp.status_code == 400:
                 raise AuthenticationError("The ElasticSearch credentials are incorrect")
@@ -716,10 +801,10 @@ class ESCheck(AgentCheck):
                 self.service_check(
                     self.SERVICE_CHECK_CONNECT_NAME,
                     AgentCheck.CRITICAL,
-                    message="Error {0} when hitting {1}".format(e, url),
+                    message="Error {0} when hitting {1}".format(error, url),
                     tags=config.service_check_tags
                 )
-            raise
+            raise error
 
         return resp.json()
 
@@ -739,10 +824,7 @@ class ESCheck(AgentCheck):
             'pending_tasks_time_in_queue':      average_time_in_queue/(total or 1),  # if total is 0
         }
 
-        for metric in self.CLUSTER_PENDING_TASKS:
-            # metric description
-            desc = self.CLUSTER_PENDING_TASKS[metric]
-            self._process_metric(node_data, metric, *desc, tags=config.tags)
+        self._process_metrics(node_data, self._cluster_pending_tasks, tags=config.tags)
 
     def _process_stats_data(self, data, stats_metrics, config):
         cluster_stats = config.cluster_stats
@@ -764,42 +846,45 @@ class ESCheck(AgentCheck):
                         metric_hostname = node_data[k]
                         break
 
-            for metric, desc in stats_metrics.iteritems():
-                self._process_metric(
-                    node_data, metric, *desc,
-                    tags=metrics_tags, hostname=metric_hostname
-                )
+            self._process_metrics(node_data, stats_metrics, tags=metrics_tags, hostname=metric_hostname)
 
     def _process_pshard_stats_data(self, data, config, pshard_stats_metrics):
-        for metric, desc in pshard_stats_metrics.iteritems():
-            self._process_metric(data, metric, *desc, tags=config.tags)
+        self._process_metrics(data, pshard_stats_metrics, tags=config.tags)
 
-    def _process_metric(self, data, metric, xtype, path, xform=None,
-                        tags=None, hostname=None):
+    @staticmethod
+    def _compile_metrics(metrics):
+        """
+        Turn a `{metric: (xtype, path[, xform])}` dictionary into a list of
+        `(metric, xtype, keys, xform, path)` tuples, `keys` being the path split once and for all
+        """
+        return [
+            (metric, desc[0], tuple(desc[1].split('.')), desc[2] if len(desc) > 2 else None, desc[1])
+            for metric, desc in metrics.iteritems()
+        ]
+
+    def _process_metrics(self, data, compiled_metrics, tags=None, hostname=None):
         """
         data: dictionary containing all the stats
-        metric: datadog metric
-        path: corresponding path in data, flattened, e.g. thread_pool.bulk.queue
-        xform: a lambda to apply to the numerical value
+        compiled_metrics: the metrics to submit, as returned by `_compile_metrics`
         """
-        value = data
+        for metric, xtype, keys, xform, path in compiled_metrics:
+            value = data
 
-        # Traverse the nested dictionaries
-        for key in path.split('.'):
-            if value is not None:
-                value = value.get(key, None)
-            else:
-                break
+            # Traverse the nested dictionaries
+            for key in keys:
+                value = value.get(key)
+                if value is None:
+                    break
 
-        if value is not None:
-            if xform:
-                value = xform(value)
-            if xtype == "gauge":
-                self.gauge(metric, value, tags=tags, hostname=hostname)
+            if value is not None:
+                if xform:
+                    value = xform(value)
+                if xtype == "gauge":
+                    self.gauge(metric, value, tags=tags, hostname=hostname)
+                else:
+                    self.rate(metric, value, tags=tags, hostname=hostname)
             else:
-                self.rate(metric, value, tags=tags, hostname=hostname)
-        else:
-            self._metric_not_found(metric, path)
+                self._metric_not_found(metric, path)
 
     def _process_health_data(self, data, config):
         if self.cluster_status.get(config.url) is None:
@@ -813,8 +898,7 @@ class ESCheck(AgentCheck):
             event = self._create_event(data['status'], tags=config.tags)
             self.event(event)
 
-        for metric, desc in self.CLUSTER_HEALTH_METRICS.iteritems():
-            self._process_metric(data, metric, *desc, tags=config.tags)
+        self._process_metrics(data, self._cluster_health_metrics, tags=config.tags)
 
         # Process the service check
         cluster_status = data['status']
@@ -1,14 +1,62 @@
 # (C) Datadog, Inc. 2018
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
+import json
 import time
 
+import mock
+import pytest
 import requests
 
 from datadog_checks.elastic import ESCheck
 from .common import CHECK_NAME, CONFIG, PASSWORD, URL, USER
 
 
+class MockResponse:
+    def __init__(self, content):
+        self.content = content
+        self.status_code = 200
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return json.loads(self.content)
+
+
+@pytest.fixture(scope='module')
+def large_cluster():
+    """
+    The responses of a 150 nodes cluster, by url path
+    """
+    elastic_check = ESCheck(CHECK_NAME, {}, {})
+    version = [6, 0, 1]
+    health_url, stats_url, pshard_stats_url, pending_tasks_url, stats_metrics, \
+        pshard_stats_metrics = elastic_check._define_params(version, True)
+
+    node = {}
+    for _, _, keys, _, _ in stats_metrics:
+        parent = node
+        for key in keys[:-1]:
+            parent = parent.setdefault(key, {})
+        parent[keys[-1]] = 42
+    nodes = {}
+    for i in range(150):
+        nodes['node-{}'.format(i)] = dict(node, name='node-{}'.format(i), host='10.0.0.{}'.format(i))
+
+    health = {
+        'cluster_name': 'elasticsearch', 'status': 'green', 'timed_out': False, 'number_of_nodes': 150,
+        'number_of_data_nodes': 150, 'active_primary_shards': 750, 'active_shards': 1500, 'relocating_shards': 0,
+        'initializing_shards': 0, 'unassigned_shards': 0,
+    }
+    return {
+        '/': json.dumps({'version': {'number': '.'.join(map(str, version))}}),
+        stats_url: json.dumps({'cluster_name': 'elasticsearch', 'nodes': nodes}),
+        health_url: json.dumps(health),
+        pending_tasks_url: json.dumps({'tasks': [{'priority': 'high', 'time_in_queue_millis': 10}] * 20}),
+    }
+
+
 def test_check(benchmark):
     elastic_check = ESCheck(CHECK_NAME, {}, {})
 
@@ -40,3 +88,18 @@ def test_index_metrics(benchmark):
     elastic_check = ESCheck(CHECK_NAME, {}, {})
 
     benchmark(elastic_check.check, config)
+
+
+def test_large_cluster(benchmark, large_cluster):
+    config = {'url': URL, 'cluster_stats': True}
+    elastic_check = ESCheck(CHECK_NAME, {}, {})
+
+    def get(url, **kwargs):
+        path = url[len(URL):] or '/'
+        return MockResponse(large_cluster[path])
+
+    try:
+        with mock.patch('requests.Session.get', side_effect=get):
+            benchmark(elastic_check.check, config)
+    finally:
+        elastic_check.stop()
@@ -274,3 +274,21 @@ def test_health_event(aggregator):
                                                               + dummy_tags + CLUSTER_TAG))
     else:
         aggregator.assert_service_check('elasticsearch.cluster_health')
+
+
+def test_stats_filter_path():
+    elastic_check = ESCheck(CHECK_NAME, {}, {})
+
+    stats_url = elastic_check._define_params([6, 0, 1], False, filter_stats=True)[1]
+    url, filter_path = stats_url.split('?filter_path=')
+    assert url == '/_nodes/_local/stats'
+    filter_path = filter_path.split(',')
+    for path in ['cluster_name', 'nodes.*.name', 'nodes.*.host', 'nodes.*.jvm.mem', 'nodes.*.indices.docs']:
+        assert path in filter_path
+
+    stats_url = elastic_check._define_params([2, 4, 0], True, filter_stats=True)[1]
+    assert stats_url.startswith('/_nodes/stats?all=true&filter_path=cluster_name,')
+
+    # filter_path is not supported
+    assert elastic_check._define_params([1, 5, 0], True, filter_stats=True)[1] == '/_nodes/stats?all=true'
+    assert elastic_check._define_params([6, 0, 1], True)[1] == '/_nodes/stats'
@@ -38,7 +38,7 @@ class Envoy(AgentCheck):
         timeout = int(instance.get('timeout', 20))
 
         try:
-            response = requests.get(
+            response = self.get_http_session(stats_url, verify=verify_ssl).get(
                 stats_url, auth=auth, verify=verify_ssl, proxies=proxies, timeout=timeout
             )
         except requests.exceptions.Timeout:
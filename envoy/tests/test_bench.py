@@ -18,7 +18,7 @@ def test_fixture(benchmark):
     instance = INSTANCES['main']
     c = Envoy('envoy', None, {}, [instance])
 
-    with mock.patch('requests.get', return_value=response('multiple_services')):
+    with mock.patch('requests.Session.get', return_value=response('multiple_services')):
         # Run once to get logging of unknown metrics out of the way.
         c.check(instance)
 
@@ -3,8 +3,11 @@
 # Licensed under Simplified BSD License (see LICENSE)
 
 # stdlib
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import copy
+import csv
+import glob
+import io
 import re
 import socket
 import time
@@ -15,6 +18,7 @@ import requests
 
 # project
 from datadog_checks.checks import AgentCheck
+from datadog_checks.checks.libs.thread_pool import Pool
 from datadog_checks.config import _is_affirmative
 from datadog_checks.utils.headers import headers
 
@@ -22,6 +26,9 @@ STATS_URL = "/;csv;norefresh"
 EVENT_TYPE = SOURCE_TYPE_NAME = 'haproxy'
 BUFSIZE = 8192
 
+# The size of the ThreadPool used to fetch the stats of several sockets
+DEFAULT_SIZE_POOL = 8
+
 
 class Services(object):
     BACKEND = 'BACKEND'
@@ -53,6 +60,16 @@ class Services(object):
         'nolb': UNAVAILABLE,
     }
 
+    # The statuses from the worst to the best, when merging the statuses reported by several
+    # processes. The other statuses rank after them.
+    STATUS_SEVERITY = {
+        'down': 0,
+        'maint': 1,
+        'nolb': 2,
+        'up': 3,
+        'open': 3,
+    }
+
     STATUS_TO_SERVICE_CHECK = {
         'up': AgentCheck.OK,
         'down': AgentCheck.CRITICAL,
@@ -71,6 +88,9 @@ class HAProxy(AgentCheck):
         # https://gist.github.com/hrldcpr/2012250
         self.host_status = defaultdict(lambda: defaultdict(lambda: None))
 
+        self.pool_size = int(self.init_config.get('threads_count', DEFAULT_SIZE_POOL))
+        self.pool = None
+
     METRICS = {
         "qcur": ("gauge", "queue.current"),
         "scur": ("gauge", "session.current"),
@@ -100,16 +120,40 @@ class HAProxy(AgentCheck):
         "lastchg": ("gauge", "uptime")
     }
 
+    # Non-metric fields of the stats the check relies on
+    FIELDS = ('pxname', 'svname', 'status')
+
+    # How the metrics of the different processes are merged when reading several stats sockets:
+    # counters, current sessions and queues and their limits add up, times are averaged and the
+    # uptime is the one of the most recent status change. `spct` is computed after the merge.
+    METRICS_MERGE = dict.fromkeys([key for key, (mtype, _) in METRICS.iteritems() if mtype == 'rate'], 'sum')
+    METRICS_MERGE.update({
+        'qcur': 'sum',
+        'scur': 'sum',
+        'slim': 'sum',
+        'req_rate': 'sum',
+        'qtime': 'avg',
+        'ctime': 'avg',
+        'rtime': 'avg',
+        'ttime': 'avg',
+        'lastchg': 'min',
+    })
+
     SERVICE_CHECK_NAME = 'haproxy.backend_up'
 
     def check(self, instance):
         url = instance.get('url')
         self.log.debug('Processing HAProxy data for %s' % url)
 
-        parsed_url = urlparse.urlparse(url)
+        parsed_url = None if isinstance(url, list) else urlparse.urlparse(url)
+
+        if parsed_url is None or (parsed_url.scheme == 'unix' and glob.has_magic(parsed_url.path)):
+            # One stats socket per HAProxy process, their stats are merged
+            url, socket_paths = self._socket_paths(url)
+            stats = self._fetch_sockets_data(socket_paths)
 
-        if parsed_url.scheme == 'unix':
-            data = self._fetch_socket_data(parsed_url.path)
+        elif parsed_url.scheme == 'unix':
+            stats = [self._fetch_socket_data(parsed_url.path)]
 
         else:
             username = instance.get('username')
@@ -121,7 +165,7 @@ class HAProxy(AgentCheck):
             for key, value in custom_headers.items():
                 custom_headers[key] = str(value)
 
-            data = self._fetch_url_data(url, username, password, verify, custom_headers)
+            stats = [self._fetch_url_data(url, username, password, verify, custom_headers)]
 
         collect_aggregates_only = _is_affirmative(
             instance.get('collect_aggregates_only', True)
@@ -155,12 +199,16 @@ class HAProxy(AgentCheck):
         active_tag_bool = instance.get('active_tag', False)
         active_tag = []
         if active_tag_bool:
-            active_tag.append("active:%s" % ('true' if 'act' in data else 'false'))
+            # the lines of the stats pages are streamed, they're needed twice
+            stats = [list(data) for data in stats]
+            active_tag.append("active:%s" % ('true' if any('act' in data for data in stats) else 'false'))
 
         process_events = instance.get('status_check', self.init_config.get('status_check', False))
 
-        self._process_data(
-            data, collect_aggregates_only, process_events,
+        data_dicts = self._merge_data_dicts([self._parse_data(data) for data in stats])
+
+        self._process_data_dicts(
+            data_dicts, collect_aggregates_only, process_events,
             url=url, collect_status_metrics=collect_status_metrics,
             collect_status_metrics_by_host=collect_status_metrics_by_host,
             tag_service_check_by_host=tag_service_check_by_host,
@@ -187,10 +235,24 @@ class HAProxy(AgentCheck):
                                 auth=auth,
                                 headers=custom_headers,
                                 verify=verify,
-                                timeout=self.default_integration_http_timeout)
-        response.raise_for_status()
+                                timeout=self.default_integration_http_timeout,
+                                stream=True)
+        try:
+            response.raise_for_status()
+        except Exception:
+            response.close()
+            raise
 
-        return response.content.splitlines()
+        return self._iter_response_lines(response)
+
+    @staticmethod
+    def _iter_response_lines(response):
+        ''' Yield the lines of the response as they are received, the body isn't loaded in memory at once '''
+        try:
+            for line in response.iter_lines(chunk_size=BUFSIZE):
+                yield line
+        finally:
+            response.close()
 
     def _fetch_socket_data(self, socket_path):
         ''' Hit a given stats socket and return the stats lines '''
@@ -201,55 +263,139 @@ class HAProxy(AgentCheck):
         sock.connect(socket_path)
         sock.send("show stat\r\n")
 
-        response = ""
+        # Accumulate the chunks in a buffer, concatenating strings is quadratic on large dumps
+        response = io.BytesIO()
         output = sock.recv(BUFSIZE)
         while output:
-            response += output.decode("ASCII")
+            response.write(output)
             output = sock.recv(BUFSIZE)
 
         sock.close()
 
-        return response.splitlines()
+        return response.getvalue().splitlines()
 
-    def _process_data(self, data, collect_aggregates_only, process_events, url=None,
-                      collect_status_metrics=False, collect_status_metrics_by_host=False,
-                      tag_service_check_by_host=False, services_incl_filter=None,
-                      services_excl_filter=None, collate_status_tags_per_host=False,
-                      count_status_by_service=True, custom_tags=None, tags_regex=None, active_tag=None):
-        ''' Main data-processing loop. For each piece of useful data, we'll
-        either save a metric, save an event or both. '''
+    def _socket_paths(self, url):
+        ''' Expand the given list or glob of stats sockets urls, return the url to tag with and the socket paths '''
+        urls = url if isinstance(url, list) else [url]
+
+        socket_paths = []
+        for socket_url in urls:
+            parsed_url = urlparse.urlparse(socket_url)
+            if parsed_url.scheme != 'unix':
+                raise Exception("Only the stats of unix sockets can be merged, got {}".format(socket_url))
+            if glob.has_magic(parsed_url.path):
+                socket_paths.extend(sorted(glob.glob(parsed_url.path)))
+            else:
+                socket_paths.append(parsed_url.path)
+
+        if not socket_paths:
+            raise Exception("No stats socket matching {}".format(url))
 
-        # Split the first line into an index of fields
-        # The line looks like (broken up onto multiple lines)
+        return ','.join(urls), socket_paths
+
+    def _fetch_sockets_data(self, socket_paths):
+        ''' Hit the given stats sockets concurrently and return their stats lines '''
+        if self.pool is None:
+            self.log.debug("Starting Thread Pool of size %s", self.pool_size)
+            self.pool = Pool(self.pool_size)
+
+        return self.pool.map(self._fetch_socket_data, socket_paths)
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def _parse_data(self, data):
+        ''' Parse the stats lines into a dictionary per frontend, backend and server '''
+
+        # The csv module takes care of the quoted values, including the ones spanning several lines.
+        # The first line is the header, it looks like (broken up onto multiple lines)
         # "# pxname,svname,qcur,qmax,scur,smax,slim,
         # stot,bin,bout,dreq,dresp,ereq,econ,eresp,wretr,
         # wredis,status,weight,act,bck,chkfail,chkdown,lastchg,
         # downtime,qlimit,pid,iid,sid,throttle,lbtot,tracked,
         # type,rate,rate_lim,rate_max,"
-        fields = [f.strip() for f in data[0][2:].split(',') if f]
+        rows = csv.reader(data)
+        fields_index = self._fields_index(next(rows, []))
 
-        self.hosts_statuses = defaultdict(int)
+        # Store each line's values in a dictionary
+        data_dicts = [self._row_to_dict(fields_index, row) for row in rows if any(row)]
 
+        # Go backwards to set back_or_front
         back_or_front = None
+        for data_dict in reversed(data_dicts):
+            if self._is_aggregate(data_dict):
+                back_or_front = data_dict['svname']
 
-        # Sanitize CSV, handle line breaks
-        data = self._sanitize_lines(data)
-        custom_tags = [] if custom_tags is None else custom_tags
-        active_tag = [] if active_tag is None else active_tag
+            self._update_data_dict(data_dict, back_or_front)
 
-        # Skip the first line, go backwards to set back_or_front
-        for line in data[:0:-1]:
-            if not line.strip():
-                continue
+        return data_dicts
+
+    def _merge_data_dicts(self, data_dicts_per_process):
+        ''' Merge the stats of the different HAProxy processes per (service, server),
+        as defined by `METRICS_MERGE`. The worst status reported by a process is kept. '''
+        if len(data_dicts_per_process) == 1:
+            return data_dicts_per_process[0]
+
+        merged = OrderedDict()
+        averaged = defaultdict(int)
+        for data_dicts in data_dicts_per_process:
+            for data_dict in data_dicts:
+                key = (data_dict['pxname'], data_dict['svname'])
+                merged_dict = merged.get(key)
+                if merged_dict is None:
+                    merged[key] = dict(data_dict)
+                    continue
+
+                for field, value in data_dict.iteritems():
+                    merge = self.METRICS_MERGE.get(field)
+                    if field == 'status':
+                        if self._status_severity(value) < self._status_severity(merged_dict.get(field)):
+                            merged_dict[field] = value
+                    elif merge is None or not isinstance(value, float):
+                        merged_dict.setdefault(field, value)
+                    elif not isinstance(merged_dict.get(field), float):
+                        merged_dict[field] = value
+                    elif merge == 'min':
+                        merged_dict[field] = min(merged_dict[field], value)
+                    else:
+                        merged_dict[field] += value
+                        if merge == 'avg':
+                            averaged[key, field] += 1
 
-            # Store each line's values in a dictionary
-            data_dict = self._line_to_dict(fields, line)
+        for (key, field), count in averaged.iteritems():
+            merged[key][field] /= count + 1
 
-            if self._is_aggregate(data_dict):
-                back_or_front = data_dict['svname']
+        data_dicts = merged.values()
+        for data_dict in data_dicts:
+            self._update_data_dict(data_dict, data_dict['back_or_front'])
 
-            self._update_data_dict(data_dict, back_or_front)
+        return data_dicts
+
+    @staticmethod
+    def _status_severity(status):
+        return Services.STATUS_SEVERITY.get(status, len(Services.STATUS_SEVERITY))
+
+    def _process_data(self, data, collect_aggregates_only, process_events, **kwargs):
+        ''' Process the given stats lines, see `_process_data_dicts` '''
+        self._process_data_dicts(self._parse_data(data), collect_aggregates_only, process_events, **kwargs)
+
+    def _process_data_dicts(self, data_dicts, collect_aggregates_only, process_events, url=None,
+                            collect_status_metrics=False, collect_status_metrics_by_host=False,
+                            tag_service_check_by_host=False, services_incl_filter=None,
+                            services_excl_filter=None, collate_status_tags_per_host=False,
+                            count_status_by_service=True, custom_tags=None, tags_regex=None, active_tag=None):
+        ''' Main data-processing loop. For each piece of useful data, we'll
+        either save a metric, save an event or both. '''
 
+        self.hosts_statuses = defaultdict(int)
+
+        custom_tags = [] if custom_tags is None else custom_tags
+        active_tag = [] if active_tag is None else active_tag
+
+        for data_dict in reversed(data_dicts):
             self._update_hosts_statuses_if_needed(
                 collect_status_metrics, collect_status_metrics_by_host,
                 data_dict, self.hosts_statuses
@@ -307,68 +453,45 @@ class HAProxy(AgentCheck):
                 active_tag=active_tag,
             )
 
-        return data
-
-    def _sanitize_lines(self, data):
-        sanitized = []
-
-        def char_count(line, char):
-            count = 0
-
-            for c in line:
-                if c is char:
-                    count += 1
-
-            return count
-
-        clean = ''
-        double_quotes = 0
-        for line in data:
-            double_quotes += char_count(line, '"')
-            clean += line
-
-            if double_quotes % 2 == 0:
-                sanitized.append(clean.replace('\n', '').replace('\r', ''))
-                double_quotes = 0
-                clean = ''
-
-        return sanitized
+    @classmethod
+    def _fields_index(cls, header):
+        """
+        Return the (position, name, is_metric) of the header fields used by the check,
+        the others are not worth converting
+        """
+        if header:
+            header[0] = header[0].lstrip('# ')
+        fields_index = []
+        for i, field in enumerate(header):
+            field = field.strip()
+            if field in cls.METRICS:
+                fields_index.append((i, field, True))
+            elif field in cls.FIELDS:
+                fields_index.append((i, field, False))
+        return fields_index
 
-    def _line_to_dict(self, fields, line):
+    @staticmethod
+    def _row_to_dict(fields_index, row):
         data_dict = {}
-        values = line.split(',')
-        if len(values) > len(fields):
-            values = self._gather_quoted_values(values)
-        for i, val in enumerate(values):
-            if val:
+        for i, field, is_metric in fields_index:
+            try:
+                val = row[i]
+            except IndexError:
+                break
+            if not val:
+                continue
+            if is_metric:
                 try:
-                    # Try converting to a long, if failure, just leave it
                     val = float(val)
-                except Exception:
+                except ValueError:
                     pass
-                data_dict[fields[i]] = val
+            data_dict[field] = val
 
         if 'status' in data_dict:
-            data_dict['status'] = self._normalize_status(data_dict['status'])
+            data_dict['status'] = HAProxy._normalize_status(data_dict['status'])
 
         return data_dict
 
-    def _gather_quoted_values(self, values):
-        gathered_values = []
-        previous = ''
-        for val in values:
-            if val.startswith('"') and not val.endswith('"'):
-                previous = val
-            elif previous:
-                if val.endswith('"'):
-                    gathered_values.append(previous + val)
-                    previous = ''
-                else:
-                    previous += val
-            else:
-                gathered_values.append(val)
-        return gathered_values
-
     def _update_data_dict(self, data_dict, back_or_front):
         """
         Adds spct if relevant, adds service
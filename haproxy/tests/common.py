@@ -1,5 +1,8 @@
+import io
 import os
 
+import requests
+
 from datadog_checks.utils.common import get_docker_hostname
 
 AGG_STATUSES_BY_SERVICE = (
@@ -123,3 +126,11 @@ BACKEND_CHECK_GAUGES_POST_1_7 = [
 ]
 
 SERVICE_CHECK_NAME = 'haproxy.backend_up'
+
+
+def mock_response(data):
+    """ A streamed response to a stats page request, with data as body """
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(data)
+    return response
@@ -26,7 +26,7 @@ def haproxy_mock():
     filepath = os.path.join(common.HERE, 'fixtures', 'mock_data')
     with open(filepath, 'r') as f:
         data = f.read()
-    p = mock.patch('requests.get', return_value=mock.Mock(content=data))
+    p = mock.patch('requests.get', side_effect=lambda *args, **kwargs: common.mock_response(data))
     yield p.start()
     p.stop()
 
@@ -36,7 +36,7 @@ def haproxy_mock_evil():
     filepath = os.path.join(common.HERE, 'fixtures', 'mock_data_evil')
     with open(filepath, 'r') as f:
         data = f.read()
-    p = mock.patch('requests.get', return_value=mock.Mock(content=data))
+    p = mock.patch('requests.get', side_effect=lambda *args, **kwargs: common.mock_response(data))
     yield p.start()
     p.stop()
 
@@ -0,0 +1,47 @@
+# (C) Datadog, Inc. 2018
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+import mock
+import pytest
+
+import common
+
+from datadog_checks.haproxy import HAProxy
+
+HEADER = (
+    '# pxname,svname,qcur,qmax,scur,smax,slim,stot,bin,bout,dreq,dresp,ereq,econ,eresp,wretr,wredis,status,'
+    'weight,act,bck,chkfail,chkdown,lastchg,downtime,qlimit,pid,iid,sid,throttle,lbtot,tracked,type,rate,'
+    'rate_lim,rate_max,check_status,check_code,check_duration,hrsp_1xx,hrsp_2xx,hrsp_3xx,hrsp_4xx,hrsp_5xx,'
+    'hrsp_other,hanafail,req_rate,req_rate_max,req_tot,cli_abrt,srv_abrt,'
+)
+SERVER = (
+    'be_{0},i-{1},0,0,{1},12,,{1},1024,2048,,0,,0,0,0,0,UP 1/2,1,1,0,0,1,1,30,,1,3,1,,70,,2,0,,1,L7OK,200,1,'
+    '0,{1},0,3,1,0,0,,,,0,0,'
+)
+BACKEND = (
+    'be_{0},BACKEND,0,0,1,2,0,421,1,0,0,0,,0,0,0,0,UP,6,6,0,,0,1,0,,1,3,0,,421,,1,0,,1,,,,0,421,0,3,1,0,,,,,0,0,'
+)
+
+
+@pytest.fixture(scope='module')
+def large_stats():
+    """
+    A `show stat` output with 100 backends of 200 servers each
+    """
+    lines = [HEADER]
+    for backend in range(100):
+        lines.extend(SERVER.format(backend, server) for server in range(200))
+        lines.append(BACKEND.format(backend))
+    return '\n'.join(lines)
+
+
+def test_large_stats(benchmark, aggregator, large_stats):
+    instance = {
+        'url': 'http://localhost/admin?stats',
+        'collect_aggregates_only': False,
+        'collect_status_metrics': True,
+    }
+    c = HAProxy(common.CHECK_NAME, {}, {})
+
+    with mock.patch('requests.get', side_effect=lambda *args, **kwargs: common.mock_response(large_stats)):
+        benchmark(c.check, instance)
@@ -1,4 +1,5 @@
 import os
+import mock
 import copy
 
 import common
@@ -258,3 +259,134 @@ def test_regex_tags(aggregator, haproxy_mock):
             'team:sre',
             'backend:i-1']
     aggregator.assert_service_check('haproxy.backend_up', tags=tags)
+
+
+def test_fetch_url_data():
+    filepath = os.path.join(common.HERE, 'fixtures', 'mock_data_evil')
+    with open(filepath, 'r') as f:
+        data = f.read()
+    response = common.mock_response(data)
+
+    haproxy_check = HAProxy(common.CHECK_NAME, {}, {})
+    with mock.patch('requests.get', return_value=response) as get, \
+            mock.patch.object(response, 'close', wraps=response.close) as close, \
+            mock.patch('datadog_checks.haproxy.haproxy.BUFSIZE', 100):
+        lines = haproxy_check._fetch_url_data('http://localhost/admin', None, None, True, {})
+        assert get.call_args[1]['stream'] is True
+
+        # the body is read as it is parsed
+        assert next(lines) == data.splitlines()[0]
+        assert response.raw.tell() < len(data)
+        assert not close.called
+        assert list(lines) == data.splitlines()[1:]
+        assert close.call_count == 1
+
+
+def test_fetch_socket_data():
+    filepath = os.path.join(common.HERE, 'fixtures', 'mock_data_evil')
+    with open(filepath, 'r') as f:
+        data = f.read()
+    # the payload is received in chunks cutting lines and quoted values
+    chunks = [data[i:i + 100] for i in range(0, len(data), 100)] + ['']
+
+    haproxy_check = HAProxy(common.CHECK_NAME, {}, {})
+    with mock.patch('socket.socket') as sock:
+        sock.return_value.recv.side_effect = chunks
+        lines = haproxy_check._fetch_socket_data('/run/haproxy.sock')
+
+    sock.return_value.send.assert_called_once_with("show stat\r\n")
+    assert lines == data.splitlines()
+
+
+def test_process_data_fields(aggregator):
+    haproxy_check = HAProxy(common.CHECK_NAME, {}, {})
+    data = [
+        '# pxname,svname,scur,slim,status,check_status,',
+        '"a,1",i-1,3,12,UP 1/2,"L7OK',
+        'garbled",',
+        'a,BACKEND,3,,UP,,',
+    ]
+    haproxy_check._process_data(data, False, False, url='http://localhost/admin?stats')
+
+    tags = ['type:BACKEND', 'instance_url:http://localhost/admin?stats', 'service:a,1', 'backend:i-1']
+    aggregator.assert_metric('haproxy.backend.session.current', value=3, tags=tags)
+    aggregator.assert_metric('haproxy.backend.session.limit', value=12, tags=tags)
+    aggregator.assert_metric('haproxy.backend.session.pct', value=25, tags=tags)
+    aggregator.assert_service_check('haproxy.backend_up', status=HAProxy.OK, tags=['service:a,1', 'backend:i-1'])
+
+
+def test_merge_sockets(aggregator, tmpdir):
+    stats = {
+        'haproxy-1.sock': [
+            '# pxname,svname,scur,slim,stot,rtime,lastchg,status,',
+            'b,i-1,1,10,100,20,30,UP,',
+            'b,BACKEND,1,20,100,20,30,UP,',
+        ],
+        'haproxy-2.sock': [
+            '# pxname,svname,scur,slim,stot,rtime,lastchg,status,',
+            'b,i-1,3,10,50,40,10,UP,',
+            'b,BACKEND,3,20,50,40,10,UP,',
+        ],
+    }
+    for name in stats:
+        tmpdir.join(name).write('')
+    url = 'unix://{}'.format(tmpdir.join('haproxy-*.sock'))
+    config = {'url': url, 'collect_aggregates_only': False}
+
+    haproxy_check = HAProxy(common.CHECK_NAME, {}, {})
+    with mock.patch.object(HAProxy, '_fetch_socket_data', side_effect=lambda path: stats[os.path.basename(path)]):
+        haproxy_check.check(config)
+    haproxy_check.stop()
+
+    tags = ['type:BACKEND', 'instance_url:%s' % url, 'service:b', 'backend:i-1']
+    aggregator.assert_metric('haproxy.backend.session.current', value=4, count=1, tags=tags)
+    aggregator.assert_metric('haproxy.backend.session.limit', value=20, count=1, tags=tags)
+    aggregator.assert_metric('haproxy.backend.session.pct', value=20, count=1, tags=tags)
+    aggregator.assert_metric('haproxy.backend.session.rate', value=150, count=1, tags=tags)
+    aggregator.assert_metric('haproxy.backend.response.time', value=30, count=1, tags=tags)
+    aggregator.assert_metric('haproxy.backend.uptime', value=10, count=1, tags=tags)
+    aggregator.assert_service_check('haproxy.backend_up', status=HAProxy.OK, count=1,
+                                    tags=['service:b', 'backend:i-1'])
+
+
+def test_merge_sockets_status(aggregator, tmpdir):
+    stats = {
+        'haproxy-1.sock': [
+            '# pxname,svname,scur,status,',
+            'b,i-1,1,UP,',
+            'b,i-2,1,MAINT,',
+            'b,i-3,1,no check,',
+            'b,BACKEND,3,UP,',
+        ],
+        'haproxy-2.sock': [
+            '# pxname,svname,scur,status,',
+            'b,i-1,1,DOWN 1/2,',
+            'b,i-2,1,UP,',
+            'b,i-3,1,UP,',
+            'b,BACKEND,3,UP,',
+        ],
+        'haproxy-3.sock': [
+            '# pxname,svname,scur,status,',
+            'b,i-1,1,MAINT,',
+            'b,i-2,1,UP,',
+            'b,i-3,1,no check,',
+            'b,BACKEND,3,UP,',
+        ],
+    }
+    for name in stats:
+        tmpdir.join(name).write('')
+    url = 'unix://{}'.format(tmpdir.join('haproxy-*.sock'))
+    config = {'url': url, 'collect_aggregates_only': False}
+
+    haproxy_check = HAProxy(common.CHECK_NAME, {}, {})
+    with mock.patch.object(HAProxy, '_fetch_socket_data', side_effect=lambda path: stats[os.path.basename(path)]):
+        haproxy_check.check(config)
+    haproxy_check.stop()
+
+    # the worst status reported by a process wins
+    aggregator.assert_service_check('haproxy.backend_up', status=HAProxy.CRITICAL, count=1,
+                                    tags=['service:b', 'backend:i-1'])
+    aggregator.assert_service_check('haproxy.backend_up', status=HAProxy.OK, count=1,
+                                    tags=['service:b', 'backend:i-2'])
+    aggregator.assert_service_check('haproxy.backend_up', status=HAProxy.OK, count=1,
+                                    tags=['service:b', 'backend:i-3'])
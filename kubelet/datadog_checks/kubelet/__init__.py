@@ -1,12 +1,13 @@
 from .kubelet import KubeletCheck
 from .__about__ import __version__
-from .common import ContainerFilter, KubeletCredentials, get_pod_by_uid, is_static_pending_pod
+from .common import ContainerFilter, KubeletCredentials, PodListIndex, get_pod_by_uid, is_static_pending_pod
 
 __all__ = [
     'KubeletCheck',
     '__version__',
     'ContainerFilter',
     'KubeletCredentials',
+    'PodListIndex',
     'get_pod_by_uid',
     'is_static_pending_pod'
 ]
@@ -15,7 +15,7 @@ import logging
 import requests
 
 # check
-from .common import tags_for_docker, tags_for_pod, is_static_pending_pod, get_pod_by_uid
+from .common import tags_for_docker, tags_for_pod
 
 NAMESPACE = "kubernetes"
 DEFAULT_MAX_DEPTH = 10
@@ -95,13 +95,17 @@ class CadvisorScraper(object):
             self.warning('cAdvisor returned no metrics')
             return
 
+        # the filter already indexes the podlist
+        pod_list_index = container_filter.pod_list_index
+        self._cadvisor_entity_tags = {}
+
         for subcontainer in metrics:
             c_id = subcontainer.get('id')
             if 'aliases' not in subcontainer:
                 # it means the subcontainer is about a higher-level entity than a container
                 continue
             try:
-                self._update_container_metrics(instance, subcontainer, pod_list, container_filter)
+                self._update_container_metrics(instance, subcontainer, pod_list_index, container_filter)
             except Exception as e:
                 self.log.error("Unable to collect metrics for container: {0} ({1})".format(c_id, e))
 
@@ -141,7 +145,20 @@ class CadvisorScraper(object):
         elif isinstance(dat, list):
             self._publish_raw_metrics(metric, dat[-1], tags, is_pod, depth + 1)
 
-    def _update_container_metrics(self, instance, subcontainer, pod_list, container_filter):
+    def _get_entity_tags(self, tags_for_entity, entity_id):
+        """
+        Queries the tagger with tags_for_entity (tags_for_pod or tags_for_docker), the result
+        is memoized until the end of the run as a pod's subcontainers share its tags.
+        The returned list MUST NOT be modified.
+        """
+        key = (tags_for_entity, entity_id)
+        tags = self._cadvisor_entity_tags.get(key)
+        if tags is None:
+            tags = tags_for_entity(entity_id, True) or []
+            self._cadvisor_entity_tags[key] = tags
+        return tags
+
+    def _update_container_metrics(self, instance, subcontainer, pod_list_index, container_filter):
         is_pod = False
         in_static_pod = False
         cid = subcontainer.get('id')
@@ -154,22 +171,20 @@ class CadvisorScraper(object):
 
         # FIXME we are forced to do that because the Kubelet PodList isn't updated
         # for static pods, see https://github.com/kubernetes/kubernetes/pull/59948
-        pod = get_pod_by_uid(pod_uid, pod_list)
-        if pod is not None and is_static_pending_pod(pod):
+        if pod_list_index.is_static_pending(pod_uid):
             in_static_pod = True
 
         # Let's see who we have here
         if is_pod:
-            tags = tags_for_pod(pod_uid, True)
+            tags = self._get_entity_tags(tags_for_pod, pod_uid)
         elif in_static_pod and k_container_name:
-            tags = tags_for_docker(cid, True)
-            tags += tags_for_pod(pod_uid, True)
+            tags = self._get_entity_tags(tags_for_docker, cid) + self._get_entity_tags(tags_for_pod, pod_uid)
             tags.append("kube_container_name:%s" % k_container_name)
         else:  # Standard container
             if container_filter.is_excluded(cid):
                 self.log.debug("Filtering out " + cid)
                 return
-            tags = tags_for_docker(cid, True)
+            tags = self._get_entity_tags(tags_for_docker, cid)
 
         if not tags:
             self.log.debug("Subcontainer {} doesn't have tags, skipping.".format(cid))
@@ -72,40 +72,98 @@ def is_static_pending_pod(pod):
         return False
 
 
-class ContainerFilter(object):
+class PodListIndex(object):
     """
-    Queries the podlist and the agent6's filtering logic to determine whether to
-    send metrics for a given container.
-    Results and podlist are cached between calls to avoid the repeated python-go switching
-    cost (filter called once per prometheus metric), hence the ContainerFilter object MUST
-    be re-created at every check run.
-
-    Containers that are part of a static pod are not filtered, as we cannot curently
-    reliably determine their image name to pass to the filtering logic.
+    Indexes a podlist by pod uid and container id, so that the lookups done for every
+    prometheus metric are constant-time dict accesses instead of scans of the podlist.
+    The index is built once per check run and MUST be re-created when the podlist changes.
     """
     def __init__(self, podlist):
+        self.pod_list = podlist
+        self.pods = {}
         self.containers = {}
+        self.host_network = {}
         self.static_pod_uids = set()
-        self.cache = {}
 
-        pods = podlist.get('items') or []
+        pods = (podlist or {}).get('items') or []
 
         for pod in pods:
-            # FIXME we are forced to do that because the Kubelet PodList isn't updated
-            # for static pods, see https://github.com/kubernetes/kubernetes/pull/59948
+            uid = pod.get('metadata', {}).get('uid')
+            if not uid:
+                continue
+            self.pods[uid] = pod
+            self.host_network[uid] = pod.get('spec', {}).get('hostNetwork', False)
             if is_static_pending_pod(pod):
-                self.static_pod_uids.add(pod.get("metadata", {}).get("uid"))
+                self.static_pod_uids.add(uid)
 
             for ctr in pod.get('status', {}).get('containerStatuses', []):
                 cid = ctr.get('containerID')
                 if not cid:
                     continue
-                self.containers[cid] = ctr
+                self.containers[cid] = (pod, ctr)
                 if "://" in cid:
                     # cAdvisor pushes cids without orchestrator scheme
-                    # re-register without the scheme
-                    short_cid = cid.split("://", 1)[-1]
-                    self.containers[short_cid] = ctr
+                    self.containers[cid.split("://", 1)[-1]] = (pod, ctr)
+
+    def get_pod(self, uid):
+        """
+        :param uid: pod uid
+        :return: pod dict object if found, None if not found
+        """
+        return self.pods.get(uid)
+
+    def get_container(self, cid):
+        """
+        :param cid: container id, with or without the orchestrator scheme
+        :return: tuple (pod, container status), (None, None) if not found
+        """
+        return self.containers.get(cid, (None, None))
+
+    def is_host_networked(self, uid):
+        """
+        Return if the pod is on host network, False if the pod isn't in the podlist
+        :param uid: pod uid
+        :return: bool
+        """
+        return self.host_network.get(uid, False)
+
+    def is_static_pending(self, uid):
+        """
+        Return if the pod is a static pending pod, see is_static_pending_pod
+        :param uid: pod uid
+        :return: bool
+        """
+        return uid in self.static_pod_uids
+
+    def __len__(self):
+        return len(self.pods)
+
+
+class ContainerFilter(object):
+    """
+    Queries the podlist and the agent6's filtering logic to determine whether to
+    send metrics for a given container.
+    Results and podlist are cached between calls to avoid the repeated python-go switching
+    cost (filter called once per prometheus metric), hence the ContainerFilter object MUST
+    be re-created whenever the podlist changes.
+
+    Containers that are part of a static pod are not filtered, as we cannot curently
+    reliably determine their image name to pass to the filtering logic.
+    """
+    def __init__(self, podlist, pod_list_index=None):
+        """
+        :param podlist: podlist dict object
+        :param pod_list_index: PodListIndex of the podlist, built if not provided
+        """
+        if pod_list_index is None:
+            pod_list_index = PodListIndex(podlist)
+        self.pod_list_index = pod_list_index
+        # container id, with and without the orchestrator scheme --> (pod, container status)
+        self.containers = pod_list_index.containers
+        # FIXME we are forced to do that because the Kubelet PodList isn't updated
+        # for static pods, see https://github.com/kubernetes/kubernetes/pull/59948
+        self.static_pod_uids = pod_list_index.static_pod_uids
+        self.cache = {}
 
     def is_excluded(self, cid, pod_uid=None):
         """
@@ -128,11 +186,11 @@ class ContainerFilter(object):
             self.cache[cid] = False
             return False
 
-        if cid not in self.containers:
+        _, ctr = self.pod_list_index.get_container(cid)
+        if ctr is None:
             # Filter out metrics not coming from a container (system slices)
             self.cache[cid] = True
             return True
-        ctr = self.containers[cid]
         if not ("name" in ctr and "image" in ctr):
             # Filter out invalid containers
             self.cache[cid] = True
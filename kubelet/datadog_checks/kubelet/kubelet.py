@@ -3,13 +3,13 @@
 # Licensed under Simplified BSD License (see LICENSE)
 
 # stdlib
+import hashlib
+import json
 import logging
 import re
+import time
 from urlparse import urljoin
 
-# 3p
-import requests
-
 # project
 from datadog_checks.checks import AgentCheck
 from datadog_checks.errors import CheckException
@@ -18,7 +18,7 @@ from kubeutil import get_connection_info
 from tagger import get_tags
 
 # check
-from .common import CADVISOR_DEFAULT_PORT, ContainerFilter, KubeletCredentials
+from .common import CADVISOR_DEFAULT_PORT, ContainerFilter, KubeletCredentials, PodListIndex
 from .cadvisor import CadvisorScraper
 from .prometheus import CadvisorPrometheusScraper
 
@@ -28,6 +28,9 @@ POD_LIST_PATH = '/pods/'
 CADVISOR_METRICS_PATH = '/metrics/cadvisor'
 KUBELET_METRICS_PATH = '/metrics'
 
+# By default the pod list is retrieved at every run
+DEFAULT_POD_LIST_CACHE_TTL = 0
+
 # Suffixes per
 # https://github.com/kubernetes/kubernetes/blob/8fd414537b5143ab039cb910590237cabf4af783/pkg/api/resource/suffix.go#L108
 FACTORS = {
@@ -68,10 +71,24 @@ class KubeletCheck(AgentCheck, CadvisorScraper):
         self.cadvisor_legacy_port = inst.get('cadvisor_port', CADVISOR_DEFAULT_PORT)
         self.cadvisor_legacy_url = None
 
+        self.pod_list_cache_ttl = float(inst.get('pod_list_cache_ttl', DEFAULT_POD_LIST_CACHE_TTL))
+        # The pod list is kept between runs along with its index and container filter:
+        # it is only retrieved again once older than pod_list_cache_ttl, and only parsed
+        # again (and re-indexed) when the kubelet returns a different payload.
+        self.pod_list = None
+        self.pod_list_index = None
+        self.container_filter = None
+        self._pod_list_digest = None
+        self._pod_list_retrieved_at = 0
+        # tagger lookups of the legacy cAdvisor scraper, memoized for the duration of a run
+        self._cadvisor_entity_tags = {}
+
         self.cadvisor_scraper = CadvisorPrometheusScraper(self)
+        self.cadvisor_scraper.keep_alive = True
 
         self.kubelet_scraper = PrometheusScraper(self)
         self.kubelet_scraper.NAMESPACE = 'kubernetes'
+        self.kubelet_scraper.keep_alive = True
         self.kubelet_scraper.metrics_mapper = {
             'apiserver_client_certificate_expiration_seconds': 'apiserver.certificate.expiration',
             'rest_client_requests_total': 'rest.client.requests',
@@ -124,9 +141,7 @@ class KubeletCheck(AgentCheck, CadvisorScraper):
         else:
             send_buckets = True
 
-        self.pod_list = self.retrieve_pod_list()
-
-        self.container_filter = ContainerFilter(self.pod_list)
+        self._update_pod_list()
 
         self.instance_tags = instance.get('tags', [])
         self._perform_kubelet_check(self.instance_tags)
@@ -149,6 +164,7 @@ class KubeletCheck(AgentCheck, CadvisorScraper):
                 send_histograms_buckets=send_buckets,
                 instance=instance,
                 pod_list=self.pod_list,
+                pod_list_index=self.pod_list_index,
                 container_filter=self.container_filter
             )
 
@@ -161,33 +177,67 @@ class KubeletCheck(AgentCheck, CadvisorScraper):
                 ignore_unmapped=True
             )
 
-        # Free up memory
-        self.pod_list = None
-        self.container_filter = None
-
     def perform_kubelet_query(self, url, verbose=True, timeout=10):
         """
         Perform and return a GET request against kubelet. Support auth and TLS validation.
+        The connection to the kubelet is kept alive between runs.
         """
-        return requests.get(
+        verify = self.kubelet_credentials.verify()
+        cert = self.kubelet_credentials.cert_pair()
+        return self.get_http_session(url, cert=cert, verify=verify).get(
             url,
             timeout=timeout,
-            verify=self.kubelet_credentials.verify(),
-            cert=self.kubelet_credentials.cert_pair(),
+            verify=verify,
+            cert=cert,
             headers=self.kubelet_credentials.headers(url),
             params={'verbose': verbose}
         )
 
+    def _update_pod_list(self):
+        """
+        Refresh self.pod_list if it is older than pod_list_cache_ttl, and rebuild
+        its index and container filter if it changed.
+        """
+        now = time.time()
+        if self.pod_list is not None and now - self._pod_list_retrieved_at < self.pod_list_cache_ttl:
+            return
+
+        pod_list = self.retrieve_pod_list()
+        if pod_list is None:
+            # don't keep serving a stale pod list if the kubelet can't be reached
+            self._pod_list_retrieved_at = 0
+        else:
+            self._pod_list_retrieved_at = now
+
+        if pod_list is self.pod_list and pod_list is not None:
+            return
+
+        self.pod_list = pod_list
+        self.pod_list_index = PodListIndex(pod_list)
+        self.container_filter = ContainerFilter(pod_list, self.pod_list_index)
+
     def retrieve_pod_list(self):
+        """
+        Retrieve the pod list from the kubelet. If the payload is the same as the one of
+        the previous call, the previously parsed pod list is returned instead of parsing it again.
+        :return: pod list dict object, None if it could not be retrieved
+        """
         try:
-            pod_list = self.perform_kubelet_query(self.pod_list_url).json()
+            content = self.perform_kubelet_query(self.pod_list_url).content
+            digest = hashlib.sha1(content).digest()
+            if digest == self._pod_list_digest and self.pod_list is not None:
+                return self.pod_list
+
+            pod_list = json.loads(content)
             if pod_list.get("items") is None:
                 # Sanitize input: if no pod are running, 'items' is a NoneObject
                 pod_list['items'] = []
+            self._pod_list_digest = digest
             return pod_list
         except Exception as e:
             self.log.debug('failed to retrieve pod list from the kubelet at %s : %s'
                            % (self.pod_list_url, str(e)))
+            self._pod_list_digest = None
             return None
 
     def _retrieve_node_spec(self):
@@ -7,7 +7,7 @@ from datadog_checks.checks.prometheus import PrometheusScraper
 from tagger import get_tags
 
 # check
-from .common import is_static_pending_pod, get_pod_by_uid
+from .common import PodListIndex
 
 METRIC_TYPES = ['counter', 'gauge', 'summary']
 # container-specific metrics should have all these labels
@@ -26,6 +26,12 @@ class CadvisorPrometheusScraper(PrometheusScraper):
         self.NAMESPACE = 'kubernetes'
         self.instance_tags = []
 
+        # set for the duration of a run by process()
+        self.pod_list_index = None
+        self.container_filter = None
+        # entity id --> tagger tags, memoized for the duration of a run
+        self._entity_tags = {}
+
         self.ignore_metrics = [
             'container_cpu_cfs_periods_total',
             'container_cpu_cfs_throttled_periods_total',
@@ -66,13 +72,11 @@ class CadvisorPrometheusScraper(PrometheusScraper):
         :param metric:
         :return: bool
         """
+        labels = dict((ml.name, ml.value) for ml in metric.label)
+        if labels.get('container_name') in ('', 'POD'):
+            return False
         for lbl in CONTAINER_LABELS:
-            if lbl == 'container_name':
-                for ml in metric.label:
-                    if ml.name == lbl:
-                        if ml.value == '' or ml.value == 'POD':
-                            return False
-            if lbl not in [ml.name for ml in metric.label]:
+            if lbl not in labels:
                 return False
         return True
 
@@ -135,6 +139,17 @@ class CadvisorPrometheusScraper(PrometheusScraper):
                 if part.startswith('pod'):
                     return part[3:]
 
+    @property
+    def pod_list(self):
+        if self.pod_list_index is None:
+            return None
+        return self.pod_list_index.pod_list
+
+    @pod_list.setter
+    def pod_list(self, pod_list):
+        self.pod_list_index = PodListIndex(pod_list) if pod_list is not None else None
+        self._entity_tags = {}
+
     def _is_pod_host_networked(self, pod_uid):
         """
         Return if the pod is on host Network
@@ -142,10 +157,7 @@ class CadvisorPrometheusScraper(PrometheusScraper):
         :param pod_uid: str
         :return: bool
         """
-        for pod in self.pod_list['items']:
-            if pod.get('metadata', {}).get('uid', '') == pod_uid:
-                return pod.get('spec', {}).get('hostNetwork', False)
-        return False
+        return self.pod_list_index.is_host_networked(pod_uid)
 
     def _get_pod_by_metric_label(self, labels):
         """
@@ -153,7 +165,40 @@ class CadvisorPrometheusScraper(PrometheusScraper):
         :return:
         """
         pod_uid = self._get_pod_uid(labels)
-        return get_pod_by_uid(pod_uid, self.pod_list)
+        return self.pod_list_index.get_pod(pod_uid)
+
+    def _get_tags(self, entity_id):
+        """
+        Queries the tagger for an entity, the result is memoized until the end of the run
+        to avoid the python-go switching cost for every metric of the same container or pod.
+        The returned list MUST NOT be modified.
+        :param entity_id: str, eg. docker://<cid>
+        :return: list
+        """
+        tags = self._entity_tags.get(entity_id)
+        if tags is None:
+            tags = get_tags(entity_id, True) or []
+            self._entity_tags[entity_id] = tags
+        return tags
+
+    def _get_container_tags(self, c_id, labels):
+        """
+        Return the tags to submit a container metric with
+        :param c_id: container id
+        :param labels: metric labels: iterable
+        :return: list
+        """
+        tags = self._get_tags('docker://%s' % c_id) + self.instance_tags
+
+        # FIXME we are forced to do that because the Kubelet PodList isn't updated
+        # for static pods, see https://github.com/kubernetes/kubernetes/pull/59948
+        pod_uid = self._get_pod_uid(labels)
+        if self.pod_list_index.is_static_pending(pod_uid):
+            tags += self._get_tags('kubernetes_pod://%s' % pod_uid)
+            tags += self._get_kube_container_name(labels)
+            tags = list(set(tags))
+
+        return tags
 
     @staticmethod
     def _get_kube_container_name(labels):
@@ -172,7 +217,12 @@ class CadvisorPrometheusScraper(PrometheusScraper):
         return []
 
     def process(self, endpoint, **kwargs):
-        self.pod_list = kwargs.get('pod_list')
+        if kwargs.get('pod_list_index') is not None:
+            # reuse the index already built by the check
+            self.pod_list_index = kwargs['pod_list_index']
+            self._entity_tags = {}
+        else:
+            self.pod_list = kwargs.get('pod_list')
         self.container_filter = kwargs.get('container_filter')
 
         instance = kwargs.get('instance')
@@ -198,16 +248,7 @@ class CadvisorPrometheusScraper(PrometheusScraper):
                 if self.container_filter.is_excluded(c_id, pod_uid):
                     continue
 
-                tags = get_tags('docker://%s' % c_id, True)
-                tags += self.instance_tags
-
-                # FIXME we are forced to do that because the Kubelet PodList isn't updated
-                # for static pods, see https://github.com/kubernetes/kubernetes/pull/59948
-                pod = self._get_pod_by_metric_label(metric.label)
-                if pod is not None and is_static_pending_pod(pod):
-                    tags += get_tags('kubernetes_pod://%s' % pod["metadata"]["uid"], True)
-                    tags += self._get_kube_container_name(metric.label)
-                    tags = list(set(tags))
+                tags = self._get_container_tags(c_id, metric.label)
 
                 val = getattr(metric, METRIC_TYPES[message.type]).value
 
@@ -224,8 +265,7 @@ class CadvisorPrometheusScraper(PrometheusScraper):
                 pod_uid = self._get_pod_uid(metric.label)
                 if '.network.' in metric_name and self._is_pod_host_networked(pod_uid):
                     continue
-                tags = get_tags('kubernetes_pod://%s' % pod_uid, True)
-                tags += self.instance_tags
+                tags = self._get_tags('kubernetes_pod://%s' % pod_uid) + self.instance_tags
                 val = getattr(metric, METRIC_TYPES[message.type]).value
                 self.check.rate(metric_name, val, tags)
 
@@ -247,16 +287,7 @@ class CadvisorPrometheusScraper(PrometheusScraper):
                 if self.container_filter.is_excluded(c_id, pod_uid):
                     continue
 
-                tags = get_tags('docker://%s' % c_id, True)
-                tags += self.instance_tags
-
-                # FIXME we are forced to do that because the Kubelet PodList isn't updated
-                # for static pods, see https://github.com/kubernetes/kubernetes/pull/59948
-                pod = self._get_pod_by_metric_label(metric.label)
-                if pod is not None and is_static_pending_pod(pod):
-                    tags += get_tags('kubernetes_pod://%s' % pod["metadata"]["uid"], True)
-                    tags += self._get_kube_container_name(metric.label)
-                    tags = list(set(tags))
+                tags = self._get_container_tags(c_id, metric.label)
 
                 val = getattr(metric, METRIC_TYPES[message.type]).value
                 cache[c_name] = (val, tags)
@@ -282,8 +313,7 @@ class CadvisorPrometheusScraper(PrometheusScraper):
                 if self.container_filter.is_excluded(c_id, pod_uid):
                     continue
 
-                tags = get_tags('docker://%s' % c_id, True)
-                tags += self.instance_tags
+                tags = self._get_tags('docker://%s' % c_id) + self.instance_tags
 
                 if m_name:
                     self.check.gauge(m_name, limit, tags)
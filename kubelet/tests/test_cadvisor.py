@@ -87,3 +87,14 @@ def test_kubelet_check_cadvisor(monkeypatch, aggregator):
         aggregator.assert_metric(metric)
         aggregator.assert_metric_has_tag(metric, "instance:tag")
     assert aggregator.metrics_asserted_pct == 100.0
+
+
+def test_entity_tags_memoized():
+    check = KubeletCheck('kubelet', None, {}, [{}])
+    tags_for_pod = mock.Mock(return_value=["pod_name:foo"])
+
+    for _ in range(3):
+        assert check._get_entity_tags(tags_for_pod, "uid-1") == ["pod_name:foo"]
+    check._get_entity_tags(tags_for_pod, "uid-2")
+
+    assert tags_for_pod.call_args_list == [mock.call("uid-1", True), mock.call("uid-2", True)]
@@ -8,7 +8,9 @@ import mock
 import pytest
 import json
 
-from datadog_checks.kubelet import ContainerFilter, KubeletCredentials, get_pod_by_uid, is_static_pending_pod
+from datadog_checks.kubelet import (
+    ContainerFilter, KubeletCredentials, PodListIndex, get_pod_by_uid, is_static_pending_pod
+)
 from datadog_checks.checks.prometheus import PrometheusScraper
 
 from .test_kubelet import mock_from_file
@@ -172,3 +174,37 @@ def test_credentials_token_noverify():
     assert scraper.ssl_cert is None
     assert scraper.ssl_private_key is None
     assert scraper.extra_headers == {}
+
+
+def test_pod_list_index():
+    podlist = json.loads(mock_from_file('pods.json'))
+    index = PodListIndex(podlist)
+
+    assert len(index) == 5
+    assert index.pod_list is podlist
+
+    for pod in podlist['items']:
+        uid = pod['metadata']['uid']
+        assert index.get_pod(uid) is get_pod_by_uid(uid, podlist)
+        assert index.is_static_pending(uid) is is_static_pending_pod(pod)
+    assert index.get_pod("unknown") is None
+
+    assert index.is_host_networked("260c2b1d43b094af6d6b4ccba082c2db") is True
+    assert index.is_host_networked("2edfd4d9-10ce-11e8-bd5a-42010af00137") is False
+    assert index.is_host_networked("unknown") is False
+
+    long_cid = "docker://a335589109ce5506aa69ba7481fc3e6c943abd23c5277016c92dac15d0f40479"
+    short_cid = "a335589109ce5506aa69ba7481fc3e6c943abd23c5277016c92dac15d0f40479"
+    pod, ctr = index.get_container(short_cid)
+    assert index.get_container(long_cid) == (pod, ctr)
+    assert ctr["name"] == "datadog-agent"
+    assert ctr in pod["status"]["containerStatuses"]
+    assert index.get_container("invalid") == (None, None)
+
+    # the container filter shares the index
+    container_filter = ContainerFilter(podlist, index)
+    assert container_filter.pod_list_index is index
+    assert container_filter.is_excluded("invalid") is True
+
+    assert len(PodListIndex(None)) == 0
+    assert len(PodListIndex({"items": None})) == 0
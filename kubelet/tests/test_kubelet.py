@@ -197,6 +197,23 @@ def test_prometheus_cpu_summed(monkeypatch, aggregator):
         assert c not in check.rate.mock_calls
 
 
+def test_prometheus_tags_memoized(monkeypatch, aggregator):
+    check = mock_kubelet_check(monkeypatch, [{}])
+    get_tags = mock.Mock(side_effect=mocked_get_tags)
+
+    with mock.patch("datadog_checks.kubelet.prometheus.get_tags", get_tags):
+        check.check({"cadvisor_metrics_endpoint": "http://dummy", "kubelet_metrics_endpoint": ""})
+        entities = [c[0][0] for c in get_tags.call_args_list]
+        # each entity is only queried once per run
+        assert entities
+        assert len(entities) == len(set(entities))
+
+        get_tags.reset_mock()
+        check.check({"cadvisor_metrics_endpoint": "http://dummy", "kubelet_metrics_endpoint": ""})
+        # but queried again on the next run
+        assert sorted(c[0][0] for c in get_tags.call_args_list) == sorted(entities)
+
+
 def test_kubelet_check_instance_config(monkeypatch):
     def mock_kubelet_check_no_prom():
         check = mock_kubelet_check(monkeypatch, [{}])
@@ -295,7 +312,7 @@ def test_perform_kubelet_check(monkeypatch):
 
     instance_tags = ["one:1"]
     get = MockResponse()
-    with mock.patch("requests.get", side_effect=get):
+    with mock.patch("requests.Session.get", side_effect=get):
         check._perform_kubelet_check(instance_tags)
 
     get.assert_has_calls([
@@ -321,6 +338,7 @@ def test_retrieve_pod_list_success(monkeypatch):
     class MockResponse:
         def __init__(self, json_data):
             self.json_data = json_data
+            self.content = json_data
 
         def json(self):
             return (json.loads(self.json_data))
@@ -345,3 +363,56 @@ def test_retrieved_pod_list_failure(monkeypatch):
 
     retrieved = check.retrieve_pod_list()
     assert retrieved is None
+
+
+def test_retrieve_pod_list_unchanged(monkeypatch):
+    check = KubeletCheck('kubelet', None, {}, [{}])
+    check.pod_list_url = "dummyurl"
+    response = mock.Mock(content=mock_from_file('pods.json'))
+    monkeypatch.setattr(check, 'perform_kubelet_query', mock.Mock(return_value=response))
+
+    check._update_pod_list()
+    pod_list, pod_list_index, container_filter = check.pod_list, check.pod_list_index, check.container_filter
+    assert len(pod_list_index) == 5
+
+    # same payload: the parsed pod list, its index and filter are reused
+    check._update_pod_list()
+    assert check.perform_kubelet_query.call_count == 2
+    assert check.pod_list is pod_list
+    assert check.pod_list_index is pod_list_index
+    assert check.container_filter is container_filter
+
+    # new payload
+    response.content = mock_from_file('pod_list_raw.dat')
+    check._update_pod_list()
+    assert check.perform_kubelet_query.call_count == 3
+    assert check.pod_list is not pod_list
+    assert check.pod_list == json.loads(mock_from_file("pod_list_raw.json"))
+    assert check.pod_list_index is not pod_list_index
+    assert check.container_filter is not container_filter
+
+
+def test_pod_list_cache_ttl(monkeypatch):
+    check = KubeletCheck('kubelet', None, {}, [{'pod_list_cache_ttl': 30}])
+    monkeypatch.setattr(check, 'retrieve_pod_list', mock.Mock(return_value=json.loads(mock_from_file('pods.json'))))
+
+    with mock.patch('time.time', return_value=1000):
+        check._update_pod_list()
+    with mock.patch('time.time', return_value=1029):
+        check._update_pod_list()
+    assert check.retrieve_pod_list.call_count == 1
+
+    with mock.patch('time.time', return_value=1030):
+        check._update_pod_list()
+    assert check.retrieve_pod_list.call_count == 2
+
+    # failures are not cached
+    check.retrieve_pod_list.return_value = None
+    with mock.patch('time.time', return_value=1060):
+        check._update_pod_list()
+    assert check.pod_list is None
+    check.retrieve_pod_list.return_value = json.loads(mock_from_file('pods.json'))
+    with mock.patch('time.time', return_value=1061):
+        check._update_pod_list()
+    assert check.retrieve_pod_list.call_count == 4
+    assert len(check.pod_list_index) == 5
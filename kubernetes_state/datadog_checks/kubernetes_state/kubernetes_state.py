@@ -174,6 +174,10 @@ class KubernetesState(PrometheusCheck):
         if hostname_override:
             self.label_to_hostname = 'node'
 
+        # Most of the families exposed by kube-state-metrics are neither mapped nor handled,
+        # don't decode them
+        self.skip_unwanted_families = True
+
     def check(self, instance):
         endpoint = instance.get('kube_state_url')
         if endpoint is None:
@@ -3,15 +3,19 @@
 # Licensed under Simplified BSD License (see LICENSE)
 from datetime import datetime, timedelta
 from urlparse import urljoin
+import calendar
+import hashlib
 import re
+import threading
 import time
 import random
-import copy
 
 import requests
 import simplejson as json
 
 from datadog_checks.checks import AgentCheck
+from datadog_checks.checks.libs.thread_pool import Pool, TimeoutError
+from datadog_checks.utils.cache import LRUCache
 
 try:
     # Agent >= 6.0: the check pushes tags invoking `set_external_tags`
@@ -32,6 +36,15 @@ DEFAULT_NEUTRON_API_VERSION = 'v2.0'
 
 DEFAULT_API_REQUEST_TIMEOUT = 10  # seconds
 
+# The size of the ThreadPool used to fetch the server, hypervisor and project stats
+DEFAULT_SIZE_POOL = 8
+
+# Number of servers listed per request to nova
+DEFAULT_PAGINATED_SERVER_LIMIT = 1000
+
+# Tokens are renewed when they expire in less than this many seconds
+TOKEN_REFRESH_MARGIN = 300
+
 NOVA_HYPERVISOR_METRICS = [
     'current_workload',
     'disk_available_least',
@@ -138,9 +151,32 @@ class KeystoneUnreachable(Exception):
     pass
 
 
+class RunDeadlineExceeded(Exception):
+    pass
+
+
 class OpenStackScope(object):
-    def __init__(self, auth_token):
+    def __init__(self, auth_token, expires_at=None):
         self.auth_token = auth_token
+        # Expiry of the token as a UTC timestamp, None if unknown
+        self.expires_at = expires_at
+
+    def expires_soon(self):
+        return self.expires_at is not None and time.time() + TOKEN_REFRESH_MARGIN >= self.expires_at
+
+    @classmethod
+    def get_token_expiry(cls, json_response):
+        """
+        Parse the expiry of the token out of an auth response, e.g. `2015-11-02T15:57:43.911674Z`
+        """
+        expires_at = json_response.get('token', {}).get('expires_at')
+        if not expires_at:
+            return None
+
+        try:
+            return calendar.timegm(datetime.strptime(expires_at[:19], '%Y-%m-%dT%H:%M:%S').timetuple())
+        except ValueError:
+            return None
 
     @classmethod
     def request_auth_token(cls, auth_scope, identity, keystone_server_url, ssl_verify, proxy=None):
@@ -264,10 +300,15 @@ class OpenStackScope(object):
 
 
 class OpenStackUnscoped(OpenStackScope):
-    def __init__(self, auth_token, project_scope_map):
-        super(OpenStackUnscoped, self).__init__(auth_token)
+    def __init__(self, auth_token, project_scope_map, expires_at=None):
+        super(OpenStackUnscoped, self).__init__(auth_token, expires_at)
         self.project_scope_map = project_scope_map
 
+    def expires_soon(self):
+        return super(OpenStackUnscoped, self).expires_soon() or any(
+            scope.expires_soon() for scope in self.project_scope_map.itervalues()
+        )
+
     @classmethod
     def from_config(cls, init_config, instance_config, proxy_config=None):
         keystone_server_url = init_config.get("keystone_server_url")
@@ -277,7 +318,7 @@ class OpenStackUnscoped(OpenStackScope):
         ssl_verify = init_config.get("ssl_verify", True)
         nova_api_version = init_config.get("nova_api_version", DEFAULT_NOVA_API_VERSION)
 
-        _, auth_token, _ = cls.get_auth_response_from_config(init_config, instance_config, proxy_config)
+        _, auth_token, auth_resp = cls.get_auth_response_from_config(init_config, instance_config, proxy_config)
 
         try:
             project_resp = cls.request_project_list(auth_token, keystone_server_url, ssl_verify, proxy_config)
@@ -318,10 +359,12 @@ class OpenStackUnscoped(OpenStackScope):
                     'domain': {} if project['domain_id'] is None else {'id': project['domain_id']},
                 }
             }
-            project_scope = OpenStackProjectScope(project_auth_token, project_auth_scope, service_catalog)
+            project_scope = OpenStackProjectScope(
+                project_auth_token, project_auth_scope, service_catalog, cls.get_token_expiry(token_resp.json())
+            )
             project_scope_map[project_key] = project_scope
 
-        return cls(auth_token, project_scope_map)
+        return cls(auth_token, project_scope_map, cls.get_token_expiry(auth_resp.json()))
 
     @classmethod
     def get_token_for_project(cls, auth_token, project, keystone_server_url, ssl_verify, proxy=None):
@@ -363,8 +406,8 @@ class OpenStackProjectScope(OpenStackScope):
     the token on expiry
     """
 
-    def __init__(self, auth_token, auth_scope, service_catalog):
-        super(OpenStackProjectScope, self).__init__(auth_token)
+    def __init__(self, auth_token, auth_scope, service_catalog, expires_at=None):
+        super(OpenStackProjectScope, self).__init__(auth_token, expires_at)
 
         # Store some identifiers for this project
         self.project_name = auth_scope["project"].get("name")
@@ -404,7 +447,7 @@ class OpenStackProjectScope(OpenStackScope):
 
             service_catalog.nova_endpoint = urljoin(service_catalog.nova_endpoint, t_id)
 
-        return cls(auth_token, auth_scope, service_catalog)
+        return cls(auth_token, auth_scope, service_catalog, cls.get_token_expiry(auth_resp.json()))
 
 
 class KeystoneCatalog(object):
@@ -526,11 +569,32 @@ class OpenStackCheck(AgentCheck):
 
     HYPERVISOR_CACHE_EXPIRY = 120  # seconds
 
+    PROJECT_NAME_CACHE_TTL = 300  # seconds
+
+    # Auth scopes shared by the instances using the same credentials, see `_scope_cache_key`
+    _shared_scopes = {}
+    # Guards `_shared_scopes` and the `instance_map` of the checks, scopes are deleted from the thread pool
+    _scopes_lock = threading.Lock()
+
     def __init__(self, name, init_config, agentConfig, instances=None):
         AgentCheck.__init__(self, name, init_config, agentConfig, instances)
 
         self._ssl_verify = init_config.get("ssl_verify", True)
         self.keystone_server_url = init_config.get("keystone_server_url")
+        self.request_timeout = float(init_config.get("request_timeout", DEFAULT_API_REQUEST_TIMEOUT))
+
+        # Stats are fetched concurrently, each run giving up on the requests still
+        # pending `run_deadline` seconds after it started (if set)
+        self.pool_size = int(init_config.get('threads_count', DEFAULT_SIZE_POOL))
+        self.pool = None
+        self.run_deadline = init_config.get("run_deadline")
+        self._deadline = None
+
+        # Servers are listed `paginated_server_limit` at a time
+        self.paginated_server_limit = int(init_config.get("paginated_server_limit", DEFAULT_PAGINATED_SERVER_LIMIT))
+
+        # project ID -> (project name, expiry timestamp)
+        self._project_names = LRUCache(maxsize=1000)
         self._hypervisor_name_cache = {}
 
         if not self.keystone_server_url:
@@ -581,7 +645,7 @@ class OpenStackCheck(AgentCheck):
                 headers=headers,
                 verify=self._ssl_verify,
                 params=params,
-                timeout=DEFAULT_API_REQUEST_TIMEOUT,
+                timeout=self.request_timeout,
                 proxies=self.proxy_config,
             )
             resp.raise_for_status()
@@ -601,6 +665,51 @@ class OpenStackCheck(AgentCheck):
 
         return resp.json()
 
+    def stop(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def _run_jobs(self, jobs):
+        """
+        Run the `(func, args, kwargs)` jobs concurrently in the thread pool and return
+        their `(result, exception)` pairs, in order, once they are all done or the run deadline passed.
+        Nothing is submitted from the pool, the results are meant to be submitted by the check thread.
+        """
+        if self.pool is None:
+            self.log.debug("Starting Thread Pool of size %s", self.pool_size)
+            self.pool = Pool(self.pool_size)
+
+        deadline = self._deadline
+        async_results = [
+            self.pool.apply_async(self._run_before_deadline, (deadline, func, args, kwargs))
+            for func, args, kwargs in jobs
+        ]
+
+        results = []
+        late_jobs = 0
+        for async_result in async_results:
+            timeout = None if deadline is None else max(deadline - time.time(), 0)
+            try:
+                results.append((async_result.get(timeout), None))
+            except (TimeoutError, RunDeadlineExceeded) as e:
+                late_jobs += 1
+                results.append((None, RunDeadlineExceeded(str(e))))
+            except Exception as e:
+                results.append((None, e))
+
+        if late_jobs:
+            self.warning("{} requests were not done before the run deadline, skipping them".format(late_jobs))
+
+        return results
+
+    @staticmethod
+    def _run_before_deadline(deadline, func, args, kwargs):
+        if deadline is not None and time.time() > deadline:
+            raise RunDeadlineExceeded("Job not started before the run deadline")
+        return func(*args, **kwargs)
+
     def _instance_key(self, instance):
         i_key = instance.get('name')
         if not i_key:
@@ -610,10 +719,28 @@ class OpenStackCheck(AgentCheck):
 
     def delete_current_scope(self):
         scope_to_delete = self._parent_scope if self._parent_scope else self._current_scope
-        for i_key, scope in self.instance_map.items():
-            if scope is scope_to_delete:
-                self.log.debug("Deleting current scope: %s", i_key)
-                del self.instance_map[i_key]
+        with self._scopes_lock:
+            for i_key, scope in self.instance_map.items():
+                if scope is scope_to_delete:
+                    self.log.debug("Deleting current scope: %s", i_key)
+                    self.instance_map.pop(i_key, None)
+            for cache_key, scope in self._shared_scopes.items():
+                if scope is scope_to_delete:
+                    self._shared_scopes.pop(cache_key, None)
+
+    def _scope_cache_key(self, instance):
+        """
+        Identify the auth scope of `instance` by its keystone server, credentials and scope
+        """
+        key = [
+            self.keystone_server_url,
+            self.init_config.get("nova_api_version", DEFAULT_NOVA_API_VERSION),
+            instance.get('user'),
+            instance.get('auth_scope'),
+            instance.get('append_tenant_id', False),
+        ]
+        # don't keep the credentials in clear
+        return hashlib.sha256(json.dumps(key, sort_keys=True)).hexdigest()
 
     def should_run(self, instance):
         i_key = self._instance_key(instance)
@@ -659,12 +786,14 @@ class OpenStackCheck(AgentCheck):
     def set_scope_for_instance(self, instance, scope):
         i_key = self._instance_key(instance)
         self.log.debug("Setting scope for instance %s", i_key)
-        self.instance_map[i_key] = scope
+        with self._scopes_lock:
+            self.instance_map[i_key] = scope
 
     def delete_scope_for_instance(self, instance):
         i_key = self._instance_key(instance)
         self.log.debug("Deleting scope for instance %s", i_key)
-        del self.instance_map[i_key]
+        with self._scopes_lock:
+            self.instance_map.pop(i_key, None)
 
     def get_auth_token(self, instance=None):
         if not instance:
@@ -820,7 +949,15 @@ class OpenStackCheck(AgentCheck):
     def get_stats_for_single_hypervisor(self, hyp_id, instance, host_tags=None, custom_tags=None):
         url = '{0}/os-hypervisors/{1}'.format(self.get_nova_endpoint(), hyp_id)
         headers = {'X-Auth-Token': self.get_auth_token()}
-        resp = self._make_request_with_auth_fallback(url, headers)
+        (resp, error), (uptime, uptime_error) = self._run_jobs([
+            (self._make_request_with_auth_fallback, (url, headers), {}),
+            (self.get_uptime_for_single_hypervisor, (hyp_id,), {}),
+        ])
+        if isinstance(error, RunDeadlineExceeded):
+            return
+        elif error is not None:
+            raise error
+
         hyp = resp['hypervisor']
         host_tags = host_tags or []
         self._hypervisor_name_cache[self._instance_key(instance)] = hyp['hypervisor_hostname']
@@ -834,10 +971,8 @@ class OpenStackCheck(AgentCheck):
         tags.extend(custom_tags)
         service_check_tags = list(custom_tags)
 
-        try:
-            uptime = self.get_uptime_for_single_hypervisor(hyp['id'])
-        except Exception as e:
-            self.warning('Unable to get uptime for hypervisor {0}: {1}'.format(hyp['id'], str(e)))
+        if uptime_error is not None:
+            self.warning('Unable to get uptime for hypervisor {0}: {1}'.format(hyp['id'], str(uptime_error)))
             uptime = {}
 
         hyp_state = hyp.get('state', None)
@@ -891,8 +1026,7 @@ class OpenStackCheck(AgentCheck):
         try:
             # Get a list of active servers
             query_params['status'] = 'ACTIVE'
-            resp = self._make_request_with_auth_fallback(url, headers, params=query_params)
-            servers.extend(resp['servers'])
+            servers.extend(self._list_servers(url, headers, query_params))
 
             # Don't collect Deleted or Shut off VMs on the first run:
             if i_key in self.changes_since_time:
@@ -901,15 +1035,12 @@ class OpenStackCheck(AgentCheck):
                 # Need to have admin perms for this to take affect
                 query_params['deleted'] = 'true'
                 del query_params['status']
-                resp = self._make_request_with_auth_fallback(url, headers, params=query_params)
-
-                servers.extend(resp['servers'])
+                servers.extend(self._list_servers(url, headers, query_params))
                 query_params['deleted'] = 'false'
 
                 # Get a list of shut off servers
                 query_params['status'] = 'SHUTOFF'
-                resp = self._make_request_with_auth_fallback(url, headers, params=query_params)
-                servers.extend(resp['servers'])
+                servers.extend(self._list_servers(url, headers, query_params))
 
             self.changes_since_time[i_key] = datetime.utcnow().isoformat()
 
@@ -945,19 +1076,73 @@ class OpenStackCheck(AgentCheck):
 
         return self.server_details_by_id
 
+    def _list_servers(self, url, headers, query_params):
+        """
+        List the servers matching `query_params`, `paginated_server_limit` at a time
+        """
+        params = dict(query_params)
+        if self.paginated_server_limit > 0:
+            params['limit'] = self.paginated_server_limit
+
+        servers = []
+        while True:
+            resp = self._make_request_with_auth_fallback(url, headers, params=params)
+            page = resp.get('servers', [])
+            servers.extend(page)
+
+            # nova links to the next page as long as the current one is full
+            has_next = any(link.get('rel') == 'next' for link in resp.get('servers_links', []))
+            if not (page and has_next and 'limit' in params):
+                return servers
+            params = dict(params, marker=page[-1]['id'])
+
     def get_project_name_from_id(self, tenant_id):
+        cached = self._project_names.get(tenant_id)
+        if cached is not None and cached[1] > time.time():
+            return cached[0]
+
         url = "{0}/{1}/{2}/{3}".format(self.keystone_server_url, DEFAULT_KEYSTONE_API_VERSION, "projects", tenant_id)
         self.log.debug("Project URL is %s", url)
         headers = {'X-Auth-Token': self.get_auth_token()}
         try:
             r = self._make_request_with_auth_fallback(url, headers)
-            return r['project']['name']
+            project_name = r['project']['name']
+            self._project_names.set(tenant_id, (project_name, time.time() + self.PROJECT_NAME_CACHE_TTL))
+            return project_name
 
         except Exception as e:
             self.warning('Unable to get project name: {0}'.format(str(e)))
             raise e
 
     def get_stats_for_single_server(self, server_details, tags=None):
+        self.get_stats_for_all_servers({server_details.get('server_id'): server_details}, tags=tags)
+
+    def get_stats_for_all_servers(self, servers, tags=None):
+        """
+        Fetch the diagnostics of `servers`, a server ID -> details mapping, concurrently and submit them
+        """
+        # Only the IDs are copied, servers found gone are removed from the cache while going through them
+        server_ids = list(servers)
+
+        headers = {'X-Auth-Token': self.get_auth_token()}
+        nova_endpoint = self.get_nova_endpoint()
+        results = self._run_jobs([
+            (self._make_request_with_auth_fallback, ('{0}/servers/{1}/diagnostics'.format(nova_endpoint, server_id),
+                                                     headers), {})
+            for server_id in server_ids
+        ])
+
+        first_error = None
+        for server_id, (server_stats, error) in zip(server_ids, results):
+            try:
+                self._submit_server_stats(servers[server_id], server_stats, error, tags)
+            except Exception as e:
+                first_error = first_error or e
+
+        if first_error is not None:
+            raise first_error
+
+    def _submit_server_stats(self, server_details, server_stats, error, tags=None):
         def _is_valid_metric(label):
             return label in NOVA_SERVER_METRICS or any(seg in label for seg in NOVA_SERVER_INTERFACE_SEGMENTS)
 
@@ -966,27 +1151,24 @@ class OpenStackCheck(AgentCheck):
         hypervisor_hostname = server_details.get('hypervisor_hostname')
         project_name = server_details.get('project_name')
 
-        server_stats = {}
-        headers = {'X-Auth-Token': self.get_auth_token()}
-        url = '{0}/servers/{1}/diagnostics'.format(self.get_nova_endpoint(), server_id)
-        try:
-            server_stats = self._make_request_with_auth_fallback(url, headers)
-        except InstancePowerOffFailure:  # 409 response code came back fro nova
+        if isinstance(error, RunDeadlineExceeded):
+            return
+        elif isinstance(error, InstancePowerOffFailure):  # 409 response code came back fro nova
             self.log.debug("Server %s is powered off and cannot be monitored", server_id)
             del self.server_details_by_id[server_id]
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 404:
-                self.log.debug("Server %s is not in an ACTIVE state and cannot be monitored, %s", server_id, e)
+        elif isinstance(error, requests.exceptions.HTTPError):
+            if error.response.status_code == 404:
+                self.log.debug("Server %s is not in an ACTIVE state and cannot be monitored, %s", server_id, error)
                 del self.server_details_by_id[server_id]
             else:
                 self.log.debug("Received HTTP Error when reaching the nova endpoint")
-                raise e
-        except Exception as e:
-            self.warning("Unknown error when monitoring %s : %s" % (server_id, e))
-            raise e
+                raise error
+        elif error is not None:
+            self.warning("Unknown error when monitoring %s : %s" % (server_id, error))
+            raise error
 
         if server_stats:
-            tags = tags or []
+            tags = list(tags or [])
             if project_name:
                 tags.append("project_name:{}".format(project_name))
             if hypervisor_hostname:
@@ -1003,25 +1185,16 @@ class OpenStackCheck(AgentCheck):
                     )
 
     def get_stats_for_single_project(self, project, tags=None):
+        self.get_stats_for_all_projects([project], tags)
+
+    def _submit_project_stats(self, project, server_stats, tags):
         def _is_valid_metric(label):
             return label in PROJECT_METRICS
 
-        if tags is None:
-            tags = []
-
-        server_tags = copy.deepcopy(tags)
-
-        project_name = project.get('name')
-
-        self.log.debug("Collecting metrics for project. name: {0} id: {1}".format(project_name, project['id']))
-
-        url = '{0}/limits'.format(self.get_nova_endpoint())
-        headers = {'X-Auth-Token': self.get_auth_token()}
-        server_stats = self._make_request_with_auth_fallback(url, headers, params={"tenant_id": project['id']})
-
+        server_tags = list(tags)
         server_tags.append('tenant_id:{0}'.format(project['id']))
 
-        if project_name:
+        if project.get('name'):
             server_tags.append('project_name:{0}'.format(project['name']))
 
         for st in server_stats['limits']['absolute']:
@@ -1036,8 +1209,26 @@ class OpenStackCheck(AgentCheck):
     def get_stats_for_all_projects(self, projects, tags=None):
         if tags is None:
             tags = []
+
+        url = '{0}/limits'.format(self.get_nova_endpoint())
+        headers = {'X-Auth-Token': self.get_auth_token()}
+        jobs = []
         for project in projects:
-            self.get_stats_for_single_project(project, tags)
+            self.log.debug("Collecting metrics for project. name: %s id: %s", project.get('name'), project['id'])
+            params = {"tenant_id": project['id']}
+            jobs.append((self._make_request_with_auth_fallback, (url, headers), {'params': params}))
+
+        first_error = None
+        for project, (server_stats, error) in zip(projects, self._run_jobs(jobs)):
+            if isinstance(error, RunDeadlineExceeded):
+                continue
+            elif error is not None:
+                first_error = first_error or error
+                continue
+            self._submit_project_stats(project, server_stats, tags)
+
+        if first_error is not None:
+            raise first_error
 
     # Cache util
     def _is_expired(self, entry):
@@ -1062,7 +1253,7 @@ class OpenStackCheck(AgentCheck):
                 scope.service_catalog.nova_endpoint,
                 headers=headers,
                 verify=self._ssl_verify,
-                timeout=DEFAULT_API_REQUEST_TIMEOUT,
+                timeout=self.request_timeout,
                 proxies=self.proxy_config,
             )
             self.service_check(
@@ -1083,7 +1274,7 @@ class OpenStackCheck(AgentCheck):
                 scope.service_catalog.neutron_endpoint,
                 headers=headers,
                 verify=self._ssl_verify,
-                timeout=DEFAULT_API_REQUEST_TIMEOUT,
+                timeout=self.request_timeout,
                 proxies=self.proxy_config,
             )
             self.service_check(
@@ -1112,15 +1303,27 @@ class OpenStackCheck(AgentCheck):
             custom_tags = []
         try:
             instance_scope = self.get_scope_for_instance(instance)
+            if instance_scope.expires_soon():
+                self.log.debug("The auth token is about to expire, renewing it")
+                self.delete_scope_for_instance(instance)
+                instance_scope = None
         except KeyError:
+            instance_scope = None
 
+        if instance_scope is None:
             # We're missing a project scope for this instance
-            # Let's populate it now
+            # Let's populate it now, unless an instance with the same credentials already did
             try:
-                if 'auth_scope' in instance:
-                    instance_scope = OpenStackProjectScope.from_config(self.init_config, instance, self.proxy_config)
-                else:
-                    instance_scope = OpenStackUnscoped.from_config(self.init_config, instance, self.proxy_config)
+                cache_key = self._scope_cache_key(instance)
+                shared_scope = self._shared_scopes.get(cache_key)
+                if shared_scope is None or shared_scope.expires_soon():
+                    if 'auth_scope' in instance:
+                        shared_scope = OpenStackProjectScope.from_config(self.init_config, instance, self.proxy_config)
+                    else:
+                        shared_scope = OpenStackUnscoped.from_config(self.init_config, instance, self.proxy_config)
+                    with self._scopes_lock:
+                        self._shared_scopes[cache_key] = shared_scope
+                instance_scope = shared_scope
 
                 self.service_check(
                     self.IDENTITY_API_SC,
@@ -1183,6 +1386,11 @@ class OpenStackCheck(AgentCheck):
         custom_tags = instance.get("tags", [])
         if custom_tags is None:
             custom_tags = []
+
+        self._deadline = None
+        if self.run_deadline:
+            self._deadline = time.time() + float(self.run_deadline)
+
         try:
             instance_scope = self.ensure_auth_scope(instance)
             split_hostname_on_first_period = instance.get('split_hostname_on_first_period', False)
@@ -1238,18 +1446,13 @@ class OpenStackCheck(AgentCheck):
 
                 host_tags = self._get_tags_for_host(split_hostname_on_first_period)
 
-                # Deep copy the cache so we can remove things from the Original during the iteration
-                server_cache_copy = copy.deepcopy(self.server_details_by_id)
-
-                for server in server_cache_copy:
-                    server_tags = copy.deepcopy(custom_tags)
-                    server_tags.append("nova_managed_server")
-
-                    if scope.tenant_id:
-                        server_tags.append("tenant_id:%s" % scope.tenant_id)
+                server_tags = custom_tags + ["nova_managed_server"]
+                if scope.tenant_id:
+                    server_tags.append("tenant_id:%s" % scope.tenant_id)
 
+                for server in servers:
                     self.external_host_tags[server] = host_tags
-                    self.get_stats_for_single_server(servers[server], tags=server_tags)
+                self.get_stats_for_all_servers(servers, tags=server_tags)
 
                 if hyp:
                     self.get_stats_for_single_hypervisor(hyp, instance, host_tags=host_tags, custom_tags=custom_tags)
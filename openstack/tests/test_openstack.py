@@ -5,23 +5,28 @@
 # stdlib
 import copy
 import re
+import threading
 import time
 
 # 3p
 import mock
 import pytest
+import requests
 
 # project
 import common
 
 from datadog_checks.openstack.openstack import (
     OpenStackCheck,
+    OpenStackScope,
     OpenStackProjectScope,
     OpenStackUnscoped,
     KeystoneCatalog,
     IncompleteConfig,
     IncompleteAuthScope,
-    IncompleteIdentity
+    IncompleteIdentity,
+    InstancePowerOffFailure,
+    RunDeadlineExceeded,
 )
 
 from datadog_checks.checks import AgentCheck
@@ -295,3 +300,156 @@ def test_cache_between_runs(self, *args):
 
     assert 'server-1' not in cached_servers
     assert 'server_newly_added' in cached_servers
+
+
+def _mock_server_diagnostics(url, headers=None, params=None):
+    server_id = url.split('/')[-2]
+    if server_id == 'server-2':
+        response = mock.MagicMock(status_code=404)
+        raise requests.exceptions.HTTPError(response=response)
+    if server_id == 'other-1':
+        raise InstancePowerOffFailure()
+    return {'memory': 42, 'vda_read': 2, 'unknown': 0}
+
+
+@mock.patch('datadog_checks.openstack.OpenStackCheck.get_nova_endpoint', return_value="http://10.0.2.15:8774/v2.1")
+@mock.patch('datadog_checks.openstack.OpenStackCheck.get_auth_token', return_value="test_auth_token")
+def test_get_stats_for_all_servers(mock_token, mock_endpoint, aggregator):
+    check = OpenStackCheck("test", {'keystone_server_url': 'http://10.0.2.15:5000', 'threads_count': 2}, {}, {})
+    check.server_details_by_id = copy.deepcopy(common.ALL_SERVER_DETAILS)
+    for server_id, details in check.server_details_by_id.iteritems():
+        details['server_id'] = server_id
+
+    with mock.patch('datadog_checks.openstack.OpenStackCheck._make_request_with_auth_fallback',
+                    side_effect=_mock_server_diagnostics) as request:
+        check.get_stats_for_all_servers(check.server_details_by_id, tags=['optional:tag1'])
+    check.stop()
+
+    assert request.call_count == 4
+    # servers gone or powered off are removed from the cache
+    assert sorted(check.server_details_by_id) == ['other-2', 'server-1']
+    for server_id in ('other-2', 'server-1'):
+        aggregator.assert_metric('openstack.nova.server.memory', value=42, hostname=server_id, count=1,
+                                 tags=['optional:tag1'])
+        aggregator.assert_metric('openstack.nova.server.vda_read', value=2, hostname=server_id, count=1)
+    aggregator.assert_all_metrics_covered()
+
+
+def test_run_jobs_deadline(aggregator):
+    check = OpenStackCheck("test", {'keystone_server_url': 'http://10.0.2.15:5000', 'threads_count': 1}, {}, {})
+    check._deadline = time.time() + 0.2
+
+    results = check._run_jobs([
+        (time.sleep, (0.5,), {}),
+        (lambda x: x, (1,), {}),
+        (int, ('not a number',), {}),
+    ])
+    check.stop()
+
+    assert [type(error) for _, error in results] == [RunDeadlineExceeded, RunDeadlineExceeded, RunDeadlineExceeded]
+
+    check._deadline = None
+    results = check._run_jobs([(lambda x: x, (1,), {}), (int, ('not a number',), {})])
+    check.stop()
+
+    assert results[0] == (1, None)
+    assert isinstance(results[1][1], ValueError)
+
+
+def test_list_servers_paginated():
+    init_config = {'keystone_server_url': 'http://10.0.2.15:5000', 'paginated_server_limit': 2}
+    check = OpenStackCheck("test", init_config, {}, {})
+    pages = [
+        {'servers': [{'id': 'server-1'}, {'id': 'server-2'}], 'servers_links': [{'rel': 'next', 'href': 'next'}]},
+        {'servers': [{'id': 'server-3'}]},
+    ]
+
+    with mock.patch('datadog_checks.openstack.OpenStackCheck._make_request_with_auth_fallback',
+                    side_effect=pages) as request:
+        servers = check._list_servers('http://10.0.2.15:8774/v2.1/servers/detail', {}, {'status': 'ACTIVE'})
+
+    assert [server['id'] for server in servers] == ['server-1', 'server-2', 'server-3']
+    assert [c[1]['params'] for c in request.call_args_list] == [
+        {'status': 'ACTIVE', 'limit': 2},
+        {'status': 'ACTIVE', 'limit': 2, 'marker': 'server-2'},
+    ]
+
+
+@mock.patch('datadog_checks.openstack.OpenStackCheck.get_auth_token', return_value="test_auth_token")
+def test_project_name_cache(*args):
+    check = OpenStackCheck("test", {'keystone_server_url': 'http://10.0.2.15:5000'}, {}, {})
+
+    with mock.patch('datadog_checks.openstack.OpenStackCheck._make_request_with_auth_fallback',
+                    return_value={'project': {'name': 'tenant-1'}}) as request:
+        assert check.get_project_name_from_id('263fd9') == 'tenant-1'
+        assert check.get_project_name_from_id('263fd9') == 'tenant-1'
+        assert request.call_count == 1
+
+        with mock.patch('time.time', return_value=time.time() + OpenStackCheck.PROJECT_NAME_CACHE_TTL + 1):
+            check.get_project_name_from_id('263fd9')
+        assert request.call_count == 2
+
+
+def test_token_expiry():
+    assert OpenStackScope.get_token_expiry({'token': {'expires_at': '2015-11-02T15:57:43.911674Z'}}) == 1446479863
+    assert OpenStackScope.get_token_expiry({'token': {'expires_at': 'not a date'}}) is None
+    assert OpenStackScope.get_token_expiry({}) is None
+
+    assert not OpenStackScope('token').expires_soon()
+    assert OpenStackScope('token', expires_at=time.time() + 10).expires_soon()
+    assert not OpenStackScope('token', expires_at=time.time() + 3600).expires_soon()
+
+
+def test_shared_scope(aggregator):
+    instance = copy.deepcopy(common.MOCK_CONFIG["instances"][0])
+    other_instance = dict(instance, name='other')
+    first = OpenStackCheck('openstack', init_config, {}, instances=[instance])
+    second = OpenStackCheck('openstack', init_config, {}, instances=[other_instance])
+    OpenStackCheck._shared_scopes.clear()
+
+    with mock.patch(
+        'datadog_checks.openstack.openstack.OpenStackProjectScope.request_auth_token',
+        return_value=MOCK_HTTP_RESPONSE
+    ) as request_auth_token:
+        scope = first.ensure_auth_scope(instance)
+        assert second.ensure_auth_scope(other_instance) is scope
+        assert request_auth_token.call_count == 1
+
+        # tokens about to expire are renewed
+        scope.expires_at = time.time()
+        assert first.ensure_auth_scope(instance) is not scope
+        assert request_auth_token.call_count == 2
+
+    OpenStackCheck._shared_scopes.clear()
+
+
+def test_delete_current_scope_concurrently():
+    instance = copy.deepcopy(common.MOCK_CONFIG["instances"][0])
+    check = OpenStackCheck('openstack', init_config, {}, instances=[instance])
+    OpenStackCheck._shared_scopes.clear()
+
+    with mock.patch(
+        'datadog_checks.openstack.openstack.OpenStackProjectScope.request_auth_token',
+        return_value=MOCK_HTTP_RESPONSE
+    ):
+        check._current_scope = check.ensure_auth_scope(instance)
+
+    # several requests failing with a 401 at once delete the scope from the thread pool
+    errors = []
+
+    def delete_current_scope():
+        try:
+            check.delete_current_scope()
+        except Exception as e:
+            errors.append(e)
+
+    with mock.patch.object(check.log, 'debug', side_effect=lambda *args: time.sleep(0.01)):
+        threads = [threading.Thread(target=delete_current_scope) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert errors == []
+    assert check.instance_map == {}
+    assert OpenStackCheck._shared_scopes == {}
@@ -5,6 +5,8 @@
 
 # stdlib
 from collections import defaultdict
+from contextlib import contextmanager
+import threading
 import time
 import os
 import subprocess
@@ -20,6 +22,7 @@ from datadog_checks.utils.platform import Platform
 
 DEFAULT_AD_CACHE_DURATION = 120
 DEFAULT_PID_CACHE_DURATION = 120
+DEFAULT_PROCESS_LIST_CACHE_DURATION = 10
 
 
 ATTR_TO_METRIC = {
@@ -55,7 +58,101 @@ ATTR_TO_METRIC_RATE = {
 }
 
 
+@contextmanager
+def _noop_context():
+    yield
+
+
+def oneshot(process):
+    """
+    Return a context in which psutil (>= 5.0) reads the info of `process` once for all the calls made in it
+    """
+    if hasattr(process, 'oneshot'):
+        return process.oneshot()
+    return _noop_context()
+
+
+class ProcessList(object):
+    """
+    A snapshot of the process table, built in a single pass and indexed by
+    process name and by command line (lowercased on Windows)
+    """
+    def __init__(self, fields, procfs_path):
+        """
+        :param fields: the fields to read for each process, `name` and/or `cmdline`
+        :param procfs_path: the procfs path the snapshot is built from
+        """
+        self.fields = frozenset(fields)
+        self.procfs_path = procfs_path
+        self.timestamp = time.time()
+
+        # pids of the processes that were running when the snapshot was built
+        self.pids = set()
+        # field -> pid -> AccessDenied error raised when reading the field
+        self.denied = dict((field, {}) for field in self.fields)
+        # name -> pids
+        self.by_name = defaultdict(set)
+        # command line -> pids
+        self.by_cmdline = defaultdict(set)
+
+        lower = os.name == 'nt'
+        for proc in psutil.process_iter():
+            try:
+                with oneshot(proc):
+                    if 'name' in self.fields:
+                        name = self._read(proc, 'name')
+                        if name is not None:
+                            self.by_name[name.lower() if lower else name].add(proc.pid)
+                    if 'cmdline' in self.fields:
+                        cmdline = self._read(proc, 'cmdline')
+                        if cmdline is not None:
+                            cmdline = ' '.join(cmdline)
+                            self.by_cmdline[cmdline.lower() if lower else cmdline].add(proc.pid)
+            except psutil.NoSuchProcess:
+                # disappeared while scanning
+                continue
+            self.pids.add(proc.pid)
+
+    def _read(self, proc, field):
+        try:
+            return getattr(proc, field)()
+        except psutil.AccessDenied as e:
+            self.denied[field][proc.pid] = e
+
+    def is_expired(self, duration):
+        return time.time() - self.timestamp > duration
+
+    def find(self, search_string, exact_match):
+        """
+        Return the pids of the processes whose name is one of `search_string` if `exact_match`,
+        whose command line contains one of them otherwise
+        """
+        field = 'name' if exact_match else 'cmdline'
+
+        # FIXME 6.x: All has been deprecated from the doc, should be removed
+        if 'All' in search_string:
+            return self.pids.difference(self.denied[field])
+
+        if os.name == 'nt':
+            search_string = [string.lower() for string in search_string]
+
+        matching_pids = set()
+        if exact_match:
+            for string in search_string:
+                matching_pids.update(self.by_name.get(string, ()))
+        else:
+            for cmdline, pids in self.by_cmdline.iteritems():
+                if any(string in cmdline for string in search_string):
+                    matching_pids.update(pids)
+
+        return matching_pids
+
+
 class ProcessCheck(AgentCheck):
+    # Snapshot of the process table shared by the instances of the check, see `get_process_list`
+    _process_list = None
+    _process_list_lock = threading.Lock()
+
     def __init__(self, name, init_config, agentConfig, instances=None):
         AgentCheck.__init__(self, name, init_config, agentConfig, instances)
 
@@ -83,6 +180,15 @@ class ProcessCheck(AgentCheck):
             )
         )
 
+        # The process table is walked at most once every `process_list_cache_duration`
+        # seconds, all the instances resolve their `search_string` against the same snapshot
+        self.process_list_cache_duration = int(
+            init_config.get(
+                'process_list_cache_duration',
+                DEFAULT_PROCESS_LIST_CACHE_DURATION
+            )
+        )
+
         self._conflicting_procfs = False
         self._deprecated_init_procfs = False
         if Platform.is_linux():
@@ -119,52 +225,30 @@ class ProcessCheck(AgentCheck):
 
         refresh_ad_cache = self.should_refresh_ad_cache(name)
 
-        matching_pids = set()
+        field = 'name' if exact_match else 'cmdline'
+        process_list = self.get_process_list(field)
 
-        for proc in psutil.process_iter():
+        denied = process_list.denied[field]
+        for pid, error in denied.iteritems():
             # Skip access denied processes
-            if not refresh_ad_cache and proc.pid in self.ad_cache:
+            if not refresh_ad_cache and pid in self.ad_cache:
                 continue
 
-            found = False
-            for string in search_string:
-                try:
-                    # FIXME 6.x: All has been deprecated
-                    # from the doc, should be removed
-                    if string == 'All':
-                        found = True
-                    if exact_match:
-                        if os.name == 'nt':
-                            if proc.name().lower() == string.lower():
-                                found = True
-                        else:
-                            if proc.name() == string:
-                                found = True
-
-                    else:
-                        cmdline = proc.cmdline()
-                        if os.name == 'nt':
-                            lstring = string.lower()
-                            if lstring in ' '.join(cmdline).lower():
-                                found = True
-                        else:
-                            if string in ' '.join(cmdline):
-                                found = True
-                except psutil.NoSuchProcess:
-                    self.log.warning('Process disappeared while scanning')
-                except psutil.AccessDenied as e:
-                    ad_error_logger('Access denied to process with PID {}'.format(proc.pid))
-                    ad_error_logger('Error: {}'.format(e))
-                    if refresh_ad_cache:
-                        self.ad_cache.add(proc.pid)
-                    if not ignore_ad:
-                        raise
-                else:
-                    if refresh_ad_cache:
-                        self.ad_cache.discard(proc.pid)
-                    if found:
-                        matching_pids.add(proc.pid)
-                        break
+            ad_error_logger('Access denied to process with PID {}'.format(pid))
+            ad_error_logger('Error: {}'.format(error))
+            if refresh_ad_cache:
+                self.ad_cache.add(pid)
+            if not ignore_ad:
+                # the next run will walk the process table again
+                with self._process_list_lock:
+                    ProcessCheck._process_list = None
+                raise error
+
+        matching_pids = process_list.find(search_string, exact_match)
+        if refresh_ad_cache:
+            self.ad_cache.intersection_update(denied)
+        else:
+            matching_pids.difference_update(self.ad_cache)
 
         self.pid_cache[name] = matching_pids
         self.last_pid_cache_ts[name] = time.time()
@@ -172,6 +256,25 @@ class ProcessCheck(AgentCheck):
             self.last_ad_cache_ts[name] = time.time()
         return matching_pids
 
+    def get_process_list(self, field):
+        """
+        Return the snapshot of the process table shared by the instances of the check,
+        walking the table again if the snapshot expired or lacks `field`
+        """
+        # PROCFS_PATH is only defined on the platforms with a procfs
+        procfs_path = getattr(psutil, 'PROCFS_PATH', None)
+        with self._process_list_lock:
+            process_list = ProcessCheck._process_list
+            if process_list is None or process_list.is_expired(self.process_list_cache_duration) \
+                    or process_list.procfs_path != procfs_path or field not in process_list.fields:
+                fields = {field}
+                if process_list is not None:
+                    # keep reading the fields needed by the other instances
+                    fields.update(process_list.fields)
+                process_list = ProcessCheck._process_list = ProcessList(fields, procfs_path)
+
+        return process_list
+
     def psutil_wrapper(self, process, method, accessors, try_sudo, *args, **kwargs):
         """
         A psutil wrapper that is calling
@@ -256,67 +359,69 @@ class ProcessCheck(AgentCheck):
 
             p = self.process_cache[name][pid]
 
-            meminfo = self.psutil_wrapper(p, 'memory_info', ['rss', 'vms'], try_sudo)
-            st['rss'].append(meminfo.get('rss'))
-            st['vms'].append(meminfo.get('vms'))
+            # read all the stats of the process at once
+            with oneshot(p):
+                meminfo = self.psutil_wrapper(p, 'memory_info', ['rss', 'vms'], try_sudo)
+                st['rss'].append(meminfo.get('rss'))
+                st['vms'].append(meminfo.get('vms'))
 
-            mem_percent = self.psutil_wrapper(p, 'memory_percent', None, try_sudo)
-            st['mem_pct'].append(mem_percent)
+                mem_percent = self.psutil_wrapper(p, 'memory_percent', None, try_sudo)
+                st['mem_pct'].append(mem_percent)
 
-            # will fail on win32 and solaris
-            shared_mem = self.psutil_wrapper(p, 'memory_info_ex', ['shared'], try_sudo).get('shared')
-            if shared_mem is not None and meminfo.get('rss') is not None:
-                st['real'].append(meminfo['rss'] - shared_mem)
-            else:
-                st['real'].append(None)
-
-            ctxinfo = self.psutil_wrapper(p, 'num_ctx_switches', ['voluntary', 'involuntary'], try_sudo)
-            st['ctx_swtch_vol'].append(ctxinfo.get('voluntary'))
-            st['ctx_swtch_invol'].append(ctxinfo.get('involuntary'))
-
-            st['thr'].append(self.psutil_wrapper(p, 'num_threads', None, try_sudo))
-
-            cpu_percent = self.psutil_wrapper(p, 'cpu_percent', None, try_sudo)
-            cpu_count = psutil.cpu_count()
-            if not new_process:
-                # psutil returns `0.` for `cpu_percent` the
-                # first time it's sampled on a process,
-                # so save the value only on non-new processes
-                st['cpu'].append(cpu_percent)
-                if cpu_count > 0 and cpu_percent is not None:
-                    st['cpu_norm'].append(cpu_percent/cpu_count)
+                # will fail on win32 and solaris
+                shared_mem = self.psutil_wrapper(p, 'memory_info_ex', ['shared'], try_sudo).get('shared')
+                if shared_mem is not None and meminfo.get('rss') is not None:
+                    st['real'].append(meminfo['rss'] - shared_mem)
                 else:
-                    self.log.debug('could not calculate the normalized '
-                                   'cpu pct, cpu_count: {}'.format(cpu_count))
-            st['open_fd'].append(self.psutil_wrapper(p, 'num_fds', None, try_sudo))
-            st['open_handle'].append(self.psutil_wrapper(p, 'num_handles', None, try_sudo))
-
-            ioinfo = self.psutil_wrapper(p, 'io_counters',
-                                         ['read_count', 'write_count', 'read_bytes', 'write_bytes'], try_sudo)
-            st['r_count'].append(ioinfo.get('read_count'))
-            st['w_count'].append(ioinfo.get('write_count'))
-            st['r_bytes'].append(ioinfo.get('read_bytes'))
-            st['w_bytes'].append(ioinfo.get('write_bytes'))
-
-            pagefault_stats = self.get_pagefault_stats(pid)
-            if pagefault_stats is not None:
-                (minflt, cminflt, majflt, cmajflt) = pagefault_stats
-                st['minflt'].append(minflt)
-                st['cminflt'].append(cminflt)
-                st['majflt'].append(majflt)
-                st['cmajflt'].append(cmajflt)
-            else:
-                st['minflt'].append(None)
-                st['cminflt'].append(None)
-                st['majflt'].append(None)
-                st['cmajflt'].append(None)
-
-            # calculate process run time
-            create_time = self.psutil_wrapper(p, 'create_time', None, try_sudo)
-            if create_time is not None:
-                now = time.time()
-                run_time = now - create_time
-                st['run_time'].append(run_time)
+                    st['real'].append(None)
+
+                ctxinfo = self.psutil_wrapper(p, 'num_ctx_switches', ['voluntary', 'involuntary'], try_sudo)
+                st['ctx_swtch_vol'].append(ctxinfo.get('voluntary'))
+                st['ctx_swtch_invol'].append(ctxinfo.get('involuntary'))
+
+                st['thr'].append(self.psutil_wrapper(p, 'num_threads', None, try_sudo))
+
+                cpu_percent = self.psutil_wrapper(p, 'cpu_percent', None, try_sudo)
+                cpu_count = psutil.cpu_count()
+                if not new_process:
+                    # psutil returns `0.` for `cpu_percent` the
+                    # first time it's sampled on a process,
+                    # so save the value only on non-new processes
+                    st['cpu'].append(cpu_percent)
+                    if cpu_count > 0 and cpu_percent is not None:
+                        st['cpu_norm'].append(cpu_percent/cpu_count)
+                    else:
+                        self.log.debug('could not calculate the normalized '
+                                       'cpu pct, cpu_count: {}'.format(cpu_count))
+                st['open_fd'].append(self.psutil_wrapper(p, 'num_fds', None, try_sudo))
+                st['open_handle'].append(self.psutil_wrapper(p, 'num_handles', None, try_sudo))
+
+                ioinfo = self.psutil_wrapper(p, 'io_counters',
+                                             ['read_count', 'write_count', 'read_bytes', 'write_bytes'], try_sudo)
+                st['r_count'].append(ioinfo.get('read_count'))
+                st['w_count'].append(ioinfo.get('write_count'))
+                st['r_bytes'].append(ioinfo.get('read_bytes'))
+                st['w_bytes'].append(ioinfo.get('write_bytes'))
+
+                pagefault_stats = self.get_pagefault_stats(pid)
+                if pagefault_stats is not None:
+                    (minflt, cminflt, majflt, cmajflt) = pagefault_stats
+                    st['minflt'].append(minflt)
+                    st['cminflt'].append(cminflt)
+                    st['majflt'].append(majflt)
+                    st['cmajflt'].append(cmajflt)
+                else:
+                    st['minflt'].append(None)
+                    st['cminflt'].append(None)
+                    st['majflt'].append(None)
+                    st['cmajflt'].append(None)
+
+                # calculate process run time
+                create_time = self.psutil_wrapper(p, 'create_time', None, try_sudo)
+                if create_time is not None:
+                    now = time.time()
+                    run_time = now - create_time
+                    st['run_time'].append(run_time)
 
         return st
 
@@ -4,6 +4,7 @@
 
 import contextlib
 import os
+import time
 from mock import patch, MagicMock
 import psutil
 from datadog_checks.process import ProcessCheck
@@ -135,6 +136,74 @@ def test_ad_cache(aggregator):
     process.check(config['instances'][0])
 
 
+class MockListedProcess(object):
+    def __init__(self, pid, name, cmdline):
+        self.pid = pid
+        self._name = name
+        self._cmdline = cmdline
+
+    def name(self):
+        return self._name
+
+    def cmdline(self):
+        if self._cmdline is None:
+            raise psutil.AccessDenied()
+        return self._cmdline
+
+
+MOCKED_PROCESS_TABLE = [
+    MockListedProcess(1, 'init', ['/sbin/init']),
+    MockListedProcess(10, 'postgres', ['postgres: writer process']),
+    MockListedProcess(11, 'postgres', ['postgres: checkpointer process']),
+    MockListedProcess(12, 'python', ['python', 'app.py', '--workers', '4']),
+    MockListedProcess(13, 'secret', None),
+]
+
+
+def test_process_list_shared(aggregator):
+    process = ProcessCheck(common.CHECK_NAME, {}, {})
+    ProcessCheck._process_list = None
+
+    with patch('psutil.process_iter', return_value=MOCKED_PROCESS_TABLE) as process_iter:
+        assert process.find_pids('pg', ['postgres'], True) == {10, 11}
+        assert process.find_pids('app', ['app.py', 'checkpointer'], False) == {11, 12}
+        # a check from another instance uses the same snapshot
+        other = ProcessCheck(common.CHECK_NAME, {}, {})
+        assert other.find_pids('python', ['python'], True) == {12}
+        assert other.find_pids('all', ['All'], False) == {1, 10, 11, 12}
+
+    # the table was walked a second time to read the command lines
+    assert process_iter.call_count == 2
+    assert ProcessCheck._process_list.fields == {'name', 'cmdline'}
+    assert process.ad_cache == {13}
+
+
+def test_process_list_expired(aggregator):
+    process = ProcessCheck(common.CHECK_NAME, {'process_list_cache_duration': 0}, {})
+    ProcessCheck._process_list = None
+
+    with patch('psutil.process_iter', return_value=MOCKED_PROCESS_TABLE) as process_iter:
+        process.find_pids('pg', ['postgres'], True)
+        with patch('time.time', return_value=time.time() + 1):
+            process.find_pids('init', ['init'], True)
+
+    assert process_iter.call_count == 2
+
+
+def test_process_list_no_procfs(aggregator):
+    # PROCFS_PATH only exists on the platforms with a procfs
+    process = ProcessCheck(common.CHECK_NAME, {}, {})
+    ProcessCheck._process_list = None
+
+    with patch('psutil.process_iter', return_value=MOCKED_PROCESS_TABLE), \
+            patch.object(psutil, 'PROCFS_PATH', create=True):
+        del psutil.PROCFS_PATH
+        assert process.find_pids('pg', ['postgres'], True) == {10, 11}
+        assert process.find_pids('init', ['init'], True) == {1}
+
+    assert ProcessCheck._process_list.procfs_path is None
+
+
 def mock_find_pid(name, search_string, exact_match=True, ignore_ad=True,
                   refresh_ad_cache=True):
     if search_string is not None:
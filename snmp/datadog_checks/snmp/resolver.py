@@ -0,0 +1,197 @@
+# (C) Datadog, Inc. 2018
+# All rights reserved
+# Licensed under Simplified BSD License (see LICENSE)
+
+# 3rd party
+from pysnmp.error import PySnmpError
+from pysnmp.hlapi.varbinds import CommandGeneratorVarBinds
+from pysnmp.proto import rfc1902, rfc1905
+from pysnmp.smi.error import NoSuchObjectError
+from pysnmp.smi.rfc1902 import ObjectIdentity
+
+# project
+from datadog_checks.utils.cache import LRUCache
+
+
+DEFAULT_INDEX_CACHE_SIZE = 10000
+
+# Values signaling that an OID has no value, which don't have the type of the OID
+UNCASTABLE_VALUES = (rfc1905.UnSpecified, rfc1905.NoSuchObject, rfc1905.NoSuchInstance, rfc1905.EndOfMibView)
+
+
+def parse_oid(oid):
+    '''
+    Convert a dotted-string OID to a tuple of integers
+    '''
+    return tuple(int(i) for i in oid.strip('.').split('.'))
+
+
+class OIDTrie(object):
+    '''
+    Map OIDs (tuples of integers) to values, to find the value registered for
+    the longest prefix of an OID without trying every registered OID
+    '''
+    def __init__(self):
+        # {sub-identifier: node}, the value of a node is stored under the None key
+        self._root = {}
+
+    def __setitem__(self, oid, value):
+        node = self._root
+        for sub_id in oid:
+            node = node.setdefault(sub_id, {})
+        node[None] = value
+
+    def prefixes(self, oid):
+        '''
+        Yield (length, value) for every registered prefix of oid, oid included, shortest first
+        '''
+        node = self._root
+        for length, sub_id in enumerate(oid):
+            node = node.get(sub_id)
+            if node is None:
+                return
+            if None in node:
+                yield length + 1, node[None]
+
+    def match(self, oid):
+        '''
+        Return (length, value) for the longest registered prefix of oid, (0, None) if there's none
+        '''
+        match = 0, None
+        for match in self.prefixes(oid):
+            pass
+        return match
+
+
+class Column(object):
+    '''
+    A MIB scalar or table column
+    '''
+    def __init__(self, symbol, syntax, row_oid, row_node=None):
+        self.symbol = symbol
+        self.syntax = syntax
+        self.row_oid = row_oid
+        self.row_node = row_node
+
+    def get_index(self, suffix):
+        '''
+        Decode the index of a row from the sub-identifiers following the column OID
+        '''
+        if self.row_node is not None:
+            return self.row_node.getIndicesFromInstId(suffix)
+        return (rfc1902.ObjectName(suffix),)
+
+    def cast(self, value):
+        '''
+        Convert a value received from the device to the type defined in the MIB
+        '''
+        if self.syntax is None or isinstance(value, UNCASTABLE_VALUES):
+            return value
+        return self.syntax.clone(value)
+
+
+class OIDResolver(object):
+    '''
+    Resolve the OIDs returned by a device to the MIB symbol and row index they
+    belong to, without going through the MIB for each of them:
+    - the MIB symbols to collect are resolved once, when registered, into a trie
+      mapping the OID of each scalar or table column to its symbol.
+    - the row indexes are decoded the first time they are seen, and cached.
+    The OIDs that don't belong to any registered symbol are resolved the first
+    time they are seen with `resolve_oid`, only to get the type of their values.
+    '''
+    vb_processor = CommandGeneratorVarBinds()
+
+    def __init__(self, snmp_engine, index_cache_size=DEFAULT_INDEX_CACHE_SIZE):
+        self.mib_view_controller = self.vb_processor.getMibViewController(snmp_engine)
+        self._columns = OIDTrie()
+        # (row oid, index sub-identifiers) -> index
+        self._indexes = LRUCache(maxsize=index_cache_size)
+        # oid -> Column, for the oids that are not under a registered symbol
+        self._oid_columns = LRUCache(maxsize=index_cache_size)
+
+        mib_builder = self.mib_view_controller.mibBuilder
+        self._mib_scalar, self._mib_table_column = mib_builder.importSymbols(
+            'SNMPv2-SMI', 'MibScalar', 'MibTableColumn')
+
+    def register(self, mib, symbol):
+        '''
+        Resolve a MIB symbol: a scalar, a table or a table column. A table is registered
+        with all its columns. Return the resolved ObjectIdentity of the symbol, to query it
+        without resolving it again. Raise a PySnmpError if it can't be resolved.
+        '''
+        identity = ObjectIdentity(mib, symbol).resolveWithMib(self.mib_view_controller)
+        oid = identity.getOid().asTuple()
+
+        node = identity.getMibNode()
+        if isinstance(node, (self._mib_scalar, self._mib_table_column)):
+            self._register_node(oid, symbol, node)
+        else:
+            # a table, or its row: register the columns under it
+            for column_oid, column_symbol, column in self._iter_nodes(oid):
+                if isinstance(column, self._mib_table_column):
+                    self._register_node(column_oid, column_symbol, column)
+
+        return identity
+
+    def resolve(self, oid):
+        '''
+        Return the Column the oid belongs to and the index of the row, None if it doesn't
+        belong to any registered symbol
+        '''
+        length, column = self._columns.match(oid)
+        if column is None:
+            return None
+
+        suffix = oid[length:]
+        key = (column.row_oid, suffix)
+        index = self._indexes.get(key)
+        if index is None:
+            index = column.get_index(suffix)
+            self._indexes.set(key, index)
+        return column, index
+
+    def resolve_oid(self, oid):
+        '''
+        Return the Column of any oid, to convert its values to their MIB type.
+        The oid is resolved with the MIBs the first time only.
+        '''
+        column = self._oid_columns.get(oid)
+        if column is None:
+            syntax = None
+            try:
+                identity = ObjectIdentity(oid).resolveWithMib(self.mib_view_controller)
+                node = identity.getMibNode()
+                if isinstance(node, (self._mib_scalar, self._mib_table_column)):
+                    syntax = node.getSyntax()
+            except PySnmpError:
+                pass
+            column = Column(None, syntax, oid)
+            self._oid_columns.set(oid, column)
+        return column
+
+    def _register_node(self, oid, symbol, node):
+        if isinstance(node, self._mib_table_column):
+            row_node, = self._import_node(oid[:-1])
+            self._columns[oid] = Column(symbol, node.getSyntax(), oid[:-1], row_node)
+        else:
+            self._columns[oid] = Column(symbol, node.getSyntax(), oid)
+
+    def _import_node(self, oid):
+        mod_name, sym_name, _ = self.mib_view_controller.getNodeLocation(oid)
+        return self.mib_view_controller.mibBuilder.importSymbols(mod_name, sym_name)
+
+    def _iter_nodes(self, oid):
+        '''
+        Yield the (oid, symbol, node) of the MIB nodes under oid
+        '''
+        next_oid = oid
+        while True:
+            try:
+                next_oid, label, _ = self.mib_view_controller.getNextNodeName(next_oid)
+            except NoSuchObjectError:
+                return
+            if next_oid[:len(oid)] != oid:
+                return
+            node, = self._import_node(next_oid)
+            yield tuple(next_oid), label[-1], node
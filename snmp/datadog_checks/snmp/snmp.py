@@ -10,14 +10,15 @@ from functools import wraps
 from pysnmp.entity.rfc3413.oneliner import cmdgen
 import pysnmp.proto.rfc1902 as snmp_type
 from pysnmp.smi import builder
-from pysnmp.smi.exval import noSuchInstance, noSuchObject
+from pysnmp.smi.exval import endOfMibView, noSuchInstance, noSuchObject
 from pysnmp.error import PySnmpError
+from pyasn1.error import PyAsn1Error
 from pyasn1.type.univ import OctetString
 
 # project
 from checks.network_checks import NetworkCheck, Status
 from config import _is_affirmative
-
+from .resolver import DEFAULT_INDEX_CACHE_SIZE, OIDResolver, OIDTrie, parse_oid
 
 
 # Additional types that are not part of the SNMP protocol. cf RFC 2856
@@ -40,6 +41,8 @@ SNMP_GAUGES = frozenset([
     snmp_type.Integer32.__name__])
 
 DEFAULT_OID_BATCH_SIZE = 10
+# 0 to walk tables with GETNEXT requests
+DEFAULT_MAX_REPETITIONS = 0
 
 
 def reply_invalid(oid):
@@ -61,10 +64,18 @@ class SnmpCheck(NetworkCheck):
                 instance['name'] = self._get_instance_key(instance)
 
         self.generators = {}
+        # Metrics to collect per instance, parsed and resolved with the MIBs once
+        self.instance_metrics = {}
 
         # Set OID batch size
         self.oid_batch_size = int(init_config.get("oid_batch_size", DEFAULT_OID_BATCH_SIZE))
 
+        # Walk tables with GETBULK requests
+        self.max_repetitions = int(init_config.get("max_repetitions", DEFAULT_MAX_REPETITIONS))
+
+        # Number of table rows whose index is kept decoded, per instance
+        self.index_cache_size = int(init_config.get("index_cache_size", DEFAULT_INDEX_CACHE_SIZE))
+
         # Load Custom MIB directory
         self.mibs_path = None
         self.ignore_nonincreasing_oid = False
@@ -224,16 +235,46 @@ class SnmpCheck(NetworkCheck):
             instance["service_check_error"] = message
             raise Exception(message)
 
+    def report_error_status(self, error_status, instance):
+        message = "{0} for instance {1}".format(error_status.prettyPrint(),
+                                                instance["ip_address"])
+        instance["service_check_error"] = message
+
+        # submit CRITICAL service check if we can't connect to device
+        if 'unknownUserName' in message:
+            instance["service_check_severity"] = Status.CRITICAL
+            self.log.error(message)
+        else:
+            self.warning(message)
+
+    def report_snmp_error(self, error, instance):
+        if "service_check_error" not in instance:
+            instance["service_check_error"] = "Fail to collect some metrics: {0}".format(error)
+        if "service_check_severity" not in instance:
+            instance["service_check_severity"] = Status.CRITICAL
+        self.warning("Fail to collect some metrics: {0}".format(error))
+
+    def get_max_repetitions(self, instance, auth_data):
+        '''
+        Return the max-repetitions of the GETBULK requests used to walk tables,
+        0 to use GETNEXT requests. SNMP v1 doesn't support GETBULK.
+        '''
+        if getattr(auth_data, 'mpModel', None) == 0:
+            return 0
+        return int(instance.get('max_repetitions', self.max_repetitions))
+
     def check_table(self, instance, cmd_generator, oids, lookup_names,
-                    timeout, retries, enforce_constraints=False):
+                    timeout, retries, resolver, enforce_constraints=False):
         '''
         Perform a snmpwalk on the domain specified by the oids, on the device
         configured in instance.
         lookup_names is a boolean to specify whether or not to use the mibs to
-        resolve the name and values.
+        resolve the name and values, through resolver (an OIDResolver).
+        enforce_constraints is a boolean to specify whether or not to drop the
+        values that don't meet the mibs constraints.
 
         Returns a dictionary:
-        dict[oid/metric_name][row index] = value
+        dict[oid tuple/metric_name][row index] = value
         In case of scalar objects, the row index is just 0
         '''
         # UPDATE: We used to perform only a snmpgetnext command to fetch metric values.
@@ -241,18 +282,59 @@ class SnmpCheck(NetworkCheck):
         # For example:
         # snmpgetnext -v2c -c public localhost:11111 1.3.6.1.2.1.25.4.2.1.7.222
         # iso.3.6.1.2.1.25.4.2.1.7.224 = INTEGER: 2
-        # SOLUTION: perform a snmpget command and fallback with snmpgetnext if not found
-
-        # Set aliases for snmpget and snmpgetnext with logging
-        snmpget = self.snmp_logger(cmd_generator.getCmd)
-        snmpgetnext = self.snmp_logger(cmd_generator.nextCmd)
+        # SOLUTION: perform a snmpget command and fallback with snmpgetnext (or snmpbulkget
+        # when max_repetitions is set) if not found
         transport_target = self.get_transport_target(instance, timeout, retries)
         auth_data = self.get_auth_data(instance)
         context_engine_id, context_name = self.get_context_data(instance)
+        max_repetitions = self.get_max_repetitions(instance, auth_data)
+
+        all_binds = self.fetch(instance, cmd_generator, oids, auth_data, transport_target,
+                               context_engine_id, context_name, max_repetitions)
+
+        results = defaultdict(dict)
+        for result_oid, value in all_binds:
+            oid = result_oid.asTuple()
+            if lookup_names:
+                resolved = resolver.resolve(oid)
+                if resolved is None:
+                    continue
+                column, index = resolved
+            else:
+                column = resolver.resolve_oid(oid)
+
+            try:
+                value = column.cast(value)
+            except PyAsn1Error as e:
+                if enforce_constraints:
+                    self.report_snmp_error(e, instance)
+                    continue
+
+            if lookup_names:
+                results[column.symbol][index] = value
+            else:
+                results[oid] = value
+
+        # if we've collected some variables, it's not that bad.
+        if "service_check_severity" in instance and len(all_binds):
+            instance["service_check_severity"] = Status.WARNING
+
+        self.log.debug("Raw results: {0}".format(results))
+        return results
+
+    def fetch(self, instance, cmd_generator, oids, auth_data, transport_target,
+              context_engine_id, context_name, max_repetitions):
+        '''
+        Query the oids in batches and return the (oid, value) pairs collected.
+        The results are not resolved with the mibs.
+        '''
+        # Set aliases for snmpget, snmpgetnext and snmpbulkget with logging
+        snmpget = self.snmp_logger(cmd_generator.getCmd)
+        snmpgetnext = self.snmp_logger(cmd_generator.nextCmd)
+        snmpbulkget = self.snmp_logger(cmd_generator.bulkCmd)
 
         first_oid = 0
         all_binds = []
-        results = defaultdict(dict)
 
         while first_oid < len(oids):
             try:
@@ -261,8 +343,7 @@ class SnmpCheck(NetworkCheck):
                     auth_data,
                     transport_target,
                     *(oids[first_oid:first_oid + self.oid_batch_size]),
-                    lookupValues=enforce_constraints,
-                    lookupNames=lookup_names,
+                    lookupMib=False,
                     contextEngineId=context_engine_id,
                     contextName=context_name
                 )
@@ -276,111 +357,131 @@ class SnmpCheck(NetworkCheck):
                 for var in var_binds:
                     result_oid, value = var
                     if reply_invalid(value):
-                        oid_tuple = result_oid.asTuple()
-                        oid = ".".join([str(i) for i in oid_tuple])
-                        missing_results.append(oid)
+                        missing_results.append(result_oid.asTuple())
                     else:
                         complete_results.append(var)
 
                 if missing_results:
-                    # If we didn't catch the metric using snmpget, try snmpnext
-                    error_indication, error_status, error_index, var_binds_table = snmpgetnext(
-                        auth_data,
-                        transport_target,
-                        *missing_results,
-                        lookupValues=enforce_constraints,
-                        lookupNames=lookup_names,
-                        contextEngineId=context_engine_id,
-                        contextName=context_name
-                    )
+                    # If we didn't catch the metric using snmpget, walk it
+                    if max_repetitions:
+                        error_indication, error_status, error_index, var_binds_table = snmpbulkget(
+                            auth_data,
+                            transport_target,
+                            0,
+                            max_repetitions,
+                            *missing_results,
+                            lookupMib=False,
+                            contextEngineId=context_engine_id,
+                            contextName=context_name
+                        )
+                    else:
+                        error_indication, error_status, error_index, var_binds_table = snmpgetnext(
+                            auth_data,
+                            transport_target,
+                            *missing_results,
+                            lookupMib=False,
+                            contextEngineId=context_engine_id,
+                            contextName=context_name
+                        )
 
                     # Raise on error_indication
                     self.raise_on_error_indication(error_indication, instance)
 
                     if error_status:
-                        message = "{0} for instance {1}".format(error_status.prettyPrint(),
-                                                                instance["ip_address"])
-                        instance["service_check_error"] = message
-
-                        # submit CRITICAL service check if we can't connect to device
-                        if 'unknownUserName' in message:
-                            instance["service_check_severity"] = Status.CRITICAL
-                            self.log.error(message)
-                        else:
-                            self.warning(message)
+                        self.report_error_status(error_status, instance)
 
                     for table_row in var_binds_table:
-                        complete_results.extend(table_row)
+                        # the walk of the oids that reached the end of their subtree is padded with endOfMibView
+                        complete_results.extend(var for var in table_row if not endOfMibView.isSameTypeWith(var[1]))
 
                 all_binds.extend(complete_results)
 
             except PySnmpError as e:
-                if "service_check_error" not in instance:
-                    instance["service_check_error"] = "Fail to collect some metrics: {0}".format(e)
-                if "service_check_severity" not in instance:
-                    instance["service_check_severity"] = Status.CRITICAL
-                self.warning("Fail to collect some metrics: {0}".format(e))
+                self.report_snmp_error(e, instance)
 
             # if we fail move onto next batch
             first_oid = first_oid + self.oid_batch_size
 
-        # if we've collected some variables, it's not that bad.
-        if "service_check_severity" in instance and len(all_binds):
-            instance["service_check_severity"] = Status.WARNING
+        return all_binds
 
-        for result_oid, value in all_binds:
-            if lookup_names:
-                _, metric, indexes = result_oid.getMibSymbol()
-                results[metric][indexes] = value
-            else:
-                oid = result_oid.asTuple()
-                matching = ".".join([str(i) for i in oid])
-                results[matching] = value
-        self.log.debug("Raw results: {0}".format(results))
-        return results
-
-    def _check(self, instance):
-        '''
-        Perform two series of SNMP requests, one for all that have MIB asociated
-        and should be looked up and one for those specified by oids
+    def get_instance_metrics(self, instance, cmd_generator, metrics):
         '''
+        Parse the metrics of the instance, the first time only: resolve the
+        symbols of the metrics specified with a MIB, and index the metrics
+        specified by oid in a trie to match the results against.
 
-        cmd_generator, ip_address, tags, metrics, timeout, retries, enforce_constraints = self._load_conf(instance)
-
-        if not metrics:
-            raise Exception('Metrics list must contain at least one metric')
-
-        tags += ['snmp_device:{0}'.format(ip_address)]
+        Returns (table_oids, raw_oids, resolver, raw_oids_trie, errors), with
+        errors the exceptions raised when resolving the symbols
+        '''
+        instance_key = instance['name']
+        if instance_key in self.instance_metrics:
+            return self.instance_metrics[instance_key]
 
+        resolver = OIDResolver(cmd_generator.snmpEngine, self.index_cache_size)
         table_oids = []
         raw_oids = []
+        errors = []
+        # oid tuple -> indexes of the metrics querying it
+        metrics_by_oid = defaultdict(list)
 
         # Check the metrics completely defined
-        for metric in metrics:
+        for idx, metric in enumerate(metrics):
             if 'MIB' in metric:
                 try:
                     assert "table" in metric or "symbol" in metric
                     to_query = metric.get("table", metric.get("symbol"))
-                    table_oids.append(cmdgen.MibVariable(metric["MIB"], to_query))
+                    table_oids.append(resolver.register(metric["MIB"], to_query))
+                except PySnmpError as e:
+                    errors.append(e)
                 except Exception as e:
                     self.log.warning("Can't generate MIB object for variable : %s\n"
                                      "Exception: %s", metric, e)
             elif 'OID' in metric:
                 raw_oids.append(metric['OID'])
+                try:
+                    metrics_by_oid[parse_oid(metric['OID'])].append(idx)
+                except ValueError:
+                    self.log.warning("Invalid OID %s", metric['OID'])
             else:
                 raise Exception('Unsupported metric in config file: %s' % metric)
+
+        raw_oids_trie = OIDTrie()
+        for oid, metric_indexes in metrics_by_oid.iteritems():
+            raw_oids_trie[oid] = metric_indexes
+
+        self.instance_metrics[instance_key] = table_oids, raw_oids, resolver, raw_oids_trie, errors
+        return self.instance_metrics[instance_key]
+
+    def _check(self, instance):
+        '''
+        Perform two series of SNMP requests, one for all that have MIB asociated
+        and should be looked up and one for those specified by oids
+        '''
+
+        cmd_generator, ip_address, tags, metrics, timeout, retries, enforce_constraints = self._load_conf(instance)
+
+        if not metrics:
+            raise Exception('Metrics list must contain at least one metric')
+
+        tags += ['snmp_device:{0}'.format(ip_address)]
+
+        table_oids, raw_oids, resolver, raw_oids_trie, errors = self.get_instance_metrics(
+            instance, cmd_generator, metrics)
         try:
+            for error in errors:
+                self.report_snmp_error(error, instance)
+
             if table_oids:
                 self.log.debug("Querying device %s for %s oids", ip_address, len(table_oids))
                 table_results = self.check_table(instance, cmd_generator, table_oids, True, timeout, retries,
-                                                 enforce_constraints=enforce_constraints)
+                                                 resolver, enforce_constraints=enforce_constraints)
                 self.report_table_metrics(metrics, table_results, tags)
 
             if raw_oids:
                 self.log.debug("Querying device %s for %s oids", ip_address, len(raw_oids))
                 raw_results = self.check_table(instance, cmd_generator, raw_oids, False, timeout, retries,
-                                               enforce_constraints=False)
-                self.report_raw_metrics(metrics, raw_results, tags)
+                                               resolver, enforce_constraints=False)
+                self.report_raw_metrics(metrics, raw_results, tags, raw_oids_trie)
         except Exception as e:
             if "service_check_error" not in instance:
                 instance["service_check_error"] = "Fail to collect metrics for {0} - {1}".format(instance['name'], e)
@@ -406,7 +507,7 @@ class SnmpCheck(NetworkCheck):
                            message=msg
                            )
 
-    def report_raw_metrics(self, metrics, results, tags):
+    def report_raw_metrics(self, metrics, results, tags, oids_trie):
         '''
         For all the metrics that are specified as oid,
         the conf oid is going to exactly match or be a prefix of the oid sent back by the device
@@ -414,27 +515,28 @@ class SnmpCheck(NetworkCheck):
 
         Submit the results to the aggregator.
         '''
+        # index of the metric -> value of its oid, or of the first result under it
+        values = {}
+        for oid, value in results.iteritems():
+            for length, metric_indexes in oids_trie.prefixes(oid):
+                for idx in metric_indexes:
+                    if length == len(oid):
+                        values[idx] = value
+                    else:
+                        values.setdefault(idx, value)
 
-        for metric in metrics:
+        for idx, metric in enumerate(metrics):
             forced_type = metric.get('forced_type')
             if 'OID' in metric:
-                queried_oid = metric['OID']
-                if queried_oid in results:
-                    value = results[queried_oid]
-                else:
-                    for oid in results:
-                        if oid.startswith(queried_oid):
-                            value = results[oid]
-                            break
-                    else:
-                        self.log.warning("No matching results found for oid %s",
-                                         queried_oid)
-                        continue
+                if idx not in values:
+                    self.log.warning("No matching results found for oid %s",
+                                     metric['OID'])
+                    continue
                 name = metric.get('name', 'unnamed_metric')
                 metric_tags = tags
                 if metric.get('metric_tags'):
                     metric_tags = metric_tags + metric.get('metric_tags')
-                self.submit_metric(name, value, forced_type, metric_tags)
+                self.submit_metric(name, values[idx], forced_type, metric_tags)
 
     def report_table_metrics(self, metrics, results, tags):
         '''
@@ -458,12 +560,15 @@ class SnmpCheck(NetworkCheck):
                     else:
                         self.log.warning("No indication on what value to use for this tag")
 
+                # the tags of each row, shared by the symbols of the table
+                row_tags = {}
                 for value_to_collect in metric.get("symbols", []):
-                    for index, val in results[value_to_collect].items():
-                        metric_tags = tags + self.get_index_tags(index, results,
-                                                                 index_based_tags,
-                                                                 column_based_tags)
-                        self.submit_metric(value_to_collect, val, forced_type, metric_tags)
+                    for index, val in results[value_to_collect].iteritems():
+                        if index not in row_tags:
+                            row_tags[index] = tags + self.get_index_tags(index, results,
+                                                                         index_based_tags,
+                                                                         column_based_tags)
+                        self.submit_metric(value_to_collect, val, forced_type, row_tags[index])
 
             elif 'symbol' in metric:
                 name = metric['symbol']
@@ -0,0 +1,153 @@
+# (C) Datadog, Inc. 2018
+# All rights reserved
+# Licensed under Simplified BSD License (see LICENSE)
+
+# stdlib
+import unittest
+
+# 3rd party
+import mock
+from nose.plugins.attrib import attr
+from pyasn1.error import PyAsn1Error
+from pysnmp.entity.rfc3413.oneliner import cmdgen
+from pysnmp.error import PySnmpError
+from pysnmp.proto import rfc1902
+from pysnmp.smi.exval import noSuchInstance
+
+# project
+from datadog_checks.snmp import SnmpCheck
+from datadog_checks.snmp.resolver import OIDResolver, OIDTrie, parse_oid
+
+IF_DESCR = (1, 3, 6, 1, 2, 1, 2, 2, 1, 2)
+IF_ADMIN_STATUS = (1, 3, 6, 1, 2, 1, 2, 2, 1, 7)
+SYS_DESCR = (1, 3, 6, 1, 2, 1, 1, 1)
+SYS_UPTIME = (1, 3, 6, 1, 2, 1, 1, 3)
+
+
+@attr(requires='snmp')
+class TestOIDTrie(unittest.TestCase):
+    def test_parse_oid(self):
+        self.assertEqual(parse_oid('1.3.6.1.2.1.1.1.0'), SYS_DESCR + (0,))
+        self.assertEqual(parse_oid('.1.3.6.1.2.1.1.1.0'), SYS_DESCR + (0,))
+        self.assertRaises(ValueError, parse_oid, '1.3.six')
+
+    def test_match(self):
+        trie = OIDTrie()
+        trie[(1, 3, 6, 1, 2, 1, 1)] = 'system'
+        trie[SYS_DESCR] = 'sysDescr'
+
+        self.assertEqual(trie.match(SYS_DESCR + (0,)), (8, 'sysDescr'))
+        self.assertEqual(trie.match(SYS_UPTIME + (0,)), (7, 'system'))
+        self.assertEqual(list(trie.prefixes(SYS_DESCR + (0,))), [(7, 'system'), (8, 'sysDescr')])
+        # OIDs are matched component-wise: 1.3.6.1.2.1.1 is not a prefix of 1.3.6.1.2.1.10
+        self.assertEqual(trie.match((1, 3, 6, 1, 2, 1, 10, 1)), (0, None))
+        self.assertEqual(trie.match((1, 3, 6)), (0, None))
+
+
+@attr(requires='snmp')
+class TestOIDResolver(unittest.TestCase):
+    def setUp(self):
+        self.resolver = OIDResolver(cmdgen.CommandGenerator().snmpEngine)
+
+    def test_register_table(self):
+        identity = self.resolver.register('IF-MIB', 'ifTable')
+        self.assertEqual(identity.getOid().asTuple(), (1, 3, 6, 1, 2, 1, 2, 2))
+
+        column, index = self.resolver.resolve(IF_DESCR + (5,))
+        self.assertEqual(column.symbol, 'ifDescr')
+        self.assertEqual(index, (5,))
+        # the index is decoded once
+        self.assertIs(self.resolver.resolve(IF_DESCR + (5,))[1], index)
+        # the columns of a row share its indexes
+        self.assertIs(self.resolver.resolve(IF_ADMIN_STATUS + (5,))[1], index)
+
+        self.assertIsNone(self.resolver.resolve(SYS_DESCR + (0,)))
+
+    def test_register_scalar(self):
+        self.resolver.register('SNMPv2-MIB', 'sysUpTime')
+
+        column, index = self.resolver.resolve(SYS_UPTIME + (0,))
+        self.assertEqual(column.symbol, 'sysUpTime')
+        self.assertEqual(index, ((0,),))
+        self.assertIsInstance(column.cast(rfc1902.TimeTicks(42)), rfc1902.TimeTicks)
+
+    def test_register_invalid_symbol(self):
+        self.assertRaises(PySnmpError, self.resolver.register, 'IF-MIB', 'ifFoo')
+
+    def test_cast(self):
+        self.resolver.register('IF-MIB', 'ifAdminStatus')
+        column, _ = self.resolver.resolve(IF_ADMIN_STATUS + (1,))
+
+        self.assertEqual(column.cast(rfc1902.Integer(2)).prettyPrint(), 'down')
+        # the values signaling a missing OID are kept as is
+        self.assertIs(column.cast(noSuchInstance), noSuchInstance)
+        # ifAdminStatus is an enumeration of 1, 2 or 3
+        self.assertRaises(PyAsn1Error, column.cast, rfc1902.Integer(7))
+
+    def test_resolve_oid(self):
+        column = self.resolver.resolve_oid(SYS_DESCR + (0,))
+        self.assertEqual(column.cast(rfc1902.OctetString('switch')).prettyPrint(), 'switch')
+        self.assertIsNot(type(column.cast(rfc1902.OctetString('switch'))), rfc1902.OctetString)
+        self.assertIs(self.resolver.resolve_oid(SYS_DESCR + (0,)), column)
+
+        # no MIB defines the type of this oid
+        value = rfc1902.Integer(1)
+        self.assertIs(self.resolver.resolve_oid((1, 3, 6, 1, 4, 1, 99999, 1)).cast(value), value)
+
+
+@attr(requires='snmp')
+class TestSnmpCheckResults(unittest.TestCase):
+    INSTANCE = {
+        'ip_address': 'localhost',
+        'port': 11111,
+        'community_string': 'public',
+        'name': 'localhost:11111',
+    }
+
+    def setUp(self):
+        self.check = SnmpCheck('snmp', {}, {}, [dict(self.INSTANCE)])
+        self.cmd_generator = cmdgen.CommandGenerator()
+        self.resolver = OIDResolver(self.cmd_generator.snmpEngine)
+        self.resolver.register('IF-MIB', 'ifAdminStatus')
+
+    def check_table(self, binds, enforce_constraints):
+        instance = dict(self.INSTANCE)
+        binds = [(rfc1902.ObjectName(oid), value) for oid, value in binds]
+        with mock.patch.object(self.check, 'fetch', return_value=binds), \
+                mock.patch.object(self.check, 'report_snmp_error') as report_snmp_error:
+            results = self.check.check_table(instance, self.cmd_generator, [], True, 1, 0, self.resolver,
+                                             enforce_constraints=enforce_constraints)
+        return results, report_snmp_error
+
+    def test_enforce_constraints(self):
+        binds = [(IF_ADMIN_STATUS + (1,), rfc1902.Integer(1)), (IF_ADMIN_STATUS + (2,), rfc1902.Integer(7))]
+
+        results, report_snmp_error = self.check_table(binds, enforce_constraints=True)
+        self.assertEqual(dict((index, int(value)) for index, value in results['ifAdminStatus'].items()), {(1,): 1})
+        self.assertEqual(report_snmp_error.call_count, 1)
+
+        results, report_snmp_error = self.check_table(binds, enforce_constraints=False)
+        self.assertEqual(dict((index, int(value)) for index, value in results['ifAdminStatus'].items()),
+                         {(1,): 1, (2,): 7})
+        self.assertFalse(report_snmp_error.called)
+
+    def test_report_raw_metrics(self):
+        metrics = [
+            {'OID': '1.3.6.1.2.1.1', 'name': 'system'},
+            {'OID': '1.3.6.1.2.1.1.3.0', 'name': 'sysUpTime'},
+            {'OID': '1.3.6.1.2.1.10', 'name': 'transmission'},
+        ]
+        trie = OIDTrie()
+        for idx, metric in enumerate(metrics):
+            trie[parse_oid(metric['OID'])] = [idx]
+        results = {
+            SYS_UPTIME + (0,): rfc1902.TimeTicks(42),
+            (1, 3, 6, 1, 2, 1, 10, 7, 2, 1): rfc1902.Gauge32(3),
+        }
+
+        with mock.patch.object(self.check, 'submit_metric') as submit_metric:
+            self.check.report_raw_metrics(metrics, results, ['foo:bar'], trie)
+
+        submitted = dict((args[0], int(args[1])) for args, _ in submit_metric.call_args_list)
+        # 1.3.6.1.2.1.1 is not a prefix of 1.3.6.1.2.1.10.7.2.1
+        self.assertEqual(submitted, {'system': 42, 'sysUpTime': 42, 'transmission': 3})
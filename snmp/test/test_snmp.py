@@ -37,6 +37,13 @@ class SNMPTestCase(AgentCheckTest):
         'community_string': "public",
     }
 
+    # snmpsim simulating a 48-port switch, see test/ci/resources/snmpsim/switch.snmprec
+    SNMPSIM_CONF = {
+        'ip_address': "localhost",
+        'port': 11112,
+        'community_string': "switch",
+    }
+
     SNMP_V3_CONF = {
         'ip_address': "localhost",
         'port': 11111,
@@ -153,6 +160,30 @@ class SNMPTestCase(AgentCheckTest):
         ]
     }]
 
+    SWITCH_INTERFACES = 48
+
+    SWITCH_TABULAR_OBJECTS = [{
+        'MIB': "IF-MIB",
+        'table': "ifTable",
+        'symbols': ["ifSpeed", "ifOutQLen"],
+        'metric_tags': [
+            {
+                'tag': "interface",
+                'column': "ifDescr"
+            }
+        ]
+    }, {
+        'MIB': "IF-MIB",
+        'table': "ifXTable",
+        'symbols': ["ifHighSpeed"],
+        'metric_tags': [
+            {
+                'tag': "interface",
+                'column': "ifName"
+            }
+        ]
+    }]
+
     INVALID_METRICS = [
         {
             'MIB': "IF-MIB",
@@ -620,3 +651,38 @@ class SNMPTestCase(AgentCheckTest):
                                 tags=self.CHECK_TAGS, count=1)
 
         self.coverage_report()
+
+    def _test_switch_table(self, init_config):
+        config = {
+            'init_config': init_config,
+            'instances': [self.generate_instance_config(self.SWITCH_TABULAR_OBJECTS, self.SNMPSIM_CONF)]
+        }
+        self.run_check(config)
+        self.service_checks = self.wait_for_async('get_service_checks', 'service_checks', 1, RESULTS_TIMEOUT)
+
+        # Every row of the tables is walked, across several GETBULK pages
+        self.metrics = self.wait_for_async('get_metrics', 'metrics', 2 * self.SWITCH_INTERFACES, RESULTS_TIMEOUT)
+        for metric_name in ["snmp.ifSpeed", "snmp.ifHighSpeed"]:
+            for port in range(1, self.SWITCH_INTERFACES + 1):
+                tags = self.CHECK_TAGS + ["interface:eth{0}".format(port)]
+                self.assertMetric(metric_name, tags=tags, count=1)
+
+        # ifOutQLen is not implemented by the switch
+        self.assertMetric("snmp.ifOutQLen", count=0)
+
+        self.assertServiceCheck("snmp.can_check", status=AgentCheck.OK,
+                                tags=self.CHECK_TAGS, count=1)
+
+        self.coverage_report()
+
+    def test_table_getnext(self):
+        """
+        Walk tables with GETNEXT requests
+        """
+        self._test_switch_table({})
+
+    def test_table_getbulk(self):
+        """
+        Walk tables with GETBULK requests
+        """
+        self._test_switch_table({'max_repetitions': 10})
@@ -10,7 +10,7 @@ import time
 import traceback
 
 from pyVim import connect
-from pyVmomi import vim  # pylint: disable=E0611
+from pyVmomi import vim, vmodl  # pylint: disable=E0611
 
 from datadog_checks.config import _is_affirmative
 from datadog_checks.checks import AgentCheck
@@ -36,13 +36,25 @@ VM_MONITORING_FLAG = 'DatadogMonitored'
 DEFAULT_SIZE_POOL = 4
 # The interval in seconds between two refresh of the entities list
 REFRESH_MORLIST_INTERVAL = 3 * 60
+# The interval in seconds between two full refresh of the entities list, when it is kept up to date
+# between them with the updates of a PropertyCollector (`incremental_discovery`)
+REFRESH_MORLIST_INCREMENTAL_INTERVAL = 60 * 60
 # The interval in seconds between two refresh of metrics metadata (id<->name)
 REFRESH_METRICS_METADATA_INTERVAL = 10 * 60
 # The amount of jobs batched at the same time in the queue to query available metrics
 BATCH_MORLIST_SIZE = 50
+# The maximum number of metrics queried in a single QueryPerf call, 0 to query each MOR separately
+DEFAULT_MAX_QUERY_METRICS = 0
 
 REALTIME_RESOURCES = {'vm', 'host'}
 
+# The resources kept up to date between two full refresh by `incremental_discovery`, and
+# the properties whose changes are watched
+INCREMENTAL_RESOURCES = {
+    'vm': ['name', 'runtime.powerState', 'runtime.host'],
+    'host': ['name'],
+}
+
 RESOURCE_TYPE_MAP = {
     'vm': vim.VirtualMachine,
     'datacenter': vim.Datacenter,
@@ -50,9 +62,10 @@ RESOURCE_TYPE_MAP = {
     'datastore': vim.Datastore
 }
 
-# Time after which we reap the jobs that clog the queue
-# TODO: use it
-JOB_TIMEOUT = 10
+# Time after which the jobs are cancelled, or reaped if they're running and clog the pool. None for no limit
+DEFAULT_JOB_TIMEOUT = None
+# Maximum number of jobs queued, the check waits for a slot when the queue is full. 0 for no limit
+DEFAULT_MAX_QUEUE_SIZE = 0
 MORLIST = 'morlist'
 METRICS_METADATA = 'metrics_metadata'
 LAST = 'last'
@@ -87,8 +100,10 @@ class VSphereCheck(AgentCheck):
         AgentCheck.__init__(self, name, init_config, agentConfig, instances)
         self.time_started = time.time()
         self.pool_started = False
-        self.jobs_status = {}
         self.exceptionq = Queue()
+        self.job_timeout = self.init_config.get('job_timeout', DEFAULT_JOB_TIMEOUT)
+        if self.job_timeout is not None:
+            self.job_timeout = float(self.job_timeout)
 
         # Connections open to vCenter instances
         self.server_instances = {}
@@ -99,11 +114,15 @@ class VSphereCheck(AgentCheck):
         self.cache_times = {}
         for instance in self.instances:
             i_key = self._instance_key(instance)
+            if _is_affirmative(instance.get('incremental_discovery', False)):
+                default_morlist_interval = REFRESH_MORLIST_INCREMENTAL_INTERVAL
+            else:
+                default_morlist_interval = REFRESH_MORLIST_INTERVAL
             self.cache_times[i_key] = {
                 MORLIST: {
                     LAST: 0,
                     INTERVAL: init_config.get('refresh_morlist_interval',
-                                              REFRESH_MORLIST_INTERVAL)
+                                              default_morlist_interval)
                 },
                 METRICS_METADATA: {
                     LAST: 0,
@@ -124,40 +143,50 @@ class VSphereCheck(AgentCheck):
         self.metrics_metadata = {}
         self.latest_event_query = {}
 
+        # With `incremental_discovery`: the PropertyCollector reporting the changes of the
+        # inventory, and the version of the latest update applied to the MOR lists
+        self.property_collectors = {}
+        self.update_versions = {}
+        # ...and the available metrics, per (MOR type, host)
+        self.available_metrics = {}
+
     def stop(self):
         self.stop_pool()
+        for i_key in list(self.property_collectors):
+            self._destroy_update_filter(i_key)
 
     def start_pool(self):
         self.log.info("Starting Thread Pool")
         self.pool_size = int(self.init_config.get('threads_count', DEFAULT_SIZE_POOL))
+        max_queue_size = int(self.init_config.get('max_queue_size', DEFAULT_MAX_QUEUE_SIZE))
 
-        self.pool = Pool(self.pool_size)
+        self.pool = Pool(self.pool_size, name='vsphere', max_queue_size=max_queue_size, job_timeout=self.job_timeout)
         self.pool_started = True
-        self.jobs_status = {}
 
-    def stop_pool(self):
+    def stop_pool(self, wait=True):
+        """
+        Terminate the pool. With `wait` set to False, the worker threads are not
+        joined: they are daemons, left to exit when their current job returns.
+        """
         self.log.info("Stopping Thread Pool")
         if self.pool_started:
             self.pool.terminate()
-            self.pool.join()
-            self.jobs_status.clear()
-            assert self.pool.get_nworkers() == 0
+            if wait:
+                self.pool.join()
+                assert self.pool.get_nworkers() == 0
             self.pool_started = False
 
-    def restart_pool(self):
-        self.stop_pool()
+    def restart_pool(self, wait=True):
+        self.stop_pool(wait=wait)
         self.start_pool()
 
     def _clean(self):
         self.log.debug("Cleaning the pool of hanging jobs")
-        now = time.time()
-        # TODO: use that
-        for name in self.jobs_status.keys():
-            start_time = self.jobs_status[name]
-            if now - start_time > JOB_TIMEOUT:
-                self.log.critical("Restarting Pool. One check is stuck.")
-                self.restart_pool()
-                break
+        # Queued jobs past their deadline are cancelled by the pool, but the running ones can't be interrupted
+        if self.job_timeout and self.pool.late_jobs():
+            self.log.critical("Restarting Pool. One check is stuck.")
+            # Joining the pool would wait for the stuck job: abandon its threads instead
+            self.restart_pool(wait=False)
 
     def _query_event(self, instance):
         i_key = self._instance_key(instance)
@@ -318,6 +347,65 @@ class VSphereCheck(AgentCheck):
 
         return external_host_tags
 
+    def _get_parent_tags(self, mor):
+        self.log.debug("Fetching tags for parent of %s", mor.name)
+        tags = []
+        if mor.parent:
+            tag = []
+            if isinstance(mor.parent, vim.HostSystem):
+                tag.append(u'vsphere_host:{}'.format(mor.parent.name))
+            elif isinstance(mor.parent, vim.Folder):
+                tag.append(u'vsphere_folder:{}'.format(mor.parent.name))
+            elif isinstance(mor.parent, vim.ComputeResource):
+                if isinstance(mor.parent, vim.ClusterComputeResource):
+                    tag.append(u'vsphere_cluster:{}'.format(mor.parent.name))
+                tag.append(u'vsphere_compute:{}'.format(mor.parent.name))
+            elif isinstance(mor.parent, vim.Datacenter):
+                tag.append(u'vsphere_datacenter:{}'.format(mor.parent.name))
+
+            tags = self._get_parent_tags(mor.parent)
+            if tag:
+                tags.extend(tag)
+
+        return tags
+
+    def _get_mor_info(self, c, vimtype, tags):
+        """
+        Return the `morlist_raw` entry of a vsphere object, None for a powered off VM
+        """
+        instance_tags = []
+        hostname = c.name
+        host = None
+        if c.parent:
+            instance_tags += self._get_parent_tags(c)
+
+        vsphere_type = None
+        if isinstance(c, vim.VirtualMachine):
+            msg = "Adding VM %s"
+            vsphere_type = u'vsphere_type:vm'
+            if c.runtime.powerState == vim.VirtualMachinePowerState.poweredOff:
+                self.log.debug("Skipping powered off VM %s", c.name)
+                return None
+            host = str(c.runtime.host)
+            instance_tags.append(u'vsphere_host:{}'.format(c.runtime.host.name))
+        elif isinstance(c, vim.HostSystem):
+            msg = "Adding Host %s"
+            vsphere_type = u'vsphere_type:host'
+            host = str(c)
+        elif isinstance(c, vim.Datastore):
+            msg = "Adding Datastore %s"
+            vsphere_type = u'vsphere_type:datastore'
+            instance_tags.append(u'vsphere_datastore:{}'.format(c.name))
+            hostname = None
+        elif isinstance(c, vim.Datacenter):
+            msg = "Adding Datacenter %s"
+            vsphere_type = u'vsphere_type:datacenter'
+            hostname = None
+        self.log.debug(msg, c.name)
+        if vsphere_type:
+            instance_tags.append(vsphere_type)
+        return dict(mor_type=vimtype, mor=c, hostname=hostname, host=host, tags=tags + instance_tags)
+
     def _discover_mor(self, instance, tags, regexes=None, include_only_marked=False):
         """
         Explore vCenter infrastructure to discover hosts, virtual machines
@@ -344,28 +432,6 @@ class VSphereCheck(AgentCheck):
         If it's a node we want to query metric for, queue it in `self.morlist_raw` that
         will be processed by another job.
         """
-        def _get_parent_tags(mor):
-            self.log.debug("Fetching tags for parent of %s", mor.name)
-            tags = []
-            if mor.parent:
-                tag = []
-                if isinstance(mor.parent, vim.HostSystem):
-                    tag.append(u'vsphere_host:{}'.format(mor.parent.name))
-                elif isinstance(mor.parent, vim.Folder):
-                    tag.append(u'vsphere_folder:{}'.format(mor.parent.name))
-                elif isinstance(mor.parent, vim.ComputeResource):
-                    if isinstance(mor.parent, vim.ClusterComputeResource):
-                        tag.append(u'vsphere_cluster:{}'.format(mor.parent.name))
-                    tag.append(u'vsphere_compute:{}'.format(mor.parent.name))
-                elif isinstance(mor.parent, vim.Datacenter):
-                    tag.append(u'vsphere_datacenter:{}'.format(mor.parent.name))
-
-                tags = _get_parent_tags(mor.parent)
-                if tag:
-                    tags.extend(tag)
-
-            return tags
-
         def _get_all_objs(content, vimtype, regexes=None, include_only_marked=False, tags=None):
             """
             Get all the vsphere objects associated with a given type
@@ -379,37 +445,10 @@ class VSphereCheck(AgentCheck):
                 True)
 
             for c in container.view:
-                instance_tags = []
                 if not self._is_excluded(c, regexes, include_only_marked):
-                    hostname = c.name
-                    if c.parent:
-                        instance_tags += _get_parent_tags(c)
-
-                    vsphere_type = None
-                    if isinstance(c, vim.VirtualMachine):
-                        msg = "Adding VM %s"
-                        vsphere_type = u'vsphere_type:vm'
-                        if c.runtime.powerState == vim.VirtualMachinePowerState.poweredOff:
-                            msg = "Skipping powered off VM %s"
-                            continue
-                        host = c.runtime.host.name
-                        instance_tags.append(u'vsphere_host:{}'.format(host))
-                    elif isinstance(c, vim.HostSystem):
-                        msg = "Adding Host %s"
-                        vsphere_type = u'vsphere_type:host'
-                    elif isinstance(c, vim.Datastore):
-                        msg = "Adding Datastore %s"
-                        vsphere_type = u'vsphere_type:datastore'
-                        instance_tags.append(u'vsphere_datastore:{}'.format(c.name))
-                        hostname = None
-                    elif isinstance(c, vim.Datacenter):
-                        msg = "Adding Datacenter %s"
-                        vsphere_type = u'vsphere_type:datacenter'
-                        hostname = None
-                    self.log.debug(msg, c.name)
-                    if vsphere_type:
-                        instance_tags.append(vsphere_type)
-                    obj_list.append(dict(mor_type=vimtype, mor=c, hostname=hostname, tags=tags + instance_tags))
+                    mor = self._get_mor_info(c, vimtype, tags)
+                    if mor is not None:
+                        obj_list.append(mor)
                 else:
                     self.log.debug("Skipping excluded object %s based on `*include_only_*` yaml parameter", c.name)
 
@@ -496,18 +535,204 @@ class VSphereCheck(AgentCheck):
                 return
         self.morlist_raw[i_key] = {}
 
-        instance_tag = "vcenter_server:%s" % instance.get('name')
+        tags, regexes, include_only_marked = self._get_discovery_config(instance)
+
+        # Watch the changes of the inventory before discovering it so that none is missed
+        update_filter_failed = False
+        if self._is_incremental(instance) and i_key not in self.property_collectors:
+            try:
+                self._create_update_filter(instance)
+            except Exception as e:
+                self.log.warning("Unable to watch the inventory updates of vCenter instance %s: %s", i_key, e)
+                update_filter_failed = True
+
+        # Discover hosts and virtual machines
+        self.log.debug("Start discovering MORs to cache in `morlist_raw`")
+        self._discover_mor(instance, tags, regexes, include_only_marked)
+
+        self.cache_times[i_key][MORLIST][LAST] = time.time()
+        if update_filter_failed:
+            # Fall back to the regular refresh interval until the inventory can be watched
+            interval = self.cache_times[i_key][MORLIST][INTERVAL]
+            self.cache_times[i_key][MORLIST][LAST] -= max(0, interval - REFRESH_MORLIST_INTERVAL)
+
+    @staticmethod
+    def _is_incremental(instance):
+        return _is_affirmative(instance.get('incremental_discovery', False))
+
+    @staticmethod
+    def _get_discovery_config(instance):
+        """ Return the tags, `*_include_only` regexes and `include_only_marked` setting
+        to discover the MORs of an instance with
+        """
+        tags = ["vcenter_server:%s" % instance.get('name')]
         regexes = {
             'host_include': instance.get('host_include_only_regex'),
             'vm_include': instance.get('vm_include_only_regex')
         }
         include_only_marked = _is_affirmative(instance.get('include_only_marked', False))
+        return tags, regexes, include_only_marked
 
-        # Discover hosts and virtual machines
-        self.log.debug("Start discovering MORs to cache in `morlist_raw`")
-        self._discover_mor(instance, [instance_tag], regexes, include_only_marked)
+    def _create_update_filter(self, instance):
+        """ Create a PropertyCollector reporting the changes of the VMs and hosts of the inventory.
+        Its initial update set, that lists them all, is skipped: they are discovered by `_discover_mor`.
+        """
+        i_key = self._instance_key(instance)
+        self.log.debug("Creating a PropertyCollector to watch the inventory updates of instance %s", i_key)
+        content = self._get_server_instance(instance).content
+
+        view = content.viewManager.CreateContainerView(
+            content.rootFolder,
+            [RESOURCE_TYPE_MAP[resource] for resource in sorted(INCREMENTAL_RESOURCES)],
+            True)
+        traversal_spec = vmodl.query.PropertyCollector.TraversalSpec(
+            name='traverseView', path='view', skip=False, type=vim.view.ContainerView
+        )
+        obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=view, skip=True, selectSet=[traversal_spec])
+        prop_specs = [
+            vmodl.query.PropertyCollector.PropertySpec(type=RESOURCE_TYPE_MAP[resource], pathSet=properties)
+            for resource, properties in sorted(INCREMENTAL_RESOURCES.iteritems())
+        ]
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=prop_specs)
+
+        # A dedicated collector, so that the versions of its updates are not shared with other clients
+        collector = content.propertyCollector.CreatePropertyCollector()
+        collector.CreateFilter(filter_spec, partialUpdates=True)
+        _, version = self._wait_for_updates(collector, '')
+
+        self.property_collectors[i_key] = collector
+        self.update_versions[i_key] = version
+
+    def _destroy_update_filter(self, i_key):
+        collector = self.property_collectors.pop(i_key, None)
+        self.update_versions.pop(i_key, None)
+        if collector is None:
+            return
+        try:
+            collector.Destroy()
+        except Exception as e:
+            self.log.debug("Unable to destroy the PropertyCollector of instance %s: %s", i_key, e)
 
-        self.cache_times[i_key][MORLIST][LAST] = time.time()
+    @staticmethod
+    def _wait_for_updates(collector, version):
+        """ Return the object updates reported by a PropertyCollector since `version`, without waiting
+        :return: tuple (list of ObjectUpdate, version of the latest update)
+        """
+        updates = []
+        options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=0)
+        while True:
+            update_set = collector.WaitForUpdatesEx(version, options)
+            if update_set is None:
+                break
+            version = update_set.version
+            for filter_update in update_set.filterSet:
+                updates.extend(filter_update.objectSet)
+            if not update_set.truncated:
+                break
+        return updates, version
+
+    def _update_morlist(self, instance):
+        """ Apply the changes of the VMs and hosts reported by the PropertyCollector since the
+        previous run to the MOR lists: removed ones are dropped, and new or modified ones are
+        queued in `morlist_raw` to be processed again.
+        On failure, a full refresh of the MOR list is scheduled.
+        """
+        i_key = self._instance_key(instance)
+        collector = self.property_collectors.get(i_key)
+        if collector is None:
+            return
+
+        try:
+            updates, version = self._wait_for_updates(collector, self.update_versions[i_key])
+        except Exception as e:
+            self.log.warning("Unable to get the inventory updates of vCenter instance %s, "
+                             "scheduling a full refresh: %s", i_key, e)
+            self._destroy_update_filter(i_key)
+            self.cache_times[i_key][MORLIST][LAST] = 0
+            return
+
+        self.update_versions[i_key] = version
+        if not updates:
+            return
+
+        self.log.debug("Applying %d inventory updates to instance %s", len(updates), i_key)
+        tags, regexes, include_only_marked = self._get_discovery_config(instance)
+        morlist_raw = self.morlist_raw.setdefault(i_key, {})
+        for update in updates:
+            try:
+                self._apply_update(i_key, update, morlist_raw, tags, regexes, include_only_marked)
+            except Exception as e:
+                # e.g. the object was deleted since the update, or is an orphaned VM:
+                # drop it, the next full refresh will discover it again if needed
+                self.log.warning("Unable to apply the update of %s to instance %s, removing it: %s",
+                                 update.obj, i_key, e)
+                self._remove_mor(i_key, str(update.obj))
+
+    def _apply_update(self, i_key, update, morlist_raw, tags, regexes, include_only_marked):
+        """ Apply the update of a VM or host to the MOR lists of an instance
+        """
+        obj = update.obj
+        resource_type = 'vm' if isinstance(obj, vim.VirtualMachine) else 'host'
+
+        mor = None
+        if update.kind != 'leave':
+            if self._is_excluded(obj, regexes, include_only_marked):
+                self.log.debug("Skipping excluded object %s based on `*include_only_*` yaml parameter", obj.name)
+            else:
+                mor = self._get_mor_info(obj, resource_type, tags)
+        if mor is None:
+            # removed, powered off or excluded
+            self.log.debug("Removing MOR %s from instance %s cache", obj, i_key)
+            self._remove_mor(i_key, str(obj))
+            return
+
+        # processed again by _cache_morlist_process_atomic, like a newly discovered one
+        morlist_raw.setdefault(resource_type, []).append(mor)
+
+        if resource_type == 'host':
+            # the VMs of a renamed host have to be tagged with its new name
+            for vm in self.morlist.get(i_key, {}).values():
+                if vm['mor_type'] == 'vm' and vm['host'] == mor['host']:
+                    try:
+                        vm_mor = self._get_mor_info(vm['mor'], 'vm', tags)
+                    except Exception as e:
+                        self.log.warning("Unable to update VM %s of instance %s, removing it: %s",
+                                         vm['mor'], i_key, e)
+                        self._remove_mor(i_key, str(vm['mor']))
+                        continue
+                    if vm_mor is not None:
+                        morlist_raw.setdefault('vm', []).append(vm_mor)
+
+    def _remove_mor(self, i_key, mor_name):
+        """ Remove a MOR from the MOR lists of an instance
+        """
+        self.morlist.get(i_key, {}).pop(mor_name, None)
+        for mors in self.morlist_raw.get(i_key, {}).itervalues():
+            mors[:] = [mor for mor in mors if str(mor['mor']) != mor_name]
+
+    def _get_available_metrics(self, instance, perfManager, mor):
+        """ Query the metrics available for a MOR.
+        With `incremental_discovery`, they are cached per (MOR type, host) until the next refresh of
+        the metrics metadata, and the metrics having several instances are queried for all of them.
+        """
+        if not self._is_incremental(instance):
+            return perfManager.QueryAvailablePerfMetric(mor['mor'], intervalId=mor['interval'])
+
+        i_key = self._instance_key(instance)
+        cache = self.available_metrics.setdefault(i_key, {})
+        key = (mor['mor_type'], mor['host'])
+        if key not in cache:
+            instances = {}
+            for metric in perfManager.QueryAvailablePerfMetric(mor['mor'], intervalId=mor['interval']):
+                if metric.instance:
+                    instances[metric.counterId] = '*'
+                else:
+                    instances.setdefault(metric.counterId, '')
+            cache[key] = [
+                vim.PerformanceManager.MetricId(counterId=counter_id, instance=instance_name)
+                for counter_id, instance_name in instances.iteritems()
+            ]
+        return cache[key]
 
     @atomic_method
     def _cache_morlist_process_atomic(self, instance, mor):
@@ -526,7 +751,7 @@ class VSphereCheck(AgentCheck):
 
         mor['interval'] = REAL_TIME_INTERVAL if mor['mor_type'] in REALTIME_RESOURCES else None
 
-        available_metrics = perfManager.QueryAvailablePerfMetric(mor['mor'], intervalId=mor['interval'])
+        available_metrics = self._get_available_metrics(instance, perfManager, mor)
 
         self.log.debug("Computing list of metrics to keep from %s", available_metrics)
         mor['metrics'] = self._compute_needed_metrics(instance, available_metrics)
@@ -534,8 +759,9 @@ class VSphereCheck(AgentCheck):
         mor_name = str(mor['mor'])
         if mor_name in self.morlist[i_key]:
             # Was already here last iteration
-            self.log.debug("MOR %s already present in instance %s cache, refreshing metrics list only", mor_name, i_key)
-            self.morlist[i_key][mor_name]['metrics'] = mor['metrics']
+            self.log.debug("MOR %s already present in instance %s cache, refreshing it", mor_name, i_key)
+            for field in ('metrics', 'hostname', 'host', 'tags'):
+                self.morlist[i_key][mor_name][field] = mor[field]
         else:
             self.log.debug("Adding MOR %s to instance %s cache", mor_name, i_key)
             self.morlist[i_key][mor_name] = mor
@@ -588,10 +814,11 @@ class VSphereCheck(AgentCheck):
         i_key = self._instance_key(instance)
         self.log.debug("Checking if there are old MORs to remove for instance %s", i_key)
         morlist = self.morlist[i_key].items()
+        max_age = 2 * max(REFRESH_MORLIST_INTERVAL, self.cache_times[i_key][MORLIST][INTERVAL])
 
         for mor_name, mor in morlist:
             last_seen = mor['last_seen']
-            if (time.time() - last_seen) > 2 * REFRESH_MORLIST_INTERVAL:
+            if (time.time() - last_seen) > max_age:
                 self.log.debug("Removing old MOR %s", mor_name)
                 del self.morlist[i_key][mor_name]
 
@@ -623,6 +850,7 @@ class VSphereCheck(AgentCheck):
         self.log.info("Finished metadata collection for instance %s", i_key)
         # Reset metadata
         self.metrics_metadata[i_key] = new_metadata
+        self.available_metrics.pop(i_key, None)
         self.log.debug("New cached metadata for instance %s: %s", i_key, new_metadata)
 
         # ## <TEST-INSTRUMENTATION>
@@ -642,6 +870,46 @@ class VSphereCheck(AgentCheck):
         # Defaults to return the value without transformation
         return value
 
+    def _submit_metrics(self, instance, mor, results):
+        """ Submit the values returned by QueryPerf for one MOR
+        """
+        i_key = self._instance_key(instance)
+        custom_tags = instance.get('tags', [])
+
+        for result in results:
+            if result.id.counterId not in self.metrics_metadata[i_key]:
+                self.log.debug("Skipping this metric value, because there is no metadata about it")
+                continue
+
+            # Metric types are absolute, delta, and rate
+            try:
+                metric_name = self.metrics_metadata[i_key][result.id.counterId]['name']
+                self.log.debug("Processing metric %s", metric_name)
+            except KeyError:
+                self.log.debug("No metric name for counter %s", result.id.counterId)
+                metric_name = None
+
+            if metric_name not in ALL_METRICS:
+                self.log.debug(u"Skipping unknown `%s` metric.", metric_name)
+                continue
+
+            if not result.value:
+                self.log.debug(u"Skipping `%s` metric because the value is empty", metric_name)
+                continue
+
+            instance_name = result.id.instance or "none"
+            value = self._transform_value(instance, result.id.counterId, result.value[0])
+
+            # vsphere "rates" should be submitted as gauges (rate is
+            # precomputed).
+            self.gauge(
+                "vsphere.%s" % metric_name,
+                value,
+                hostname=mor['hostname'],
+                tags=['instance:%s' % instance_name] + custom_tags
+            )
+            self.log.debug("Submitted metric %s with value %s", metric_name, value)
+
     @atomic_method
     def _collect_metrics_atomic(self, instance, mor):
         """ Task that collects the metrics listed in the morlist for one MOR
@@ -663,43 +931,7 @@ class VSphereCheck(AgentCheck):
                                                  format='normal')
         results = perfManager.QueryPerf(querySpec=[query])
         if results:
-            for result in results[0].value:
-                if result.id.counterId not in self.metrics_metadata[i_key]:
-                    self.log.debug("Skipping this metric value, because there is no metadata about it")
-                    continue
-
-                # Metric types are absolute, delta, and rate
-                try:
-                    metric_name = self.metrics_metadata[i_key][result.id.counterId]['name']
-                    self.log.debug("Processing metric %s", metric_name)
-                except KeyError:
-                    self.log.debug("No metric name for counter %s", result.id.counterId)
-                    metric_name = None
-
-                if metric_name not in ALL_METRICS:
-                    self.log.debug(u"Skipping unknown `%s` metric.", metric_name)
-                    continue
-
-                if not result.value:
-                    self.log.debug(u"Skipping `%s` metric because the value is empty", metric_name)
-                    continue
-
-                instance_name = result.id.instance or "none"
-                value = self._transform_value(instance, result.id.counterId, result.value[0])
-
-                tags = ['instance:%s' % instance_name]
-                if not mor['hostname']:  # no host tags available
-                    tags.extend(mor['tags'])
-
-                # vsphere "rates" should be submitted as gauges (rate is
-                # precomputed).
-                self.gauge(
-                    "vsphere.%s" % metric_name,
-                    value,
-                    hostname=mor['hostname'],
-                    tags=['instance:%s' % instance_name] + custom_tags
-                )
-                self.log.debug("Submitted metric %s with value %s", metric_name, value)
+            self._submit_metrics(instance, mor, results[0].value)
         else:
             self.log.debug("No result when querying metrics for MOR %s", mor)
 
@@ -707,6 +939,69 @@ class VSphereCheck(AgentCheck):
         self.histogram('datadog.agent.vsphere.metric_colection.time', t.total(), tags=custom_tags)
         # ## </TEST-INSTRUMENTATION>
 
+    @atomic_method
+    def _collect_metrics_batch_atomic(self, instance, batch):
+        """ Task that collects the metrics of several MORs with a single QueryPerf call
+        :param batch: list of (mor, metrics) pairs, as built by `_batch_queries`
+        """
+        # ## <TEST-INSTRUMENTATION>
+        t = Timer()
+        # ## </TEST-INSTRUMENTATION>
+
+        i_key = self._instance_key(instance)
+        self.log.debug("Collect metrics for a batch of %d queries of instance %s", len(batch), i_key)
+        server_instance = self._get_server_instance(instance)
+        perfManager = server_instance.content.perfManager
+        custom_tags = instance.get('tags', [])
+
+        queries = []
+        mors_by_entity = {}
+        for mor, metrics in batch:
+            queries.append(vim.PerformanceManager.QuerySpec(maxSample=1,
+                                                            entity=mor['mor'],
+                                                            metricId=metrics,
+                                                            intervalId=mor['interval'],
+                                                            format='normal'))
+            mors_by_entity[mor['mor']] = mor
+
+        results = perfManager.QueryPerf(querySpec=queries)
+        for entity_metric in results or []:
+            # Demultiplex the results back to their MOR
+            mor = mors_by_entity.get(entity_metric.entity)
+            if mor is None:
+                self.log.debug("Skipping the result of an entity that was not queried: %s", entity_metric.entity)
+                continue
+            self._submit_metrics(instance, mor, entity_metric.value)
+
+        # ## <TEST-INSTRUMENTATION>
+        self.histogram('datadog.agent.vsphere.metric_colection.time', t.total(), tags=custom_tags)
+        # ## </TEST-INSTRUMENTATION>
+
+    @staticmethod
+    def _batch_queries(mors, max_query_metrics):
+        """ Group the metrics to collect of several MORs in batches of `max_query_metrics`
+        metrics, each batch being queried with a single QueryPerf call. The metrics of a
+        MOR may be split across two or more batches to fill them up.
+        :return: list of batches, each one a list of (mor, metrics) pairs
+        """
+        batches = []
+        batch = []
+        batch_size = 0
+        for mor in mors:
+            metrics = mor['metrics']
+            while metrics:
+                chunk = metrics[:max_query_metrics - batch_size]
+                metrics = metrics[len(chunk):]
+                batch.append((mor, chunk))
+                batch_size += len(chunk)
+                if batch_size == max_query_metrics:
+                    batches.append(batch)
+                    batch = []
+                    batch_size = 0
+        if batch:
+            batches.append(batch)
+        return batches
+
     def collect_metrics(self, instance):
         """ Calls asynchronously _collect_metrics_atomic on all MORs, as the
         job queue is processed the Aggregator will receive the metrics.
@@ -722,7 +1017,9 @@ class VSphereCheck(AgentCheck):
         vm_count = 0
 
         custom_tags = instance.get('tags', [])
+        max_query_metrics = int(self.init_config.get('max_query_metrics', DEFAULT_MAX_QUERY_METRICS))
 
+        mors_to_query = []
         for mor_name, mor in mors:
             if mor['mor_type'] == 'vm':
                 vm_count += 1
@@ -730,9 +1027,18 @@ class VSphereCheck(AgentCheck):
                 self.log.debug("Skipping mor %s that doesn't have metrics", mor)
                 continue
 
+            if max_query_metrics > 0:
+                mors_to_query.append(mor)
+                continue
+
             self.log.debug("Scheduling metric collection to the thread pool")
             self.pool.apply_async(self._collect_metrics_atomic, args=(instance, mor))
 
+        if max_query_metrics > 0:
+            for batch in self._batch_queries(mors_to_query, max_query_metrics):
+                self.log.debug("Scheduling batched metric collection to the thread pool")
+                self.pool.apply_async(self._collect_metrics_batch_atomic, args=(instance, batch))
+
         self.gauge('vsphere.vm.count', vm_count, tags=["vcenter_server:%s" % instance.get('name')] + custom_tags)
 
     def check(self, instance):
@@ -742,7 +1048,7 @@ class VSphereCheck(AgentCheck):
         custom_tags = instance.get('tags', [])
 
         # ## <TEST-INSTRUMENTATION>
-        self.gauge('datadog.agent.vsphere.queue_size', self.pool._workq.qsize(), tags=['instant:initial'] + custom_tags)
+        self.gauge('datadog.agent.vsphere.queue_size', self.pool.qsize(), tags=['instant:initial'] + custom_tags)
         # ## </TEST-INSTRUMENTATION>
 
         # First part: make sure our object repository is neat & clean
@@ -753,6 +1059,8 @@ class VSphereCheck(AgentCheck):
         if self._should_cache(instance, MORLIST):
             self.log.debug("Caching MOR list for instance %s", self._instance_key(instance))
             self._cache_morlist_raw(instance)
+        else:
+            self._update_morlist(instance)
         self._cache_morlist_process(instance)
         self._vacuum_morlist(instance)
 
@@ -779,5 +1087,6 @@ class VSphereCheck(AgentCheck):
             set_external_tags(self.get_external_host_tags())
 
         # ## <TEST-INSTRUMENTATION>
-        self.gauge('datadog.agent.vsphere.queue_size', self.pool._workq.qsize(), tags=['instant:final'] + custom_tags)
+        self.gauge('datadog.agent.vsphere.queue_size', self.pool.qsize(), tags=['instant:final'] + custom_tags)
         # ## </TEST-INSTRUMENTATION>
+        self.pool.submit_stats(self, 'datadog.agent.vsphere.pool', tags=custom_tags)
@@ -0,0 +1,45 @@
+# (C) Datadog, Inc. 2018
+# All rights reserved
+# Licensed under Simplified BSD License (see LICENSE)
+from __future__ import unicode_literals
+
+import pytest
+from mock import MagicMock
+
+from datadog_checks.stubs import aggregator
+from datadog_checks.vsphere import VSphereCheck
+from .utils import MockedPerfManager, disable_thread_pool, mock_morlist
+
+VM_COUNT = 6000
+METRICS = ['cpu.usage', 'cpu.usagemhz', 'mem.active', 'mem.consumed', 'disk.read', 'disk.write']
+
+
+@pytest.fixture
+def instance():
+    return {'name': 'vsphere_mock', 'tags': ['foo:bar']}
+
+
+def large_vcenter(instance, max_query_metrics):
+    """
+    A check monitoring 6000 VMs through a mocked PerformanceManager counting the QueryPerf round trips
+    """
+    check = disable_thread_pool(VSphereCheck('vsphere', {'max_query_metrics': max_query_metrics}, {}, [instance]))
+    perf_manager = MockedPerfManager()
+    check._get_server_instance = MagicMock(return_value=MagicMock(content=MagicMock(perfManager=perf_manager)))
+    mock_morlist(check, instance, VM_COUNT, METRICS)
+    return check, perf_manager
+
+
+@pytest.mark.parametrize('max_query_metrics', [0, 64, 256])
+def test_collect_metrics(benchmark, instance, max_query_metrics):
+    check, perf_manager = large_vcenter(instance, max_query_metrics)
+
+    # don't let the submitted metrics pile up in the stub between rounds
+    benchmark.pedantic(check.collect_metrics, args=(instance,), setup=aggregator.reset, rounds=10)
+
+    round_trips = perf_manager.query_perf_calls / 10.0
+    benchmark.extra_info['query_perf_round_trips'] = round_trips
+    if max_query_metrics:
+        assert round_trips == -(-VM_COUNT * len(METRICS) // max_query_metrics)
+    else:
+        assert round_trips == VM_COUNT
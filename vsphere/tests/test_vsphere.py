@@ -3,15 +3,20 @@
 # Licensed under Simplified BSD License (see LICENSE)
 from __future__ import unicode_literals
 
+import threading
+import time
+
 import pytest
 import mock
 from mock import MagicMock
 
+from pyVmomi import vim
+
 from datadog_checks.vsphere import VSphereCheck
-from datadog_checks.vsphere.vsphere import MORLIST, INTERVAL, METRICS_METADATA
+from datadog_checks.vsphere.vsphere import MORLIST, INTERVAL, LAST, METRICS_METADATA
 from datadog_checks.vsphere.common import SOURCE_TYPE
-from .utils import assertMOR, MockedMOR
-from .utils import disable_thread_pool, get_mocked_server
+from .utils import assertMOR, MockedMOR, MockedPerfManager, MockedPropertyCollector
+from .utils import disable_thread_pool, get_mocked_server, mock_morlist
 
 
 @pytest.fixture
@@ -56,7 +61,7 @@ def test_init():
     check = VSphereCheck('vsphere', init_config, {}, [{'name': 'vsphere_foo'}])
     assert check.time_started > 0
     assert check.pool_started is False
-    assert len(check.jobs_status) == 0
+    assert check.job_timeout is None
     assert len(check.server_instances) == 0
     assert len(check.cache_times) == 1
     assert 'vsphere_foo' in check.cache_times
@@ -261,3 +266,193 @@ def test_service_check_ok(aggregator, instance):
         sc = aggregator.service_checks(VSphereCheck.SERVICE_CHECK_NAME)[0]
         assert sc.status == check.OK
         assert 'foo:bar' in sc.tags
+
+
+def test__batch_queries():
+    mors = [
+        {'mor': 'vm1', 'metrics': [1, 2, 3]},
+        {'mor': 'vm2', 'metrics': [1, 2, 3, 4, 5]},
+        {'mor': 'vm3', 'metrics': [1]},
+    ]
+    batches = VSphereCheck._batch_queries(mors, 4)
+
+    assert [[(mor['mor'], metrics) for mor, metrics in batch] for batch in batches] == [
+        [('vm1', [1, 2, 3]), ('vm2', [1])],
+        [('vm2', [2, 3, 4, 5])],
+        [('vm3', [1])],
+    ]
+    assert VSphereCheck._batch_queries([], 4) == []
+
+
+@pytest.mark.parametrize('max_query_metrics, query_perf_calls', [(0, 10), (64, 1), (12, 3), (2, 15)])
+def test_collect_metrics_batched(aggregator, instance, max_query_metrics, query_perf_calls):
+    check = disable_thread_pool(VSphereCheck('vsphere', {'max_query_metrics': max_query_metrics}, {}, [instance]))
+    perf_manager = MockedPerfManager()
+    check._get_server_instance = MagicMock(return_value=MagicMock(content=MagicMock(perfManager=perf_manager)))
+    mock_morlist(check, instance, 10, ['cpu.usage', 'mem.active', 'disk.read'])
+
+    check.collect_metrics(instance)
+
+    assert perf_manager.query_perf_calls == query_perf_calls
+    for i in range(10):
+        for metric in ['vsphere.cpu.usage', 'vsphere.mem.active', 'vsphere.disk.read']:
+            aggregator.assert_metric(metric, value=1, hostname='vm{}'.format(i), count=1)
+
+
+def get_mor(check, instance, hostname):
+    for mor in check.morlist[instance['name']].itervalues():
+        if mor['hostname'] == hostname:
+            return mor
+
+
+def test_incremental_discovery(instance):
+    """
+    Keep the MOR list up to date with the updates reported by a PropertyCollector
+    """
+    instance['incremental_discovery'] = True
+    check = disable_thread_pool(VSphereCheck('vsphere', {}, {}, [instance]))
+    server = get_mocked_server()
+    check._get_server_instance = MagicMock(return_value=server)
+    collector = server.content.propertyCollector.CreatePropertyCollector.return_value
+    view_manager = server.content.viewManager
+
+    check.check(instance)
+    assert check.cache_times['vsphere_mock'][MORLIST][INTERVAL] == 60 * 60
+    assert check.property_collectors['vsphere_mock'] is collector
+    assert check.update_versions['vsphere_mock'] == '1'
+    assert [prop_spec.pathSet for prop_spec in collector.filter_spec.propSet] == [
+        ['name'], ['name', 'runtime.powerState', 'runtime.host']
+    ]
+    assert {mor['hostname'] for mor in check.morlist['vsphere_mock'].itervalues()} == {
+        'vm1', 'vm2', 'vm4', 'host1', 'host2', 'host3', None
+    }
+    discovery_calls = view_manager.CreateContainerView.call_count
+
+    # a VM is removed
+    collector.push('leave', get_mor(check, instance, 'vm4')['mor'])
+    check.check(instance)
+    assert get_mor(check, instance, 'vm4') is None
+    assert check.update_versions['vsphere_mock'] == '2'
+
+    # a VM is added
+    host3 = get_mor(check, instance, 'host3')['mor']
+    vm5 = MockedMOR(spec='VirtualMachine', name='vm5', runtime=MockedMOR(powerState='poweredOn', host=host3))
+    vm5.parent = host3
+    collector.push('enter', vm5)
+    check.check(instance)
+    vm = get_mor(check, instance, 'vm5')
+    assert vm['mor'] is vm5
+    assert 'vsphere_host:host3' in vm['tags']
+
+    # a host is renamed, its VMs are tagged with its new name
+    host3.name = 'host3-renamed'
+    collector.push('modify', host3)
+    check.check(instance)
+    assert get_mor(check, instance, 'host3') is None
+    assert get_mor(check, instance, 'host3-renamed')['mor'] is host3
+    assert 'vsphere_host:host3' not in get_mor(check, instance, 'vm5')['tags']
+    assert 'vsphere_host:host3-renamed' in get_mor(check, instance, 'vm5')['tags']
+
+    # a VM is powered off
+    vm5.runtime.powerState = 'poweredOff'
+    collector.push('modify', vm5)
+    check.check(instance)
+    assert get_mor(check, instance, 'vm5') is None
+
+    # the inventory was never fully discovered again
+    assert view_manager.CreateContainerView.call_count == discovery_calls
+
+    # on failure, a full discovery is scheduled
+    collector.WaitForUpdatesEx = MagicMock(side_effect=Exception("connection reset"))
+    check.check(instance)
+    assert check.cache_times['vsphere_mock'][MORLIST][LAST] == 0
+    assert 'vsphere_mock' not in check.property_collectors
+
+    server.content.propertyCollector.CreatePropertyCollector.return_value = MockedPropertyCollector()
+    check.check(instance)
+    assert view_manager.CreateContainerView.call_count > discovery_calls
+    assert 'vsphere_mock' in check.property_collectors
+    assert get_mor(check, instance, 'vm4') is not None
+
+
+def test_incremental_discovery_failed_update(instance):
+    """
+    An update that can't be applied doesn't prevent applying the others nor collecting the metrics
+    """
+    instance['incremental_discovery'] = True
+    check = disable_thread_pool(VSphereCheck('vsphere', {}, {}, [instance]))
+    server = get_mocked_server()
+    check._get_server_instance = MagicMock(return_value=server)
+    collector = server.content.propertyCollector.CreatePropertyCollector.return_value
+    check.check(instance)
+
+    # vm2 is orphaned: it has no host anymore
+    vm2 = get_mor(check, instance, 'vm2')['mor']
+    vm2.runtime.host = None
+    collector.push('modify', vm2)
+    host3 = get_mor(check, instance, 'host3')['mor']
+    vm5 = MockedMOR(spec='VirtualMachine', name='vm5', runtime=MockedMOR(powerState='poweredOn', host=host3))
+    vm5.parent = host3
+    collector.push('enter', vm5)
+    check.collect_metrics = MagicMock()
+    check.check(instance)
+
+    assert get_mor(check, instance, 'vm2') is None
+    assert get_mor(check, instance, 'vm5')['mor'] is vm5
+    assert check.update_versions['vsphere_mock'] == '2'
+    check.collect_metrics.assert_called_once_with(instance)
+
+
+def test_clean_stuck_pool():
+    check = VSphereCheck('vsphere', {'job_timeout': 0.05}, {}, [{'name': 'vsphere_foo'}])
+    check.start_pool()
+    stuck_pool = check.pool
+    event = threading.Event()
+    try:
+        stuck_pool.apply_async(event.wait)
+        time.sleep(0.1)
+
+        start = time.time()
+        check._clean()
+        # the stuck job isn't waited for
+        assert time.time() - start < 1
+        assert check.pool is not stuck_pool
+        assert check.pool_started
+        assert check.pool.apply_async(sum, ([1, 2],)).get(1) == 3
+    finally:
+        event.set()
+        check.stop_pool()
+
+
+def test_available_metrics_cache(instance):
+    instance['incremental_discovery'] = True
+    check = VSphereCheck('vsphere', {}, {}, [instance])
+    perf_manager = MagicMock()
+    perf_manager.QueryAvailablePerfMetric.return_value = [
+        vim.PerformanceManager.MetricId(counterId=1, instance=''),
+        vim.PerformanceManager.MetricId(counterId=2, instance=''),
+        vim.PerformanceManager.MetricId(counterId=2, instance='vmnic0'),
+        vim.PerformanceManager.MetricId(counterId=3, instance='scsi0:0'),
+    ]
+
+    for i in range(10):
+        mor = {
+            'mor_type': 'vm', 'mor': MockedMOR(spec='VirtualMachine'), 'host': 'host-{}'.format(i % 2), 'interval': 20
+        }
+        metrics = check._get_available_metrics(instance, perf_manager, mor)
+        assert sorted((metric.counterId, metric.instance) for metric in metrics) == [(1, ''), (2, '*'), (3, '*')]
+
+    # queried once per host
+    assert perf_manager.QueryAvailablePerfMetric.call_count == 2
+
+    # the cache expires with the metrics metadata
+    check._get_server_instance = MagicMock(return_value=MagicMock(content=MagicMock(perfManager=perf_manager)))
+    check._cache_metrics_metadata(instance)
+    check._get_available_metrics(instance, perf_manager, mor)
+    assert perf_manager.QueryAvailablePerfMetric.call_count == 3
+
+    # every MOR is queried without incremental discovery
+    instance['incremental_discovery'] = False
+    check._get_available_metrics(instance, perf_manager, mor)
+    check._get_available_metrics(instance, perf_manager, mor)
+    assert perf_manager.QueryAvailablePerfMetric.call_count == 5
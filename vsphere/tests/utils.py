@@ -6,7 +6,7 @@ import json
 from datetime import datetime
 
 from mock import Mock, MagicMock
-from pyVmomi import vim
+from pyVmomi import vim, vmodl
 
 
 HERE = os.path.abspath(os.path.dirname(__file__))
@@ -41,7 +41,7 @@ class MockedContainer(Mock):
 
     def __init__(self, **kwargs):
         # Mocking
-        super(MockedContainer, self).__init__(**kwargs)
+        super(MockedContainer, self).__init__(spec=vim.view.ContainerView, **kwargs)
 
         self.topology = kwargs.get('topology')
         self.view_idx = 0
@@ -81,6 +81,58 @@ class MockedContainer(Mock):
         return view
 
 
+class MockedPerfManager(object):
+    """
+    Helper, a `PerformanceManager` answering every queried metric with the value 1 and
+    counting the QueryPerf round trips.
+    """
+    def __init__(self):
+        self.query_perf_calls = 0
+
+    def QueryPerf(self, querySpec):
+        self.query_perf_calls += 1
+        results = []
+        for spec in querySpec:
+            values = [
+                vim.PerformanceManager.IntSeries(id=metric_id, value=[1]) for metric_id in spec.metricId
+            ]
+            results.append(vim.PerformanceManager.EntityMetric(entity=spec.entity, value=values))
+        return results
+
+
+class MockedPropertyCollector(object):
+    """
+    Helper, a `PropertyCollector` reporting the object updates pushed with `push`.
+    """
+    def __init__(self):
+        self.version = 0
+        self.object_updates = []
+        self.filter_spec = None
+
+    def push(self, kind, obj):
+        self.object_updates.append(vmodl.query.PropertyCollector.ObjectUpdate(kind=kind, obj=obj))
+
+    def CreateFilter(self, spec, partialUpdates):
+        self.filter_spec = spec
+
+    def WaitForUpdatesEx(self, version, options):
+        # the first call always returns an update set, listing the initial state
+        if version and not self.object_updates:
+            return None
+
+        self.version += 1
+        update_set = vmodl.query.PropertyCollector.UpdateSet(
+            version=str(self.version),
+            filterSet=[vmodl.query.PropertyCollector.FilterUpdate(objectSet=self.object_updates)],
+            truncated=False
+        )
+        self.object_updates = []
+        return update_set
+
+    def Destroy(self):
+        pass
+
+
 def create_topology(topology_json):
     """
     Helper, recursively generate a vCenter topology from a JSON description.
@@ -192,6 +244,32 @@ def disable_thread_pool(check):
     return check
 
 
+def mock_morlist(check, instance, vm_count, metric_names):
+    """
+    Fill the MOR list and metrics metadata caches of the check with `vm_count` VMs
+    reporting the given metrics
+    """
+    i_key = instance['name']
+    check.metrics_metadata[i_key] = {
+        counter_id: {'name': name, 'unit': 'number'} for counter_id, name in enumerate(metric_names)
+    }
+    metrics = [
+        vim.PerformanceManager.MetricId(counterId=counter_id, instance='') for counter_id in range(len(metric_names))
+    ]
+    check.morlist[i_key] = {}
+    for i in range(vm_count):
+        name = 'vm{}'.format(i)
+        check.morlist[i_key][name] = {
+            'mor_type': 'vm',
+            'mor': MockedMOR(spec='VirtualMachine', name=name),
+            'hostname': name,
+            'tags': [],
+            'host': 'host',
+            'interval': 20,
+            'metrics': metrics,
+        }
+
+
 def get_mocked_server():
     """
     Return a mocked Server object
@@ -203,7 +281,10 @@ def get_mocked_server():
     viewmanager_mock = MagicMock(**{'CreateContainerView.return_value': view_mock})
     event_mock = MagicMock(createdTime=datetime.now())
     eventmanager_mock = MagicMock(latestEvent=event_mock)
-    content_mock = MagicMock(viewManager=viewmanager_mock, eventManager=eventmanager_mock)
+    propertycollector_mock = MagicMock(**{'CreatePropertyCollector.return_value': MockedPropertyCollector()})
+    content_mock = MagicMock(
+        viewManager=viewmanager_mock, eventManager=eventmanager_mock, propertyCollector=propertycollector_mock
+    )
     # assemble the mocked server
     server_mock = MagicMock()
     server_mock.configure_mock(**{